@@ -0,0 +1,220 @@
+"""
+End-to-end benchmark of process_comments against in-process fakes for the Graph API,
+the LLM and Google Sheets (see fakes.py). Nothing leaves the machine.
+
+    python benchmarks/bench_pipeline.py --posts 100 --comments-per-post 100
+    python benchmarks/bench_pipeline.py --posts 1000 --comments-per-post 1000 --graph-latency 0.05 --llm-latency 0.4
+    python benchmarks/bench_pipeline.py --posts 100 --comments-per-post 100 --compare benchmarks/results/<earlier>.json
+
+Rate limits are lifted unless --real-limits is given, so the numbers show what the
+pipeline itself can do. Each run is saved as JSON under --results-dir so later runs can be
+compared against it.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from unittest import mock
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from fakes import FakeGraph, FakeGspreadClient  # noqa: E402
+
+STAGES = ("check", "generate", "post", "log")
+# Fine buckets from 10us to ~60s so per-stage percentiles are accurate to a few percent
+STAGE_BUCKETS = tuple(0.00001 * 1.15 ** n for n in range(112))
+UNLIMITED = (10 ** 9, 10 ** 6)
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="replybot-bench-")
+    os.environ.update({
+        "REPLYBOT_DB_PATH": os.path.join(workdir, "bench.db"),
+        "LLM_BACKEND": "fake",
+        "GRAPH_API_BASE_URL": "http://fake-graph",
+    })
+    if not args.real_limits:
+        for name in ("gemini", "graph_read", "graph_write", "sheets_write"):
+            os.environ[f"RATE_LIMIT_{name.upper()}"] = f"{UNLIMITED[0]}:{UNLIMITED[1]}"
+
+    import main
+    import graph_api
+    import llm
+    import metrics
+    import sheets_writer
+
+    logging.getLogger().setLevel(args.log_level)
+    graph = FakeGraph(posts=args.posts, comments_per_post=args.comments_per_post, replied_ratio=args.replied_ratio,
+                      latency=args.graph_latency, distinct_messages=args.distinct_messages, seed=args.seed)
+    graph.mount(graph_api.get_session(), graph_api.GRAPH_API_BASE_URL)
+    sheets = FakeGspreadClient(latency=args.sheets_latency)
+    backend = llm.FakeBackend(latency=args.llm_latency)
+    llm.set_llm(backend)
+    metrics.stage_seconds = metrics.Histogram(
+        metrics.stage_seconds.name, metrics.stage_seconds.documentation, ["stage"], buckets=STAGE_BUCKETS
+    )
+
+    config = main.FacebookConfig(page_id=graph.page_id, access_token="bench-token")
+    rss_before = peak_rss_mb()
+    if args.tracemalloc:
+        tracemalloc.start()
+    with mock.patch.object(sheets_writer.gspread, "authorize", return_value=sheets), \
+            mock.patch.object(sheets_writer.service_account.Credentials, "from_service_account_info",
+                              return_value=object()):
+        started = time.perf_counter()
+        main.process_comments(config, "bench-sheet", {"type": "service_account", "bench": True}, "Replies",
+                              args.duration, job_id="bench")
+        seconds = time.perf_counter() - started
+    traced_peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024) if args.tracemalloc else None
+    if args.tracemalloc:
+        tracemalloc.stop()
+
+    states = main.comment_queue.stats(graph.page_id)["states"]
+    processed = states["replied"] + states["skipped"] + states["failed"]
+    sheet_calls = sheets.calls()
+    api_calls = {
+        "graph_http_requests": graph.calls["http_requests"],
+        "graph_batched_reads": graph.calls["batched_reads"],
+        "graph_reply_posts": graph.calls["reply_posts"],
+        "graph_reply_author_reads": graph.calls["reply_author_reads"],
+        "llm_calls": backend.calls,
+        "sheets_append_rows": sheet_calls["append_rows"],
+        "sheets_other": sum(sheet_calls.values()) - sheet_calls["append_rows"],
+    }
+    round_trips = api_calls["graph_http_requests"] + api_calls["llm_calls"] + sum(sheet_calls.values())
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("compare", "results_dir", "no_save")},
+        "results": {
+            "comments": graph.total_comments,
+            "processed": processed,
+            "states": states,
+            "replies": graph.calls["reply_posts"],
+            "sheet_rows": sheets.rows(),
+            "seconds": round(seconds, 3),
+            "comments_per_sec": round(processed / seconds, 1) if seconds else 0.0,
+            "api_calls": api_calls,
+            "api_calls_per_comment": round(round_trips / processed, 4) if processed else None,
+            "stages": {
+                stage: {
+                    "count": metrics.stage_seconds.count(stage=stage),
+                    "p50_ms": _ms(metrics.stage_seconds.quantile(0.5, stage=stage)),
+                    "p99_ms": _ms(metrics.stage_seconds.quantile(0.99, stage=stage)),
+                }
+                for stage in STAGES
+            },
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "rss_growth_mb": round(peak_rss_mb() - rss_before, 1),
+            "tracemalloc_peak_mb": round(traced_peak, 1) if traced_peak is not None else None,
+        },
+    }
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+
+# (path into results, higher is better)
+COMPARED = [
+    (("comments_per_sec",), True),
+    (("api_calls_per_comment",), False),
+    (("peak_rss_mb",), False),
+] + [(("stages", stage, quantile), False) for stage in STAGES for quantile in ("p50_ms", "p99_ms")]
+
+
+def _lookup(results: dict, path):
+    for key in path:
+        results = (results or {}).get(key)
+    return results
+
+
+def compare(current: dict, baseline: dict):
+    print(f"\nCompared with {baseline['revision']} ({baseline['timestamp']}):")
+    differing = sorted(key for key in current["config"] if current["config"][key] != baseline["config"].get(key))
+    if differing:
+        print(f"  Note: runs differ in {', '.join(differing)}; the numbers are not directly comparable")
+    for path, higher_is_better in COMPARED:
+        before, after = _lookup(baseline["results"], path), _lookup(current["results"], path)
+        if before is None or after is None:
+            continue
+        change = (after - before) / before * 100 if before else 0.0
+        better = change > 0 if higher_is_better else change < 0
+        verdict = "" if abs(change) < 5 else ("  better" if better else "  WORSE")
+        print(f"  {'.'.join(path):<24} {before:>12} -> {after:>12}  ({change:+.1f}%){verdict}")
+
+
+def report(result: dict):
+    results = result["results"]
+    print(f"{results['comments']} comments on {result['config']['posts']} posts, "
+          f"{results['processed']} processed in {results['seconds']}s")
+    print(f"  comments/sec:          {results['comments_per_sec']}")
+    print(f"  API calls per comment: {results['api_calls_per_comment']}  {results['api_calls']}")
+    print(f"  queue states:          {results['states']}")
+    for stage, stats in results["stages"].items():
+        print(f"  {stage:<8} n={stats['count']:<8} p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms")
+    print(f"  peak RSS: {results['peak_rss_mb']} MB (+{results['rss_growth_mb']} MB during the run)"
+          + (f", tracemalloc peak {results['tracemalloc_peak_mb']} MB" if results["tracemalloc_peak_mb"] else ""))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=100)
+    parser.add_argument("--comments-per-post", type=int, default=100)
+    parser.add_argument("--replied-ratio", type=float, default=0.1, help="Share of comments the page already answered")
+    parser.add_argument("--distinct-messages", type=int, default=5000, help="Distinct comment texts (reply cache hits)")
+    parser.add_argument("--graph-latency", type=float, default=0.0, help="Seconds added to every Graph request")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds added to every LLM call")
+    parser.add_argument("--sheets-latency", type=float, default=0.0, help="Seconds added to every Sheets call")
+    parser.add_argument("--duration", type=int, default=None, help="duration_seconds for the run (default: no limit)")
+    parser.add_argument("--real-limits", action="store_true", help="Keep the configured rate limits")
+    parser.add_argument("--tracemalloc", action="store_true", help="Also trace Python allocations (slow)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--results-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "results"))
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--compare", help="Earlier result file to compare against")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    result = run(args)
+    report(result)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(result, json.load(f))
+    if not args.no_save:
+        os.makedirs(args.results_dir, exist_ok=True)
+        path = os.path.join(args.results_dir, f"pipeline-{datetime.now():%Y%m%d-%H%M%S}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"\nSaved {path}")
+
+
+if __name__ == "__main__":
+    main()
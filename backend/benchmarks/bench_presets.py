@@ -0,0 +1,85 @@
+"""
+Micro-benchmark: indexed preset matcher vs the old linear scan.
+
+    python benchmarks/bench_presets.py --presets 5000 --comments 2000
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from presets import PresetIndex  # noqa: E402
+
+WORDS = [
+    "price", "delivery", "order", "dhaka", "size", "color", "available", "stock", "thanks", "good",
+    "product", "quality", "when", "how", "much", "cash", "bkash", "return", "policy", "discount",
+    "ধন্যবাদ", "দাম", "কত", "ডেলিভারি", "অর্ডার", "সাইজ", "আছে", "ভালো", "শুভ", "কামনা",
+]
+
+
+def linear_scan(presets, comment):
+    """The matcher as it was before the index, kept here as the baseline"""
+    comment = re.sub(r"[^\w\s]", "", comment).lower()
+    comment_words = set(comment.split())
+    for keyword, reply in presets.items():
+        clean_keyword = re.sub(r"[^\w\s]", "", keyword).lower()
+        keyword_words = set(clean_keyword.split())
+        if len(keyword_words) == 0:
+            continue
+        if len(keyword_words.intersection(comment_words)) / len(keyword_words) >= 0.75:
+            return reply
+    return None
+
+
+def make_presets(count, rng):
+    presets = {}
+    while len(presets) < count:
+        keyword = " ".join(rng.sample(WORDS, rng.randint(2, 4))) + f" {len(presets)}"
+        presets[keyword] = f"reply {len(presets)}"
+    return presets
+
+
+def make_comments(count, rng):
+    return [" ".join(rng.choices(WORDS, k=rng.randint(3, 15))) + "!" for _ in range(count)]
+
+
+def timed(func, comments):
+    started = time.perf_counter()
+    results = [func(comment) for comment in comments]
+    return time.perf_counter() - started, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--presets", type=int, default=2000)
+    parser.add_argument("--comments", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    presets = make_presets(args.presets, rng)
+    comments = make_comments(args.comments, rng)
+
+    started = time.perf_counter()
+    index = PresetIndex(presets)
+    build_seconds = time.perf_counter() - started
+
+    linear_seconds, linear_results = timed(lambda comment: linear_scan(presets, comment), comments)
+    indexed_seconds, indexed_results = timed(index.match, comments)
+    mismatches = sum(1 for a, b in zip(linear_results, indexed_results) if a != b)
+
+    print(f"presets={args.presets} comments={args.comments}")
+    print(f"index build:  {build_seconds * 1000:.1f} ms")
+    print(f"linear scan:  {linear_seconds * 1e6 / len(comments):.1f} us/comment")
+    print(f"indexed:      {indexed_seconds * 1e6 / len(comments):.1f} us/comment")
+    print(f"speedup:      {linear_seconds / indexed_seconds:.1f}x")
+    print(f"mismatches:   {mismatches}")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
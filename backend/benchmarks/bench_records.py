@@ -0,0 +1,131 @@
+"""
+Memory benchmark for crawled comments: the Post/Comment records (records.py) against the
+raw Graph API dicts and per-comment task dicts the crawl used to keep.
+
+    python benchmarks/bench_records.py --posts 100 --comments-per-post 1000
+
+Comment pages come from FakeGraph and are parsed from JSON page by page, like the crawl
+does. For each representation the benchmark holds every comment as a task (and, unless
+--no-derived, builds the derived strings the reply stages need) and reports what stays
+allocated, the tracemalloc peak and the build time.
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from fakes import FakeGraph  # noqa: E402
+from records import Comment, Post  # noqa: E402
+
+PAGE_SIZE = 100
+
+
+def graph_pages(graph: FakeGraph):
+    """(post JSON, comments page JSON) as the crawl receives them, one page at a time"""
+    for post_index in range(graph.posts):
+        post = json.dumps(graph.post(post_index))
+        for after in range(0, graph.comments_per_post, PAGE_SIZE):
+            yield post, json.dumps(graph.comments_page(post_index, after, PAGE_SIZE))
+
+
+def build_dicts(graph: FakeGraph, derived: bool):
+    tasks = []
+    for post_json, page_json in graph_pages(graph):
+        post = json.loads(post_json)
+        for comment in json.loads(page_json)["data"]:
+            replies = comment.pop("comments", None)
+            comment["reply_authors"] = [r["from"]["name"] for r in replies["data"]] if replies else []
+            task = {
+                "post_id": post["id"],
+                "post_message": post.get("message", "No post content"),
+                "post_permalink_url": post.get("permalink_url", "No URL"),
+                "post_time": post.get("created_time", "Unknown"),
+                "comment": comment
+            }
+            if derived:
+                commenter_id = comment.get("from", {}).get("id", "")
+                commenter_name = comment.get("from", {}).get("name", "Anonymous")
+                task.update({
+                    "full_comment_id": f"{graph.page_id}_{post['id'].split('_')[-1]}_{comment['id'].split('_')[-1]}",
+                    "comment_message": comment.get("message", "No comment message"),
+                    "comment_permalink_url": comment.get("permalink_url", "No comment URL"),
+                    "comment_time": comment.get("created_time", "Unknown"),
+                    "commenter_name": commenter_name,
+                    "commenter_profile_link": f"https://www.facebook.com/profile.php?id={commenter_id}"
+                    if commenter_id else commenter_name
+                })
+            tasks.append(task)
+    return tasks
+
+
+def build_records(graph: FakeGraph, derived: bool):
+    tasks = []
+    posts = {}
+    for post_json, page_json in graph_pages(graph):
+        data = json.loads(post_json)
+        post = posts.get(data["id"])
+        if post is None:
+            post = posts[data["id"]] = Post.from_graph(data)
+        for data in json.loads(page_json)["data"]:
+            comment = Comment.from_graph(data, post.id, graph.page_id)
+            if derived:
+                comment.full_id  # Built on first access, as the post stage does
+            tasks.append({"post": post, "comment": comment})
+    return tasks
+
+
+def measure(name: str, build, graph: FakeGraph, derived: bool) -> dict:
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    tasks = build(graph, derived)
+    seconds = time.perf_counter() - started
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    count = len(tasks)
+    del tasks
+    return {
+        "name": name,
+        "comments": count,
+        "retained_mb": retained / (1024 * 1024),
+        "peak_mb": peak / (1024 * 1024),
+        "bytes_per_comment": retained / count if count else 0,
+        "us_per_comment": seconds / count * 1e6 if count else 0,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=100)
+    parser.add_argument("--comments-per-post", type=int, default=1000)
+    parser.add_argument("--replied-ratio", type=float, default=0.1)
+    parser.add_argument("--no-derived", action="store_true",
+                        help="Leave out the derived fields (full comment ID, profile link) the check stage builds")
+    parser.add_argument("--seed", type=int, default=7)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    graph = FakeGraph(posts=args.posts, comments_per_post=args.comments_per_post,
+                      replied_ratio=args.replied_ratio, seed=args.seed)
+    derived = not args.no_derived
+    results = [measure("dicts", build_dicts, graph, derived), measure("records", build_records, graph, derived)]
+    print(f"{graph.total_comments} comments on {args.posts} posts{' with derived fields' if derived else ''}")
+    for result in results:
+        print(f"  {result['name']:<8} retained {result['retained_mb']:8.1f} MB  peak {result['peak_mb']:8.1f} MB  "
+              f"{result['bytes_per_comment']:7.0f} B/comment  {result['us_per_comment']:6.2f} us/comment")
+    dicts, records = results
+    if dicts["retained_mb"]:
+        print(f"  records retain {100 * (1 - records['retained_mb'] / dicts['retained_mb']):.0f}% less memory")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+In-process stand-ins for the Graph API and Google Sheets, used by the pipeline benchmark.
+
+FakeGraph answers the same requests Facebook would (page crawl with nested comments, feed
+paging, batch requests, reply posts) from a synthetic page generated on the fly, so even a
+page with a million comments costs no memory until the crawler asks for it. It is mounted
+on graph_api's shared requests session, so the real send() path with its retries, rate
+limits and stats runs unchanged.
+
+FakeGspreadClient implements the handful of gspread calls SheetWriter and
+load_existing_replies make.
+"""
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+import gspread
+import requests
+from requests.adapters import HTTPAdapter
+
+WORDS = [
+    "price", "delivery", "order", "dhaka", "size", "color", "available", "stock", "thanks", "good",
+    "product", "quality", "when", "how", "much", "cash", "bkash", "return", "policy", "discount",
+    "ধন্যবাদ", "দাম", "কত", "ডেলিভারি", "অর্ডার", "সাইজ", "আছে", "ভালো", "শুভ", "কামনা",
+]
+
+GRAPH_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S+0000"
+
+
+class FakeGraph:
+    """
+    A synthetic page: `posts` posts with `comments_per_post` comments each, newest first.
+    `replied_ratio` of the comments already carry a reply from the page and `latency`
+    seconds are added to every request. Call counts by category are kept in `calls`.
+    """
+
+    def __init__(self, page_id: str = "104857600", page_name: str = "Bench Page", posts: int = 100,
+                 comments_per_post: int = 100, replied_ratio: float = 0.1, latency: float = 0.0,
+                 distinct_messages: int = 5000, seed: int = 7):
+        self.page_id = page_id
+        self.page_name = page_name
+        self.posts = posts
+        self.comments_per_post = comments_per_post
+        self.replied_ratio = replied_ratio
+        self.latency = latency
+        self.seed = seed
+        rng = random.Random(seed)
+        self.messages = [" ".join(rng.choices(WORDS, k=rng.randint(3, 12))) for _ in range(max(1, distinct_messages))]
+        self.newest = datetime(2025, 6, 1)
+        self.base_url = "http://fake-graph"
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def total_comments(self) -> int:
+        return self.posts * self.comments_per_post
+
+    def count(self, category: str, amount: int = 1):
+        with self._lock:
+            self.calls[category] += amount
+
+    def post(self, index: int) -> Dict[str, Any]:
+        created = self.newest - timedelta(hours=index)
+        return {
+            "id": f"{self.page_id}_{index + 1}",
+            "message": f"Post {index + 1}: {self.messages[index % len(self.messages)]}",
+            "created_time": created.strftime(GRAPH_TIME_FORMAT),
+            "updated_time": (created + timedelta(minutes=30)).strftime(GRAPH_TIME_FORMAT),
+            "permalink_url": f"https://www.facebook.com/{self.page_id}/posts/{index + 1}"
+        }
+
+    def comment(self, post_index: int, index: int) -> Dict[str, Any]:
+        # Comment IDs are numeric like Facebook's, unique across posts
+        number = post_index * self.comments_per_post + index
+        # Hash the number so replied comments and messages are spread evenly but reproducibly
+        mixed = (number * 2654435761 + self.seed) % 2 ** 32
+        comment = {
+            "id": f"{post_index + 1}_{number + 1}",
+            "message": self.messages[mixed % len(self.messages)],
+            "created_time": (self.newest - timedelta(hours=post_index, seconds=index)).strftime(GRAPH_TIME_FORMAT),
+            "permalink_url": f"https://www.facebook.com/{self.page_id}/posts/{post_index + 1}?comment_id={number + 1}",
+            "from": {"id": str(100000 + mixed % 50000), "name": f"User {mixed % 50000}"}
+        }
+        if (mixed % 1000) < self.replied_ratio * 1000:
+            comment["comments"] = {"data": [{"from": {"name": self.page_name, "id": self.page_id}}]}
+        return comment
+
+    def _paging(self, path: str, after: int, limit: int, total: int, extra: str = "") -> Dict[str, Any]:
+        if after + limit >= total:
+            return {}
+        return {"paging": {"next": f"{self.base_url}/v22.0/{path}?after={after + limit}&limit={limit}{extra}"}}
+
+    def feed_page(self, after: int, limit: int, comment_limit: int) -> Dict[str, Any]:
+        posts = []
+        for index in range(after, min(after + limit, self.posts)):
+            post = self.post(index)
+            post["comments"] = self.comments_page(index, 0, comment_limit)
+            post["comments"]["summary"] = {"total_count": self.comments_per_post}
+            posts.append(post)
+        return {"data": posts, **self._paging(f"{self.page_id}/feed", after, limit, self.posts,
+                                              f"&comment_limit={comment_limit}")}
+
+    def comments_page(self, post_index: int, after: int, limit: int) -> Dict[str, Any]:
+        comments = [self.comment(post_index, index)
+                    for index in range(after, min(after + limit, self.comments_per_post))]
+        return {"data": comments, **self._paging(f"{self.page_id}_{post_index + 1}/comments", after, limit,
+                                                 self.comments_per_post)}
+
+    def route(self, method: str, path: str, query: Dict[str, List[str]], form: Dict[str, List[str]]) -> Any:
+        parts = [part for part in re.sub(r"^/v\d+\.\d+", "", path).split("/") if part]
+        arg = lambda name, default: int((query.get(name) or [default])[0])
+        if method == "POST" and not parts:
+            requests_ = json.loads(form["batch"][0])
+            self.count("batch_requests")
+            self.count("batched_reads", len(requests_))
+            answers = []
+            for request in requests_:
+                parsed = urlparse("/" + request["relative_url"])
+                body = self.route("GET", parsed.path, parse_qs(parsed.query), {})
+                answers.append({"code": 200, "body": json.dumps(body)})
+            return answers
+        if method == "POST" and parts[-1] == "comments":
+            self.count("reply_posts")
+            return {"id": f"{parts[0]}_reply"}
+        if parts == [self.page_id]:
+            self.count("page_reads")
+            fields = (query.get("fields") or [""])[0]
+            if "feed" not in fields:
+                return {"name": self.page_name, "id": self.page_id}
+            return {"name": self.page_name, "id": self.page_id,
+                    "feed": self.feed_page(0, _limit(fields, "feed", 25), _limit(fields, "comments.order", 100))}
+        if parts == [self.page_id, "feed"]:
+            self.count("feed_reads")
+            return self.feed_page(arg("after", 0), arg("limit", 25), arg("comment_limit", 100))
+        if len(parts) == 2 and parts[1] == "comments":
+            object_id = parts[0]
+            if object_id.startswith(f"{self.page_id}_"):
+                self.count("comment_reads")
+                post_index = int(object_id.split("_")[1]) - 1
+                return self.comments_page(post_index, arg("after", 0), arg("limit", 100))
+            self.count("reply_author_reads")
+            return {"data": []}
+        raise KeyError(f"FakeGraph has no route for {method} {path}")
+
+    def mount(self, session: requests.Session, base_url: Optional[str] = None):
+        """Answer every request the session sends to base_url"""
+        self.base_url = (base_url or self.base_url).rstrip("/")
+        session.mount(self.base_url, FakeGraphAdapter(self))
+
+
+def _limit(fields: str, prefix: str, default: int) -> int:
+    start = fields.find(prefix)
+    if start < 0:
+        return default
+    marker = fields.find(".limit(", start)
+    return int(fields[marker + 7:fields.index(")", marker)]) if marker >= 0 else default
+
+
+class FakeGraphAdapter(HTTPAdapter):
+    """Transport adapter that answers from a FakeGraph instead of opening a connection"""
+
+    def __init__(self, graph: FakeGraph):
+        super().__init__()
+        self.graph = graph
+
+    def send(self, request, **kwargs):
+        if self.graph.latency:
+            time.sleep(self.graph.latency)
+        parsed = urlparse(request.url)
+        body = request.body or ""
+        if isinstance(body, bytes):
+            body = body.decode("utf-8")
+        self.graph.count("http_requests")
+        payload = self.graph.route(request.method, parsed.path, parse_qs(parsed.query), parse_qs(body))
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps(payload).encode("utf-8")
+        response.headers["Content-Type"] = "application/json"
+        response.url = request.url
+        response.request = request
+        response.encoding = "utf-8"
+        return response
+
+
+class FakeWorksheet:
+    def __init__(self, title: str, latency: float = 0.0):
+        self.title = title
+        self.latency = latency
+        self.rows: List[List[Any]] = []
+        self.calls = Counter()
+
+    def _call(self, name: str):
+        self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def row_values(self, index: int) -> List[Any]:
+        self._call("row_values")
+        return list(self.rows[index - 1]) if len(self.rows) >= index else []
+
+    def insert_row(self, values: List[Any], index: int = 1):
+        self._call("insert_row")
+        self.rows.insert(index - 1, list(values))
+
+    def update(self, values: List[List[Any]]):
+        self._call("update")
+        self.rows[:len(values)] = [list(row) for row in values]
+
+    def append_rows(self, rows: List[List[Any]]):
+        self._call("append_rows")
+        self.rows.extend(list(row) for row in rows)
+
+    def get_all_values(self) -> List[List[Any]]:
+        self._call("get_all_values")
+        return [list(row) for row in self.rows]
+
+
+class FakeSpreadsheet:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.worksheets: Dict[str, FakeWorksheet] = {}
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        if title not in self.worksheets:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return self.worksheets[title]
+
+    def add_worksheet(self, title: str, rows: int = 1, cols: int = 1) -> FakeWorksheet:
+        worksheet = self.worksheets[title] = FakeWorksheet(title, self.latency)
+        return worksheet
+
+
+class FakeGspreadClient:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.spreadsheets: Dict[str, FakeSpreadsheet] = {}
+        self._lock = threading.Lock()
+
+    def open_by_key(self, key: str) -> FakeSpreadsheet:
+        with self._lock:
+            spreadsheet = self.spreadsheets.get(key)
+            if spreadsheet is None:
+                spreadsheet = self.spreadsheets[key] = FakeSpreadsheet(self.latency)
+            return spreadsheet
+
+    def calls(self) -> Counter:
+        total = Counter()
+        for spreadsheet in self.spreadsheets.values():
+            for worksheet in spreadsheet.worksheets.values():
+                total.update(worksheet.calls)
+        return total
+
+    def rows(self) -> int:
+        return sum(max(0, len(worksheet.rows) - 1)
+                   for spreadsheet in self.spreadsheets.values() for worksheet in spreadsheet.worksheets.values())
@@ -0,0 +1,185 @@
+import csv
+import io
+import json
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import storage
+
+IMPORT_CHUNK_SIZE = 1000
+
+
+def normalize_name(user_name: Optional[str]) -> Optional[str]:
+    if not user_name:
+        return None
+    return " ".join(user_name.split()).casefold() or None
+
+
+class Blacklist:
+    """
+    Blacklisted users kept in hash maps by user ID and by normalized name, so checking a
+    commenter is O(1) however long the list gets. Every change is written through to the
+    local SQLite store and the list is reloaded from it on startup. page_id "" is the
+    global list; any other page_id holds that page's own entries.
+    """
+
+    def __init__(self, page_id: str = ""):
+        self.page_id = page_id
+        self._lock = threading.Lock()
+        self._entries: Dict[int, Tuple[Optional[str], Optional[str]]] = {}
+        self._by_id: Dict[str, Set[int]] = {}
+        self._by_name: Dict[str, Set[int]] = {}
+        self._loaded = False
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            for entry_id, user_id, user_name in storage.load_blacklist(self.page_id):
+                self._index(entry_id, user_id, user_name)
+            self._loaded = True
+
+    def _index(self, entry_id: int, user_id: Optional[str], user_name: Optional[str]):
+        self._entries[entry_id] = (user_id, user_name)
+        if user_id:
+            self._by_id.setdefault(user_id, set()).add(entry_id)
+        name_key = normalize_name(user_name)
+        if name_key:
+            self._by_name.setdefault(name_key, set()).add(entry_id)
+
+    def _unindex(self, entry_id: int):
+        user_id, user_name = self._entries.pop(entry_id)
+        for table, key in ((self._by_id, user_id), (self._by_name, normalize_name(user_name))):
+            if key and key in table:
+                table[key].discard(entry_id)
+                if not table[key]:
+                    del table[key]
+
+    def _matches(self, user_id: Optional[str], user_name: Optional[str]) -> Set[int]:
+        found = set()
+        if user_id:
+            found |= self._by_id.get(user_id, set())
+        name_key = normalize_name(user_name)
+        if name_key:
+            found |= self._by_name.get(name_key, set())
+        return found
+
+    def contains(self, user_id: Optional[str], user_name: Optional[str]) -> bool:
+        with self._lock:
+            self._ensure_loaded()
+            return bool(self._matches(user_id, user_name))
+
+    def add(self, users: Iterable[Tuple[Optional[str], Optional[str]]]) -> int:
+        """Add (user_id, user_name) pairs that are not blacklisted yet by ID or name"""
+        added = 0
+        with self._lock:
+            self._ensure_loaded()
+            batch = []
+            batch_ids, batch_names = set(), set()
+            for user_id, user_name in users:
+                user_id = str(user_id).strip() if user_id not in (None, "") else None
+                user_name = user_name.strip() if user_name else None
+                name_key = normalize_name(user_name)
+                if not user_id and not name_key:
+                    continue
+                if self._matches(user_id, user_name) or (user_id and user_id in batch_ids) or \
+                   (name_key and name_key in batch_names):
+                    continue
+                batch.append((user_id, user_name))
+                batch_ids.add(user_id)
+                batch_names.add(name_key)
+                if len(batch) >= IMPORT_CHUNK_SIZE:
+                    added += self._store(batch)
+                    batch = []
+                    batch_ids, batch_names = set(), set()
+            added += self._store(batch)
+        return added
+
+    def _store(self, batch: List[Tuple[Optional[str], Optional[str]]]) -> int:
+        if not batch:
+            return 0
+        for entry_id, (user_id, user_name) in zip(storage.add_blacklist_entries(batch, self.page_id), batch):
+            self._index(entry_id, user_id, user_name)
+        return len(batch)
+
+    def remove(self, users: Iterable[Tuple[Optional[str], Optional[str]]]) -> int:
+        """Remove every entry matching any of the given user IDs or names"""
+        with self._lock:
+            self._ensure_loaded()
+            entry_ids = set()
+            for user_id, user_name in users:
+                entry_ids |= self._matches(user_id, user_name)
+            for entry_id in entry_ids:
+                self._unindex(entry_id)
+            storage.delete_blacklist_entries(list(entry_ids))
+            return len(entry_ids)
+
+    def clear(self) -> int:
+        with self._lock:
+            self._ensure_loaded()
+            count = len(self._entries)
+            self._entries.clear()
+            self._by_id.clear()
+            self._by_name.clear()
+            storage.clear_blacklist(self.page_id)
+            return count
+
+    def replace(self, users: Iterable[Tuple[Optional[str], Optional[str]]]) -> int:
+        self.clear()
+        return self.add(users)
+
+    def reload(self):
+        """Drop the in-memory maps so the next lookup reads the store again (changes from other processes)"""
+        with self._lock:
+            self._entries.clear()
+            self._by_id.clear()
+            self._by_name.clear()
+            self._loaded = False
+
+    def users(self) -> List[Dict[str, Optional[str]]]:
+        with self._lock:
+            self._ensure_loaded()
+            return [{"user_id": user_id, "user_name": user_name} for user_id, user_name in self._entries.values()]
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._ensure_loaded()
+            return len(self._entries)
+
+
+def parse_users(lines: Iterable[str], file_format: str) -> Iterator[Tuple[Optional[str], Optional[str]]]:
+    """
+    Stream (user_id, user_name) pairs from CSV (header with user_id and/or user_name)
+    or NDJSON ({"user_id": ..., "user_name": ...} per line) without loading the whole file
+    """
+    if file_format == "csv":
+        for row in csv.DictReader(lines):
+            yield row.get("user_id") or None, row.get("user_name") or None
+    elif file_format == "ndjson":
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError(f"expected a JSON object per line, got {line[:50]}")
+            yield record.get("user_id") or None, record.get("user_name") or None
+    else:
+        raise ValueError("format must be csv or ndjson")
+
+
+def export_users(users: Iterable[Dict[str, Optional[str]]], file_format: str) -> Iterator[str]:
+    if file_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(["user_id", "user_name"])
+        for user in users:
+            writer.writerow([user["user_id"] or "", user["user_name"] or ""])
+            if buffer.tell() > 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    elif file_format == "ndjson":
+        for user in users:
+            yield json.dumps(user, ensure_ascii=False) + "\n"
+    else:
+        raise ValueError("format must be csv or ndjson")
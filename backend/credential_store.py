@@ -0,0 +1,83 @@
+import copy
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+CREDENTIALS_PATH = os.getenv(
+    "REPLYBOT_CREDENTIALS_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "replybot.credentials.json")
+)
+
+# (section, field) of every secret in a daily job's settings
+SECRET_FIELDS = (("config", "access_token"), ("google_credentials", "credentials"))
+
+_lock = threading.Lock()
+
+
+def _read() -> Dict[str, Dict[str, Any]]:
+    try:
+        with open(CREDENTIALS_PATH, encoding="utf-8") as credentials_file:
+            return json.load(credentials_file)
+    except FileNotFoundError:
+        return {}
+
+
+def _write(data: Dict[str, Dict[str, Any]]):
+    # Written to a private temp file and renamed, so readers never see half a file and the
+    # secrets are never readable by other users, not even briefly
+    temp_path = f"{CREDENTIALS_PATH}.{os.getpid()}.tmp"
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as credentials_file:
+        json.dump(data, credentials_file)
+    os.replace(temp_path, CREDENTIALS_PATH)
+
+
+def save(ref: str, secrets: Dict[str, Any]):
+    with _lock:
+        data = _read()
+        data[ref] = secrets
+        _write(data)
+
+
+def load(ref: str) -> Dict[str, Any]:
+    with _lock:
+        return _read().get(ref, {})
+
+
+def delete(ref: str):
+    with _lock:
+        data = _read()
+        if data.pop(ref, None) is not None:
+            _write(data)
+
+
+def split_secrets(settings: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Split job settings into (settings without secrets, secrets keyed "section.field")"""
+    public = copy.deepcopy(settings)
+    secrets = {}
+    for section, field in SECRET_FIELDS:
+        if isinstance(public.get(section), dict) and field in public[section]:
+            secrets[f"{section}.{field}"] = public[section].pop(field)
+    return public, secrets
+
+
+def with_secrets(settings: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Settings with the secrets of their credentials_ref put back. Settings saved before
+    secrets were split out have no reference and already hold them.
+    """
+    ref = settings.get("credentials_ref")
+    if not ref:
+        return settings
+    secrets = load(ref)
+    if not secrets:
+        logger.error(f"No stored credentials for {ref}, see {CREDENTIALS_PATH}")
+    full = copy.deepcopy(settings)
+    for key, value in secrets.items():
+        section, field = key.split(".", 1)
+        full.setdefault(section, {})[field] = value
+    return full
@@ -0,0 +1,136 @@
+import logging
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+import metrics
+import storage
+from rate_limit import rate_limiter
+
+logger = logging.getLogger(__name__)
+
+
+def call_counts() -> Counter:
+    """External calls made so far in this process, by (service, endpoint)"""
+    return Counter(metrics.external_call_seconds.counts())
+
+
+class DryRun:
+    """
+    One shadow run of a page's reply job: crawl, checks and generation run for real, but
+    replies are recorded in the dry_run_replies table instead of being posted, and no
+    watermark, queue or replied-comment state moves, so the next real run sees the page
+    exactly as before. The run gets its own moderation window and an empty in-memory reply
+    cache, and stays out of the comment and reply metrics. Its external calls do count in
+    the shared call metrics (the report is built from them), as do its LLM and Graph calls
+    against the shared rate limits.
+
+    report() turns the run into the numbers needed to size a window: comments per second,
+    external calls by category and how many comments fit in duration_seconds once the
+    Graph write quota for the replies is taken into account. Call counts are process-wide,
+    so other jobs running at the same time inflate them.
+    """
+
+    def __init__(self, page_id: str, duration_seconds: Optional[int] = None, run_id: Optional[str] = None):
+        self.run_id = run_id or f"dry_{uuid.uuid4().hex[:12]}"
+        self.page_id = page_id
+        self.duration_seconds = duration_seconds
+        self.stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self.counts = Counter()  # would_reply plus llm_mode of each would-be reply
+        self.started = time.monotonic()
+        self.first_reply_seconds: Optional[float] = None
+        self._calls_before = call_counts()
+        self.report_data: Optional[Dict[str, Any]] = None
+        storage.start_dry_run(self.run_id, page_id)
+
+    def record(self, entry: Dict[str, Any], llm_mode: Optional[str]):
+        """Keep a reply the real run would have posted (entry keyed like the reply log)"""
+        storage.add_dry_run_reply(self.run_id, entry)
+        with self._lock:
+            self.counts["would_reply"] += 1
+            self.counts[f"llm_{llm_mode or 'unknown'}"] += 1
+            if self.first_reply_seconds is None:
+                self.first_reply_seconds = time.monotonic() - self.started
+
+    def api_calls(self) -> Dict[str, Dict[str, int]]:
+        """Calls made during the run, by service and endpoint"""
+        calls: Dict[str, Dict[str, int]] = {}
+        for (service, endpoint), count in (call_counts() - self._calls_before).items():
+            calls.setdefault(service, {})[endpoint] = count
+        return calls
+
+    def projection(self, processed: int, replies: int, seconds: float, drained: bool) -> Dict[str, Any]:
+        """
+        Comments that fit in duration_seconds. The dry run already waits on the LLM and
+        Graph read quotas; posting is the one step it skips, so the reply rate is capped
+        separately by the graph_write bucket.
+        """
+        if not self.duration_seconds or not seconds or not processed:
+            return {"duration_seconds": self.duration_seconds, "comments": None}
+        rate = processed / seconds
+        by_pipeline = rate * self.duration_seconds
+        write = rate_limiter.snapshot().get("graph_write", {})
+        reply_share = replies / processed
+        by_write_quota = None
+        if write and reply_share:
+            replies_allowed = write["burst"] + write["per_minute"] * self.duration_seconds / 60
+            by_write_quota = replies_allowed / reply_share
+        fits = min(by_pipeline, by_write_quota) if by_write_quota is not None else by_pipeline
+        return {
+            "duration_seconds": self.duration_seconds,
+            "comments": int(fits),
+            "replies": int(fits * reply_share),
+            "limited_by": "graph_write" if by_write_quota is not None and by_write_quota < by_pipeline else "pipeline",
+            "by_pipeline": int(by_pipeline),
+            "by_graph_write_quota": int(by_write_quota) if by_write_quota is not None else None,
+            # A drained run saw every new comment, so the window covers the whole backlog
+            "backlog_fits": drained and processed <= fits
+        }
+
+    def report(self, ended_by: str, stage_counts: Dict[str, Dict[str, int]]) -> Dict[str, Any]:
+        seconds = time.monotonic() - self.started
+        processed = stage_counts["check"]["in"]
+        with self._lock:
+            counts = dict(self.counts)
+        replies = counts.get("would_reply", 0)
+        calls = self.api_calls()
+        report = {
+            "run_id": self.run_id,
+            "page_id": self.page_id,
+            "finished_at": datetime.now().isoformat(timespec="seconds"),
+            "ended_by": ended_by,
+            "seconds": round(seconds, 3),
+            "comments_processed": processed,
+            "would_reply": replies,
+            "skipped": sum(stage["dropped"] for stage in stage_counts.values()),
+            "errors": sum(stage["errors"] for stage in stage_counts.values()),
+            "comments_per_second": round(processed / seconds, 2) if seconds else 0.0,
+            "first_reply_seconds": round(self.first_reply_seconds, 3) if self.first_reply_seconds is not None else None,
+            "reply_sources": {key[4:]: value for key, value in counts.items() if key.startswith("llm_")},
+            "api_calls": {
+                service: {"total": sum(endpoints.values()), "by_endpoint": endpoints}
+                for service, endpoints in sorted(calls.items())
+            },
+            "stage_counts": stage_counts,
+            "projection": self.projection(processed, replies, seconds, ended_by == "drained")
+        }
+        self.report_data = report
+        storage.finish_dry_run(self.run_id, report)
+
+        call_totals = ", ".join(f"{service} {stats['total']}" for service, stats in report["api_calls"].items())
+        logger.info(
+            f"Dry run {self.run_id} for page {self.page_id} ended ({ended_by}) after {report['seconds']}s: "
+            f"{processed} comments, {replies} would be replied, {report['comments_per_second']} comments/s; "
+            f"external calls: {call_totals or 'none'}"
+        )
+        projection = report["projection"]
+        if projection["comments"] is not None:
+            logger.info(
+                f"Dry run {self.run_id}: about {projection['comments']} comments ({projection['replies']} replies) "
+                f"fit in {self.duration_seconds}s, limited by {projection['limited_by']}"
+            )
+        return report
@@ -0,0 +1,248 @@
+import abc
+import asyncio
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import google.generativeai as genai
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# LLM_BACKEND=fake swaps Gemini for a canned local model, for tests and benchmarks only:
+# dry runs use the configured model, so their replies and timings are real
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+
+# two_call: separate offensiveness check and reply; single_call: one JSON answer carrying both
+REPLY_MODES = ("two_call", "single_call")
+SINGLE_CALL_MARKER = "Respond only with a JSON object"
+
+
+def generation_config_from_env() -> Dict[str, Any]:
+    config = {}
+    for key, env_name, cast in (
+        ("temperature", "GEMINI_TEMPERATURE", float),
+        ("top_p", "GEMINI_TOP_P", float),
+        ("top_k", "GEMINI_TOP_K", int),
+        ("max_output_tokens", "GEMINI_MAX_OUTPUT_TOKENS", int),
+    ):
+        value = os.getenv(env_name)
+        if value:
+            config[key] = cast(value)
+    return config
+
+
+class LLMBackend(abc.ABC):
+    """
+    Interface every model backend implements. Subclasses provide _generate;
+    generate() adds call and latency accounting on top. agenerate() is the coroutine
+    version; backends without a native async call run _generate on a worker thread.
+    """
+
+    name = "base"
+
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+
+    @abc.abstractmethod
+    def _generate(self, prompt: str) -> str:
+        """One completion of `prompt`"""
+
+    async def _agenerate(self, prompt: str) -> str:
+        return await asyncio.to_thread(self._generate, prompt)
+
+    def _record(self, started: float, failed: bool):
+        elapsed = time.monotonic() - started
+        with self._stats_lock:
+            self.calls += 1
+            self.errors += int(failed)
+            self.total_seconds += elapsed
+        metrics.observe_call("llm", self.name, elapsed, failed)
+
+    def generate(self, prompt: str) -> str:
+        started = time.monotonic()
+        failed = False
+        try:
+            return self._generate(prompt)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._record(started, failed)
+
+    async def agenerate(self, prompt: str) -> str:
+        started = time.monotonic()
+        failed = False
+        try:
+            return await self._agenerate(prompt)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._record(started, failed)
+
+    def describe(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                **self.describe(),
+                "calls": self.calls,
+                "errors": self.errors,
+                "total_seconds": round(self.total_seconds, 3),
+                "avg_seconds": round(self.total_seconds / self.calls, 3) if self.calls else 0.0
+            }
+
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+
+    def __init__(self, model_name: str = GEMINI_MODEL, generation_config: Optional[Dict[str, Any]] = None,
+                 api_key: Optional[str] = None):
+        super().__init__()
+        api_key = api_key or os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError("Gemini API key not found in environment variables")
+        self.model_name = model_name
+        self.generation_config = generation_config or {}
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model_name, generation_config=self.generation_config or None)
+
+    def _generate(self, prompt: str) -> str:
+        return self.model.generate_content(prompt).text
+
+    async def _agenerate(self, prompt: str) -> str:
+        return (await self.model.generate_content_async(prompt)).text
+
+    def describe(self) -> Dict[str, Any]:
+        return {"backend": self.name, "model": self.model_name, "generation_config": self.generation_config}
+
+
+class FakeBackend(LLMBackend):
+    """
+    Local stand-in for Gemini. Answers the offensiveness check with 'no' and everything
+    else with a fixed reply, unless a custom responder is supplied. `latency` simulates
+    model response time.
+    """
+
+    name = "fake"
+
+    def __init__(self, responder: Optional[Callable[[str], str]] = None, latency: float = 0.0):
+        super().__init__()
+        self.responder = responder or self.default_response
+        self.latency = latency
+
+    @staticmethod
+    def default_response(prompt: str) -> str:
+        if "Answer only with 'yes' or 'no'" in prompt:
+            return "no"
+        if SINGLE_CALL_MARKER in prompt:
+            return json.dumps({"offensive": False, "reply": "Thank you so much for your kind words!"})
+        return "Thank you so much for your kind words!"
+
+    def _generate(self, prompt: str) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        return self.responder(prompt)
+
+    async def _agenerate(self, prompt: str) -> str:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.responder(prompt)
+
+    def describe(self) -> Dict[str, Any]:
+        return {"backend": self.name, "latency": self.latency}
+
+
+def parse_moderated_reply(text: str) -> Optional[Tuple[bool, str]]:
+    """
+    Parse a single-call answer into (is_offensive, reply). Returns None when the model
+    did not return the JSON object we asked for, so the caller can fall back.
+    """
+    cleaned = re.sub(r"^```(?:json)?|```$", "", text.strip(), flags=re.IGNORECASE).strip()
+    match = re.search(r"\{.*\}", cleaned, re.DOTALL)
+    if not match:
+        return None
+    try:
+        data = json.loads(match.group(0))
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or "offensive" not in data:
+        return None
+    offensive = data["offensive"]
+    if isinstance(offensive, str):
+        offensive = offensive.strip().lower() in ("yes", "true")
+    reply = data.get("reply") or ""
+    if not isinstance(reply, str) or (not offensive and not reply.strip()):
+        return None
+    return bool(offensive), reply.strip()
+
+
+class ReplyModeStats:
+    """Per reply mode counts, LLM calls and latency so the modes can be compared"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def record(self, mode: str, llm_calls: int, seconds: float):
+        with self._lock:
+            entry = self._stats.setdefault(mode, {"comments": 0, "llm_calls": 0, "total_seconds": 0.0})
+            entry["comments"] += 1
+            entry["llm_calls"] += llm_calls
+            entry["total_seconds"] += seconds
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                mode: {
+                    "comments": entry["comments"],
+                    "llm_calls": entry["llm_calls"],
+                    "llm_calls_per_comment": round(entry["llm_calls"] / entry["comments"], 3),
+                    "avg_seconds_per_comment": round(entry["total_seconds"] / entry["comments"], 3)
+                }
+                for mode, entry in self._stats.items()
+            }
+
+
+reply_mode_stats = ReplyModeStats()
+
+_backend: Optional[LLMBackend] = None
+_backend_lock = threading.Lock()
+
+
+def build_backend() -> LLMBackend:
+    if LLM_BACKEND == "fake":
+        return FakeBackend(latency=float(os.getenv("FAKE_LLM_LATENCY", "0")))
+    return GeminiBackend(GEMINI_MODEL, generation_config_from_env())
+
+
+def get_llm() -> LLMBackend:
+    """
+    Return the shared model client, building it on first use. A failed build (e.g. a
+    missing API key) is not cached, so the next call tries again.
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = build_backend()
+                logger.info(f"Initialized LLM backend: {_backend.describe()}")
+    return _backend
+
+
+def set_llm(backend: Optional[LLMBackend]):
+    """Install a specific backend (e.g. a FakeBackend for benchmarks); None rebuilds from env"""
+    global _backend
+    with _backend_lock:
+        _backend = backend
@@ -1,32 +1,44 @@
-import time 
-from fastapi import FastAPI, HTTPException, Body
+import time
+from fastapi import FastAPI, File, HTTPException, Query, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-import requests
 import logging
-import google.generativeai as genai
 import os
 from typing import List, Optional, Dict, Any
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.interval import IntervalTrigger
-import re
-from fastapi import FastAPI, File, UploadFile
-from fastapi.responses import FileResponse
 from datetime import datetime, timedelta
 import gspread
-from google.oauth2 import service_account
 import json
-import tempfile
 from dotenv import load_dotenv
 import pytz
-
-
-# Add these new imports instead
+import csv
+import io
+import subprocess
+import sys
 import threading
-from datetime import datetime, timedelta
-import time
-
-
+import uuid
+from collections import OrderedDict
+
+import storage
+import credential_store
+import graph_api
+from graph_api import AsyncGraphAPIClient, GraphAPIClient, GraphAPIError
+from records import Comment, Post
+from reply_index import RepliedCommentIndex, comment_key
+from pipeline import Pipeline, Stage
+from rate_limit import rate_limiter
+import llm
+import metrics
+from moderation import LocalModerator
+from reply_cache import ReplyCache
+from sheets_writer import SHEET_HEADERS, sheet_writer
+from page_settings import GLOBAL_SCOPE, PageSettings
+from blacklist import export_users, parse_users
+from work_queue import CommentQueue
+from dry_run import DryRun
+from scheduler import JobScheduler, ScheduledJob
+from sharding import JOB_WORKER_METRICS_PORT, JOB_WORKER_PROCESSES, HashRing
+from webhooks import WebhookQueue, comment_events, verify_signature, verify_token
 
 app = FastAPI(title="Facebook Comment Reply Bot with Scheduler")
 
@@ -45,28 +57,26 @@ app.add_middleware(
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize scheduler
-scheduler = BackgroundScheduler()
-scheduler.start()
-
 # Global variables
-current_job = None
-is_running = False
-job_start_time = None  # Track when the job was started
-preset_replies = {
+default_preset_replies = {
     "hi there": "Hi there too!",
     "not so good": "We're sorry to hear that. Could you let us know what we can improve?",
     "how are you": "I'm doing well! How about you?",
     "rambunctious dinosaur": "That sounds like a wild dinosaur!",
     "শুভ কামনা রইলো": "Thank you!"
 }
-additional_instructions = ""
+# Instructions, presets and blacklists per page, falling back to the global ones
+page_settings = PageSettings(default_preset_replies)
+llm_reply_mode = os.getenv("LLM_REPLY_MODE", "two_call")  # See llm.REPLY_MODES
 
-blacklisted_users = []  # Store blacklisted user names and IDs
 
-# Add these new global variables instead
-active_jobs = {}  # Store recurring job info
-stop_flags = {}   # Control job stopping
+# Comments we already replied to or deliberately skipped; worker processes share the store
+replied_index = RepliedCommentIndex(shared_store=JOB_WORKER_PROCESSES > 0)
+moderator = LocalModerator()  # Local lexicon and spam-flood checks that run before the LLM
+reply_cache = ReplyCache()  # Generated replies for near-identical comments on the same post
+comment_queue = CommentQueue()  # Durable queue of comments still to handle, survives stops and restarts
+# Token buckets live in each process, so job worker processes and this one split every quota
+rate_limiter.set_shares(JOB_WORKER_PROCESSES + 1)
 
 # Update your request model
 
@@ -92,8 +102,8 @@ class GoogleCredentials(BaseModel):
 class AIReplyRequest(BaseModel):
     config: FacebookConfig
     interval_seconds: int
-    google_sheet_id: str
-    google_credentials: GoogleCredentials
+    google_sheet_id: Optional[str] = None
+    google_credentials: Optional[GoogleCredentials] = None
     stop_time_after: Optional[int] = None  # New field for auto-stop
 
 class AdditionalPromptConfig(BaseModel):
@@ -101,182 +111,142 @@ class AdditionalPromptConfig(BaseModel):
 
 class HeartbeatRequest(BaseModel):
     timestamp: str
-    
 
-def get_sheets_client(credentials_dict, temp_file=None):
-    try:
-        if temp_file is None:
-            temp_file = tempfile.NamedTemporaryFile(delete=False, mode='w+')
-            json.dump(credentials_dict, temp_file)
-            temp_file.flush()
-        
-        creds = service_account.Credentials.from_service_account_file(
-            temp_file.name, 
-            scopes=['https://www.googleapis.com/auth/spreadsheets']
-        )
-        client = gspread.authorize(creds)
-        return client, temp_file
-    except Exception as e:
-        logger.error(f"Error initializing Google Sheets client: {e}")
-        if temp_file:
-            try:
-                os.unlink(temp_file.name)
-            except:
-                pass
-        raise
+class LLMReplyModeConfig(BaseModel):
+    mode: str  # two_call or single_call
+
+class ModerationConfig(BaseModel):
+    blocked_terms: Optional[List[str]] = None  # A trailing * also matches longer words
+    safe_phrases: Optional[List[str]] = None
 
-def load_existing_replies(sheet_id: str, credentials_dict: dict, sheet_name: str) -> set:
-    temp_file = None
+class RateLimitConfig(BaseModel):
+    name: str  # gemini, graph_read, graph_write or sheets_write
+    per_minute: float
+    burst: int
+    
+
+def load_existing_replies(sheet_id: str, credentials_dict: dict, sheet_name: str, page_id: Optional[str] = None) -> set:
+    """
+    Comment IDs in the reply sheet. With page_id the rows are also imported into the local
+    reply log, so replies logged before the log existed can be queried there too.
+    """
     try:
-        client, temp_file = get_sheets_client(credentials_dict)
+        key = sheet_writer.register_credentials(credentials_dict)
+        client = sheet_writer.client(key)
         try:
             sheet = client.open_by_key(sheet_id).worksheet(sheet_name)
             values = sheet.get_all_values()
             if len(values) > 1:
                 comment_id_idx = values[0].index("Comment ID")
+                if page_id:
+                    imported = storage.add_reply_log_entries(
+                        sheet_log_entry(page_id, dict(zip(values[0], row))) for row in values[1:] if row[comment_id_idx]
+                    )
+                    logger.info(f"Imported {imported} replies from sheet '{sheet_name}' into the reply log")
                 return set(row[comment_id_idx] for row in values[1:])
             return set()
         except gspread.exceptions.WorksheetNotFound:
             spreadsheet = client.open_by_key(sheet_id)
             worksheet = spreadsheet.add_worksheet(title=sheet_name, rows=1, cols=11)
-            header = ["Post ID", "Post Content", "Post URL", "Post Time", "Comment ID", 
-                     "Comment Content", "Comment URL", "Comment Time", "Commenter Name", "Reply"]
-            worksheet.update([header])
+            worksheet.update([SHEET_HEADERS])
             return set()
     except Exception as e:
         logger.error(f"Error loading existing replies from Google Sheets: {e}")
         return set()
-    finally:
-        if temp_file:
-            try:
-                os.unlink(temp_file.name)
-            except:
-                pass
 
-def store_data_in_sheet(data: Dict[str, Any], sheet_id: str, credentials_dict: dict, sheet_name: str):
-    temp_file = None
-    try:
-        client, temp_file = get_sheets_client(credentials_dict)
-        spreadsheet = client.open_by_key(sheet_id)
-        
+def sheet_log_entry(page_id: str, row: Dict[str, str]) -> Dict[str, Any]:
+    """Reply log entry for a row of a reply sheet"""
+    return {
+        "page_id": page_id,
+        "comment_id": comment_key(row.get("Comment ID", "")),
+        "full_comment_id": row.get("Comment ID"),
+        "post_id": row.get("Post ID"),
+        "post_message": row.get("Post Content"),
+        "post_url": row.get("Post URL"),
+        "post_time": row.get("Post Time"),
+        "comment_message": row.get("Comment Content"),
+        "comment_url": row.get("Comment URL"),
+        "comment_time": row.get("Comment Time"),
+        "commenter_name": row.get("Commenter Name"),
+        "reply": row.get("Reply"),
+        "source": "sheet",
+        "replied_at": sheet_row_time(row)
+    }
+
+def sheet_row_time(row: Dict[str, str]) -> Optional[float]:
+    """
+    The sheet has no reply time, so imported rows take the comment's time (a reply never
+    predates its comment) rather than the import time; None falls back to now.
+    """
+    for column in ("Comment Time", "Post Time"):
         try:
-            sheet = spreadsheet.worksheet(sheet_name)
-            # Check if headers exist (first row is empty or doesn't match)
-            existing_headers = sheet.row_values(1)
-            expected_headers = ["Post ID", "Post Content", "Post URL", "Post Time", "Comment ID", 
-                              "Comment Content", "Comment URL", "Comment Time", "Commenter Name", "Reply"]
-            
-            if not existing_headers or existing_headers != expected_headers:
-                sheet.insert_row(expected_headers, index=1)
-                logger.info(f"Added headers to existing sheet '{sheet_name}'")
-                
-        except gspread.exceptions.WorksheetNotFound:
-            sheet = spreadsheet.add_worksheet(title=sheet_name, rows=1, cols=11)
-            header = ["Post ID", "Post Content", "Post URL", "Post Time", "Comment ID", 
-                     "Comment Content", "Comment URL", "Comment Time", "Commenter Name", "Reply"]
-            sheet.update([header])
-            logger.info(f"Created new sheet '{sheet_name}' with headers")
-
-        row = [
-            data.get("Post ID", ""),
-            data.get("Post Content", ""),
-            data.get("Post URL", ""),
-            data.get("Post Time", ""),
-            data.get("Comment ID", ""),
-            data.get("Comment Content", ""),
-            data.get("Comment URL", ""),
-            data.get("Comment Time", ""),
-            data.get("Commenter Name", ""),
-            data.get("Reply", "")
-        ]
-        sheet.append_row(row)
-        logger.info("Data stored in Google Sheets successfully.")
-    except Exception as e:
-        logger.error(f"Error storing data in Google Sheets: {e}")
-        raise
-    finally:
-        if temp_file:
-            try:
-                os.unlink(temp_file.name)
-            except:
-                pass
+            return datetime.strptime(row.get(column, ""), "%Y-%m-%dT%H:%M:%S%z").timestamp()
+        except ValueError:
+            continue
+    return None
 
+def sheet_link(sheet_id: Optional[str]) -> Optional[str]:
+    return f"https://docs.google.com/spreadsheets/d/{sheet_id}/edit" if sheet_id else None
 
+def store_data_in_sheet(data: Dict[str, Any], sheet_id: str, credentials_dict: dict, sheet_name: str):
+    """
+    Queue a reply row for the background sheet writer. The row is safe in the local
+    write-ahead buffer once this returns; it reaches Sheets with the next batched flush.
+    """
+    row = [data.get(header, "") for header in SHEET_HEADERS]
+    sheet_writer.enqueue(row, sheet_id, credentials_dict, sheet_name)
 
-def preset_replies_check(comment: str) -> Optional[str]:
-    global preset_replies
-    comment = re.sub(r"[^\w\s]", "", comment).lower()
-    comment_words = set(comment.split())
 
-    for keyword, reply in preset_replies.items():
-        clean_keyword = re.sub(r"[^\w\s]", "", keyword).lower()
-        keyword_words = set(clean_keyword.split())
-        if len(keyword_words) == 0:
-            continue  # Skip empty keywords to avoid division by zero
-        if len(keyword_words.intersection(comment_words)) / len(keyword_words) >= 0.75:
-            return reply
-    return None
+
+def preset_replies_check(comment: str, page_id: Optional[str] = None) -> Optional[str]:
+    # A preset matches when at least 75% of its keyword words appear in the comment
+    return page_settings.match_preset(comment, page_id)
+
 
 
+def blacklist_pairs(users: List[BlacklistUser]):
+    return [(user.user_id, user.user_name) for user in users]
 
 @app.post("/update-blacklisted-users")
-async def update_blacklisted_users(request: BlacklistRequest):
-    global blacklisted_users
-    
-    # Replace the entire blacklist with the new list
-    blacklisted_users = request.users
+def update_blacklisted_users(request: BlacklistRequest, page_id: Optional[str] = None):
+    # Replace the entire blacklist with the new list; page_id scopes it to one page
+    blacklist = page_settings.blacklist(page_id or GLOBAL_SCOPE)
+    count = blacklist.replace(blacklist_pairs(request.users))
     
     return {
         "status": "success", 
-        "message": f"Blacklist updated with {len(blacklisted_users)} users",
-        "blacklisted_users": blacklisted_users
+        "message": f"Blacklist updated with {count} users",
+        "blacklisted_users": blacklist.users()
     }
 
 @app.post("/add-blacklisted-users")
-async def add_blacklisted_users(request: BlacklistRequest):
-    global blacklisted_users
-    
-    # Add only users that aren't already in the blacklist
-    added_count = 0
-    for user in request.users:
-        # Check if this user is already in the blacklist
-        if not any((existing.user_id == user.user_id and user.user_id is not None) or 
-                  (existing.user_name == user.user_name and user.user_name is not None) 
-                  for existing in blacklisted_users):
-            blacklisted_users.append(user)
-            added_count += 1
+def add_blacklisted_users(request: BlacklistRequest, page_id: Optional[str] = None):
+    # Add only users that aren't already in the blacklist (matched by ID or name)
+    blacklist = page_settings.blacklist(page_id or GLOBAL_SCOPE)
+    added_count = blacklist.add(blacklist_pairs(request.users))
     
     return {
         "status": "success", 
         "message": f"Added {added_count} users to blacklist",
-        "blacklisted_users": blacklisted_users
+        "blacklisted_users": blacklist.users()
     }
 
 @app.post("/remove-blacklisted-users")
-async def remove_blacklisted_users(request: BlacklistRequest):
-    global blacklisted_users
-    
-    removed_count = 0
-    for user in request.users:
-        initial_count = len(blacklisted_users)
-        blacklisted_users = [u for u in blacklisted_users if 
-                            not ((user.user_id and u.user_id == user.user_id) or 
-                                (user.user_name and u.user_name == user.user_name))]
-        removed_count += initial_count - len(blacklisted_users)
+def remove_blacklisted_users(request: BlacklistRequest, page_id: Optional[str] = None):
+    blacklist = page_settings.blacklist(page_id or GLOBAL_SCOPE)
+    removed_count = blacklist.remove(blacklist_pairs(request.users))
     
     return {
         "status": "success", 
         "message": f"Removed {removed_count} users from blacklist",
-        "blacklisted_users": blacklisted_users
+        "blacklisted_users": blacklist.users()
     }
 
 @app.post("/clear-blacklist")
-async def clear_blacklist(request: BlacklistClearRequest):
-    global blacklisted_users
-    
+def clear_blacklist(request: BlacklistClearRequest, page_id: Optional[str] = None):
+    blacklist = page_settings.blacklist(page_id or GLOBAL_SCOPE)
     if request.clear_all:
-        count = len(blacklisted_users)
-        blacklisted_users = []
+        count = blacklist.clear()
         return {
             "status": "success", 
             "message": f"Cleared all {count} users from blacklist",
@@ -286,24 +256,64 @@ async def clear_blacklist(request: BlacklistClearRequest):
         return {
             "status": "error", 
             "message": "clear_all must be set to true to clear the blacklist",
-            "blacklisted_users": blacklisted_users
+            "blacklisted_users": blacklist.users()
         }
 
 @app.get("/get-blacklisted-users")
-async def get_blacklisted_users():
-    global blacklisted_users
-    return {"blacklisted_users": blacklisted_users}
+def get_blacklisted_users(page_id: Optional[str] = None):
+    return {"blacklisted_users": page_settings.blacklist(page_id or GLOBAL_SCOPE).users()}
+
+@app.post("/import-blacklisted-users")
+def import_blacklisted_users(file: UploadFile = File(...), format: Optional[str] = None, replace: bool = False,
+                            page_id: Optional[str] = None):
+    """
+    Bulk import from a CSV (user_id,user_name header) or NDJSON upload. The file is read
+    line by line, so lists with hundreds of thousands of users never sit in memory at once.
+    """
+    file_format = (format or os.path.splitext(file.filename or "")[1].lstrip(".")).lower()
+    if file_format == "jsonl":
+        file_format = "ndjson"
+    if file_format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+
+    blacklist = page_settings.blacklist(page_id or GLOBAL_SCOPE)
+    lines = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    try:
+        if replace:
+            blacklist.clear()
+        added_count = blacklist.add(parse_users(lines, file_format))
+    except (ValueError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid {file_format} file: {e}")
+    finally:
+        lines.detach()
+
+    return {
+        "status": "success",
+        "message": f"Imported {added_count} users to blacklist",
+        "total_blacklisted": len(blacklist)
+    }
+
+@app.get("/export-blacklisted-users")
+def export_blacklisted_users(format: str = "csv", page_id: Optional[str] = None):
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        export_users(page_settings.blacklist(page_id or GLOBAL_SCOPE).users(), format),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=blacklist.{format}"}
+    )
 
 
 @app.post("/set-additional-instructions")
-async def set_additional_instructions(prompt_config: AdditionalPromptConfig):
-    global additional_instructions
-    additional_instructions = prompt_config.additional_instructions
+def set_additional_instructions(prompt_config: AdditionalPromptConfig, page_id: Optional[str] = None):
+    # With page_id the instructions apply to that page only; empty text falls back to the global ones
+    page_settings.set_instructions(prompt_config.additional_instructions, page_id or GLOBAL_SCOPE)
     return {"status": "success", "message": "Additional instructions updated"}
 
 @app.get("/get-additional-instructions")
-async def get_additional_instructions():
-    return {"additional_instructions": additional_instructions}
+def get_additional_instructions(page_id: Optional[str] = None):
+    return {"additional_instructions": page_settings.instructions(page_id)}
 @app.get("/ping")
 @app.post("/ping")
 async def ping():
@@ -324,26 +334,97 @@ async def heartbeat(request: HeartbeatRequest):
     logger.info(f"Received heartbeat at {request.timestamp}")
     return {"status": "success", "message": "Heartbeat received", "server_time": datetime.now().isoformat()}
 
+FORBIDDEN_PHRASES = [
+    "since there is no post content",
+    "since there is no comment",
+    "cannot generate reply",
+    "not enough information",
+    "sorry i cannot",
+    "since there is no",
+    "instruction",
+    "reply",
+    "imran sharif",
+    "ইমরান শরীফ ",
+    "i am"
+]
+
+def build_reply_prompt(comment: str, post_message: Optional[str] = None, preset_reply: Optional[str] = None,
+                       page_id: Optional[str] = None) -> str:
+    is_bengali = any('\u0980' <= char <= '\u09FF' for char in comment)
+
+    if is_bengali:
+        comment_language="bengali"
+    else:
+        comment_language='others'
+
+    prompt = f"""
+        
+        আমার  Post:  {post_message}
+ person's Comment to my post: {comment}
+ Comment language:{comment_language}
+
+Now reply to that as me
+        """
+
+    additional_instructions = page_settings.instructions(page_id)
+    if additional_instructions:
+        prompt= f"\n\nAdditional Instructions:\n{additional_instructions}"+prompt
+    if preset_reply:
+        prompt=prompt+f"including {preset_reply} in the reply "
+    return prompt
+
+def build_single_call_prompt(comment: str, post_message: Optional[str] = None, preset_reply: Optional[str] = None,
+                             page_id: Optional[str] = None) -> str:
+    return build_reply_prompt(comment, post_message, preset_reply, page_id) + f"""
+
+        Before replying, decide if the comment is offensive, religiously sensitive, or aggressive
+        (hate speech, offensive language, religious insults, aggressive behavior, threats, or any
+        content that could be considered harmful).
+        {llm.SINGLE_CALL_MARKER} and nothing else, in this form:
+        {{"offensive": true or false, "reply": "your reply, or an empty string if offensive"}}
+        """
+
 def generate_ai_reply(comment: str, post_message: Optional[str] = None, 
                      preset_reply: Optional[str] = None, commenter_name: Optional[str] = None, 
-                     commenter_profile_link: Optional[str] = None) -> tuple:
+                     commenter_profile_link: Optional[str] = None, result_info: Optional[dict] = None,
+                     skip_classification: bool = False, page_id: Optional[str] = None) -> tuple:
+    """
+    Returns (reply, skip). skip_classification is set when the local moderator already
+    cleared the comment, so no LLM offensiveness check is needed.
+    Runs in llm_reply_mode: "two_call" classifies and then replies,
+    "single_call" asks for both in one JSON answer and falls back to two calls when the
+    answer cannot be parsed. The mode that actually ran, the number of LLM calls and the
+    time taken are recorded in llm.reply_mode_stats and copied into result_info if given.
+    """
+    started = time.monotonic()
+    mode = llm_reply_mode
+    llm_calls = 0
+    outcome = "error"
     try:
-        time.sleep(2)
-        gemini_api_key = os.getenv("GEMINI_API_KEY")
-        if not gemini_api_key:
-            raise ValueError("Gemini API key not found in environment variables")
-            
-        genai.configure(api_key=gemini_api_key)
-        model = genai.GenerativeModel('gemini-2.0-flash')
-        is_bengali = any('\u0980' <= char <= '\u09FF' for char in comment)
-
-        if is_bengali:
-            comment_language="bengali"
+        model = llm.get_llm()
+        verdict = None
+
+        if skip_classification:
+            mode = "reply_only"
+        elif mode == "single_call":
+            rate_limiter.acquire("gemini")
+            llm_calls += 1
+            verdict = llm.parse_moderated_reply(
+                model.generate(build_single_call_prompt(comment, post_message, preset_reply, page_id))
+            )
+            if verdict is None:
+                logger.info("Could not parse single-call LLM response, falling back to two calls")
+                mode = "single_call_fallback"
+
+        if verdict is not None:
+            is_offensive, ai_reply = verdict
+            if is_offensive:
+                outcome = "offensive"
+                return "", True
         else:
-            comment_language='others'
-            
-        # First, check if the comment is offensive or sensitive
-        classification_prompt = f"""
+            if not skip_classification:
+                # First, check if the comment is offensive or sensitive
+                classification_prompt = f"""
         Analyze this comment and determine if it is offensive, religiously sensitive, or aggressive.
         Comment: {comment}
         
@@ -351,158 +432,249 @@ def generate_ai_reply(comment: str, post_message: Optional[str] = None,
         If the comment contains hate speech, offensive language, religious insults, aggressive behavior, 
         threats, or any content that could be considered harmful, answer 'yes'.
         """
-        
-        classification_response = model.generate_content(classification_prompt)
-        is_offensive = "yes" in classification_response.text.strip().lower()
-        
-        if is_offensive:
-            return "", True  # Return empty reply and flag as offensive
-            
-        prompt = f"""
-        
-        আমার  Post:  {post_message}
- person's Comment to my post: {comment}
- Comment language:{comment_language}
+                
+                rate_limiter.acquire("gemini")
+                llm_calls += 1
+                classification_response = model.generate(classification_prompt)
+                is_offensive = "yes" in classification_response.strip().lower()
+                
+                if is_offensive:
+                    outcome = "offensive"
+                    return "", True  # Return empty reply and flag as offensive
 
-Now reply to that as me
-        """
+            rate_limiter.acquire("gemini")
+            llm_calls += 1
+            ai_reply = model.generate(build_reply_prompt(comment, post_message, preset_reply, page_id)).strip()
 
-        if additional_instructions:
-            prompt= f"\n\nAdditional Instructions:\n{additional_instructions}"+prompt
-        if preset_reply:
-            prompt=prompt+f"including {preset_reply} in the reply "
-        time.sleep(2)
-        response = model.generate_content(prompt)
-        forbidden_phrases = [
-                        "since there is no post content",
-                        "since there is no comment",
-                        "cannot generate reply",
-                        "not enough information",
-                        "sorry i cannot",
-                        "since there is no",
-                        "instruction",
-                        "reply",
-                        "imran sharif",
-                        "ইমরান শরীফ ",
-                        "i am"
-                    ]
-        ai_reply = response.text.strip()
         # Check if the AI generated a generic useless reply
-        for forbidden_phrase in forbidden_phrases:     
+        for forbidden_phrase in FORBIDDEN_PHRASES:     
             if forbidden_phrase in ai_reply.lower():
                 logger.info(f"AI generated a generic reply, skipping. Detected phrase: {forbidden_phrase}")
+                outcome = "forbidden_phrase"
                 return "", True  # Treat as offensive (skip replying)
 
-        return response.text.strip(), False  # Return reply and flag as not offensive
+        outcome = "reply"
+        return ai_reply, False  # Return reply and flag as not offensive
     except Exception as e:
         logger.error(f"AI reply generation failed: {e}")
         return "", True  # Return empty reply and flag as offensive so no reply if ai fail
         # return "Thank you for your comment", False
+    finally:
+        elapsed = time.monotonic() - started
+        llm.reply_mode_stats.record(mode, llm_calls, elapsed)
+        if result_info is not None:
+            result_info.update({
+                "llm_mode": mode,
+                "llm_calls": llm_calls,
+                "llm_seconds": round(elapsed, 3),
+                "llm_outcome": outcome
+            })
 
 @app.post("/add-preset-reply")
-def add_preset_reply(preset_data: dict):
+def add_preset_reply(preset_data: dict, page_id: Optional[str] = None):
     if not preset_data:
         raise HTTPException(status_code=400, detail="No preset data provided")
 
-    global preset_replies
-    updated_keys = []
-    new_keys = []
-
     for key, reply in preset_data.items():
         if not key or not reply:
             raise HTTPException(status_code=400, detail="Empty key or reply detected")
-            
-        if key in preset_replies:
-            updated_keys.append(key)
-        else:
-            new_keys.append(key)
-            
-        preset_replies[key] = reply
+
+    # With page_id the presets apply to that page only, ahead of the global ones
+    new_keys, updated_keys = page_settings.set_presets(preset_data, page_id or GLOBAL_SCOPE)
 
     logger.info(f"Added {len(new_keys)} new preset replies and updated {len(updated_keys)} existing ones")
     return {
         "status": "Success",
         "added": new_keys,
         "updated": updated_keys,
-        "total_presets": len(preset_replies)
+        "total_presets": len(page_settings.presets(page_id or GLOBAL_SCOPE))
     }
 
+@app.get("/get-preset-replies")
+def get_preset_replies(page_id: Optional[str] = None):
+    return {"preset_replies": page_settings.presets(page_id or GLOBAL_SCOPE)}
+
+@app.get("/page-settings")
+def get_page_settings():
+    """Pages that have instructions, presets or a blacklist of their own"""
+    return {"pages": page_settings.scopes()}
+
 @app.get("/get-sheet-link/{sheet_id}")
 async def get_sheet_link(sheet_id: str):
     return {"sheet_link": f"https://docs.google.com/spreadsheets/d/{sheet_id}/edit"}
 
-def get_facebook_posts(page_id: str, access_token: str) -> List[Dict[str, Any]]:
-    url = f"https://graph.facebook.com/v22.0/{page_id}/feed"
-    params = {"access_token": access_token, "fields": "id,message,created_time,permalink_url"}
-    posts = []
-    
-    while url:
-        try:
-            response = requests.get(url, params=params)
-            response.raise_for_status()
-            data = response.json()
-            posts.extend(data.get('data', []))
-            url = data.get('paging', {}).get('next', None)
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error fetching posts: {e}")
-            raise HTTPException(status_code=500, detail=f"Failed to fetch posts: {str(e)}")
-
-    posts.sort(key=lambda x: x.get('created_time', ''), reverse=True)
-    return posts
-
-def get_facebook_comments(post_id: str, access_token: str) -> List[Dict[str, Any]]:
-    url = f"https://graph.facebook.com/v22.0/{post_id}/comments"
-    params = {"access_token": access_token, "fields": "id,message,created_time,permalink_url,from"}
-    comments = []
-    
-    while url:
-        try:
-            response = requests.get(url, params=params)
-            response.raise_for_status()
-            data = response.json()
-            comments.extend(data.get('data', []))
-            url = data.get('paging', {}).get('next', None)
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error fetching comments: {e}")
-            raise HTTPException(status_code=500, detail=f"Failed to fetch comments: {str(e)}")
-
-    comments.sort(key=lambda x: x.get('created_time', ''), reverse=True)
-    return comments
+@app.get("/sheet-writer-stats")
+def get_sheet_writer_stats():
+    return {"sheet_writer": sheet_writer.stats()}
+
+@app.on_event("shutdown")
+def flush_sheet_writer():
+    sheet_writer.flush()
+
+@app.get("/reply-cache-stats")
+def get_reply_cache_stats():
+    return {"reply_cache": reply_cache.stats()}
+
+@app.post("/clear-reply-cache")
+def clear_reply_cache():
+    reply_cache.clear()
+    return {"status": "success", "message": "Reply cache cleared"}
+
+@app.get("/moderation-stats")
+def get_moderation_stats():
+    return {"moderation": moderator.stats()}
+
+@app.post("/update-moderation-config")
+def update_moderation_config(moderation_config: ModerationConfig):
+    blocked_terms = moderation_config.blocked_terms
+    safe_phrases = moderation_config.safe_phrases
+    moderator.configure(
+        blocked_terms if blocked_terms is not None else moderator.matcher.terms,
+        safe_phrases if safe_phrases is not None else moderator.safe_phrases
+    )
+    return {"status": "success", "moderation": moderator.stats()}
 
-def post_facebook_reply(access_token: str, full_comment_id: str, reply_text: str):
-    url = f"https://graph.facebook.com/v22.0/{full_comment_id}/comments"
-    params = {"access_token": access_token, "message": reply_text}
+@app.get("/rate-limits")
+def get_rate_limits():
+    return {"rate_limits": rate_limiter.snapshot()}
+
+@app.post("/update-rate-limit")
+def update_rate_limit(limit: RateLimitConfig):
+    if limit.per_minute <= 0 or limit.burst < 1:
+        raise HTTPException(status_code=400, detail="per_minute must be positive and burst at least 1")
+    try:
+        rate_limiter.save(limit.name, limit.per_minute, limit.burst)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"status": "success", "rate_limit": rate_limiter.snapshot()[limit.name]}
+
+@app.get("/llm-stats")
+def get_llm_stats():
+    try:
+        backend_stats = llm.get_llm().stats()
+        error = None
+    except Exception as e:
+        backend_stats, error = None, str(e)
+    return {
+        "llm": backend_stats,
+        "error": error,
+        "reply_mode": llm_reply_mode,
+        "reply_modes": llm.reply_mode_stats.snapshot()
+    }
+
+@app.post("/set-llm-reply-mode")
+def set_llm_reply_mode(mode_config: LLMReplyModeConfig):
+    global llm_reply_mode
+    if mode_config.mode not in llm.REPLY_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(llm.REPLY_MODES)}")
+    llm_reply_mode = mode_config.mode
+    return {"status": "success", "message": f"LLM reply mode set to {llm_reply_mode}"}
+
+@app.get("/metrics")
+def get_metrics():
+    """
+    Counters and histograms in the Prometheus text format. With JOB_WORKER_PROCESSES set,
+    daily runs happen in the worker processes, which serve their own metrics on
+    JOB_WORKER_METRICS_PORT + shard.
+    """
+    return PlainTextResponse(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/graph-api-stats")
+def get_graph_api_stats():
+    return {"endpoints": graph_api.api_stats.snapshot(), "usage": graph_api.usage_throttle.snapshot()}
 
+@app.get("/crawl-state/{page_id}")
+def get_crawl_state(page_id: str):
+    post_watermarks = storage.get_post_watermarks(page_id)
+    return {
+        "page_id": page_id,
+        "page_watermark": storage.get_page_watermark(page_id),
+        "tracked_posts": len(post_watermarks),
+        "indexed_comments": replied_index.size(page_id)
+    }
+
+@app.post("/reset-crawl-state/{page_id}")
+def reset_crawl_state(page_id: str):
+    """
+    Forget the watermarks for a page so the next run re-scans every post after the cutoff
+    """
+    storage.clear_watermarks(page_id)
+    return {"status": "success", "message": f"Crawl state cleared for page {page_id}"}
+
+@app.get("/work-queue-stats")
+def get_work_queue_stats(page_id: Optional[str] = None):
+    """Queue depth and task states, for one page or across all pages"""
+    return comment_queue.stats(page_id)
+
+@app.post("/requeue-failed-comments/{page_id}")
+def requeue_failed_comments(page_id: str):
+    """Give comments that ran out of retry attempts another round on the next run"""
+    requeued = comment_queue.requeue_failed(page_id)
+    return {"status": "success", "message": f"Requeued {requeued} failed comments for page {page_id}"}
+
+def parse_log_time(value: Optional[str], name: str) -> Optional[float]:
+    if not value:
+        return None
     try:
-        response = requests.post(url, params=params)
-        response.raise_for_status()
-        logger.info(f"Reply posted successfully: {response.json()}")
-        return response.json()
-    except requests.exceptions.RequestException as e:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be an ISO date or datetime, e.g. 2025-05-01T10:00")
+
+def reply_log_row(entry: Dict[str, Any]) -> Dict[str, Any]:
+    return {**entry, "replied_at": datetime.fromtimestamp(entry["replied_at"]).isoformat(timespec="seconds")}
+
+@app.get("/reply-log/{page_id}")
+def get_reply_log(page_id: str, post_id: Optional[str] = None, commenter: Optional[str] = None,
+                  since: Optional[str] = None, until: Optional[str] = None, cursor: Optional[int] = None,
+                  limit: int = Query(50, ge=1, le=500)):
+    """
+    Replies posted on the page, newest first. commenter is a user ID or name; since and
+    until bound the reply time. Pass next_cursor back as cursor for the following page.
+    """
+    since_ts, until_ts = parse_log_time(since, "since"), parse_log_time(until, "until")
+    entries = storage.query_reply_log(page_id, post_id, commenter, since_ts, until_ts, cursor, limit)
+    return {
+        "status": "success",
+        "replies": [reply_log_row(entry) for entry in entries],
+        "count": len(entries),
+        "next_cursor": entries[-1]["id"] if len(entries) == limit else None
+    }
+
+@app.get("/reply-log/{page_id}/{comment_id}")
+def get_reply_log_entry(page_id: str, comment_id: str):
+    entry = storage.get_reply_log_entry(page_id, comment_key(comment_id))
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"No reply logged for comment {comment_id}")
+    return {"status": "success", "reply": reply_log_row(entry)}
+
+@app.get("/reply-log-stats/{page_id}")
+def get_reply_log_stats(page_id: str, since: Optional[str] = None, until: Optional[str] = None):
+    since_ts, until_ts = parse_log_time(since, "since"), parse_log_time(until, "until")
+    day_ago = time.time() - 86400
+    return {
+        "status": "success",
+        "page_id": page_id,
+        "replies": storage.count_reply_log(page_id, since=since_ts, until=until_ts),
+        "replies_last_24h": storage.count_reply_log(page_id, since=day_ago),
+        "top_posts": [
+            {"post_id": post_id, "replies": replies} for post_id, replies in storage.reply_log_post_counts(page_id)
+        ]
+    }
+
+def post_facebook_reply(access_token: str, full_comment_id: str, reply_text: str):
+    try:
+        result = GraphAPIClient(access_token).post(f"{full_comment_id}/comments", {"message": reply_text})
+        logger.info(f"Reply posted successfully: {result}")
+        return result
+    except GraphAPIError as e:
         logger.error(f"Error posting reply: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to post reply: {str(e)}")
     
-def get_page_name(page_id, access_token):
-    url = f"https://graph.facebook.com/v12.0/{page_id}"
-    params = {'fields': 'name', 'access_token': access_token}
-    response = requests.get(url, params=params)
-    if response.status_code == 200:
-        return response.json().get('name', '[Unknown]')
-    else:
-        print(f"Error fetching page name: {response.json()}")
-        return None
-
 def get_replier_names(full_comment_id, access_token):
-    url = f"https://graph.facebook.com/v12.0/{full_comment_id}/comments"
-    params = {'fields': 'from', 'access_token': access_token}
-    response = requests.get(url, params=params)
-    if response.status_code == 200:
-        replies = response.json().get('data', [])
-        if replies:
-            return [reply.get('from', {}).get('name', '[Unknown]') for reply in replies]
-        return []
-    else:
-        print(f"Error fetching replies: {response.status_code} - {response.json()}")
+    try:
+        return GraphAPIClient(access_token).get_reply_authors(full_comment_id)
+    except GraphAPIError as e:
+        logger.error(f"Error fetching replies: {e}")
         return 'error'
 
 
@@ -511,8 +683,9 @@ def get_replier_names(full_comment_id, access_token):
 # Update your request model
 class AIReplyRequest(BaseModel):
     config: FacebookConfig
-    google_sheet_id: str
-    google_credentials: GoogleCredentials
+    # Replies are always kept in the local reply log; a sheet, when given, gets a copy
+    google_sheet_id: Optional[str] = None
+    google_credentials: Optional[GoogleCredentials] = None
     start_time: str  # Time in HH:MM format (24-hour)
     duration_seconds: int  # How long to run each day
 
@@ -552,254 +725,502 @@ def calculate_seconds_until_dhaka_time(target_time_dhaka):
     time_diff = target_time_dhaka - now_dhaka
     return int(time_diff.total_seconds())
 
+# Worker threads per stage of the reply pipeline; generation and posting are I/O bound
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "50"))
+PIPELINE_WORKERS = {
+    "check": int(os.getenv("PIPELINE_CHECK_WORKERS", "2")),
+    "generate": int(os.getenv("PIPELINE_GENERATE_WORKERS", "4")),
+    "post": int(os.getenv("PIPELINE_POST_WORKERS", "2")),
+    "log": int(os.getenv("PIPELINE_LOG_WORKERS", "1")),
+}
+
+def reply_job(config: FacebookConfig, sheet_id: str, credentials_dict: dict, sheet_name: str, page_name: Optional[str],
+              job_id: str = "manual", dry_run: Optional[DryRun] = None) -> Dict[str, Any]:
+    """
+    Everything the reply stages need to know about the page a comment belongs to. A dry run
+    gets its own moderation window and reply cache, so it leaves the shared ones untouched.
+    """
+    job_moderator, job_cache = moderator, reply_cache
+    if dry_run:
+        job_moderator = LocalModerator(moderator.matcher.terms, moderator.safe_phrases)
+        job_cache = ReplyCache(persist=False)
+    return {
+        "job_id": job_id,
+        "page_id": config.page_id,
+        "access_token": config.access_token,
+        "page_name": page_name,
+        "sheet_id": sheet_id,
+        "credentials_dict": credentials_dict,
+        "sheet_name": sheet_name,
+        "dry_run": dry_run,
+        "moderator": job_moderator,
+        "reply_cache": job_cache
+    }
+
+def count_skipped(job: Dict[str, Any], reason: str):
+    # Live metrics only describe real runs
+    if not job["dry_run"]:
+        metrics.comments_skipped.inc(page_id=job["page_id"], reason=reason)
+
+def check_comment(task):
+    job = task["job"]
+    comment = task["comment"]
+    raw_comment_id = comment.id
+    if not job["dry_run"]:
+        metrics.comments_scanned.inc(page_id=job["page_id"])
+
+    if replied_index.contains(job["page_id"], raw_comment_id):
+        logger.info(f"Skipping already replied comment: {raw_comment_id}")
+        count_skipped(job, "already_replied")
+        return None
+    commenter_name = comment.from_name
+    commenter_id = comment.from_id
+
+    # Check if user is blacklisted
+    if page_settings.is_blacklisted(job["page_id"], commenter_id, commenter_name):
+        logger.info(f"Skipping comment by blacklisted user {commenter_name} (ID: {commenter_id})")
+        count_skipped(job, "blacklisted")
+        return None
+
+    # Reply authors normally arrive with the crawl; only fall back to a remote check
+    # when the nested expansion was truncated
+    replier_names = comment.reply_authors
+    if replier_names is None:
+        replier_names = get_replier_names(raw_comment_id, job["access_token"])
+    if replier_names == 'error':
+        # Unknown whether the page already replied: fail the task so the queue retries it
+        # later, and keep it out of the index so a transient failure is not permanent
+        raise GraphAPIError(f"Could not fetch replies to comment {raw_comment_id}")
+
+    if job["page_name"] in replier_names:
+        if not job["dry_run"]:
+            replied_index.add(job["page_id"], raw_comment_id, reason="already_replied")
+        count_skipped(job, "already_replied")
+        return None
+
+    # Cheap local moderation first; only uncertain comments need the LLM classifier
+    verdict, reason = job["moderator"].check(job["page_id"], comment.message, raw_comment_id)
+    if verdict in ("offensive", "spam"):
+        logger.info(f"Skipping {verdict} comment by {commenter_name} ({reason})")
+        count_skipped(job, verdict)
+        return None
+    task["moderation"] = verdict
+    return task
+
+def generate_reply(task):
+    job = task["job"]
+    page_id = job["page_id"]
+    reply_cache = job["reply_cache"]
+    post = task["post"]
+    comment = task["comment"]
+    additional_instructions = page_settings.instructions(page_id)
+    cached = reply_cache.get(comment.message, post.id, additional_instructions)
+    if cached is not None:
+        reply_text, is_offensive = cached
+        llm_info = {"llm_mode": "cache", "llm_calls": 0}
+    else:
+        preset_reply = preset_replies_check(comment.message, page_id)
+        llm_info = {}
+        reply_text, is_offensive = generate_ai_reply(
+            comment.message,
+            post.message,
+            preset_reply,
+            comment.from_name,
+            comment.profile_link,
+            result_info=llm_info,
+            skip_classification=task["moderation"] == "clean",
+            page_id=page_id
+        )
+        # Failures and forbidden-phrase replies are worth retrying, so only cache real verdicts
+        if llm_info.get("llm_outcome") in ("reply", "offensive"):
+            reply_cache.put(comment.message, post.id, additional_instructions, reply_text, is_offensive)
+    task.update(llm_info)
+    if is_offensive:
+        logger.info(f"Skipping reply to offensive comment by {comment.from_name}: {comment.message[:50]}... ({llm_info.get('llm_mode')})")
+        reason = {"error": "ai_failure", "forbidden_phrase": "forbidden_phrase"}.get(llm_info.get("llm_outcome"), "offensive")
+        count_skipped(job, reason)
+        return None
+    if not reply_text:
+        count_skipped(job, "empty_reply")
+        return None
+    task["reply_text"] = reply_text
+    return task
+
+def post_reply(task):
+    job = task["job"]
+    if job["dry_run"]:
+        # Shadow mode: keep the reply for the report instead of posting it
+        job["dry_run"].record(reply_log_entry(task), task.get("llm_mode"))
+        return task
+    # Set before posting: a failed post may still have reached Facebook (see CommentQueue.complete)
+    task["post_attempted"] = True
+    post_facebook_reply(job["access_token"], task["comment"].full_id, task["reply_text"])
+    task["posted"] = True
+    replied_index.add(job["page_id"], task["comment"].id)
+    # The reply log is the record of what was posted, so write it before anything else can fail
+    storage.add_reply_log_entries([reply_log_entry(task)])
+    metrics.replies_posted.inc(page_id=job["page_id"], job_id=job["job_id"])
+    metrics.job_reply_rate.record(job["job_id"])
+    return task
+
+def reply_log_entry(task) -> Dict[str, Any]:
+    job = task["job"]
+    post = task["post"]
+    comment = task["comment"]
+    return {
+        "page_id": job["page_id"],
+        "comment_id": comment_key(comment.id),
+        "full_comment_id": comment.full_id,
+        "post_id": post.id,
+        "post_message": post.message,
+        "post_url": post.permalink_url,
+        "post_time": post.created_time or None,
+        "comment_message": comment.message,
+        "comment_url": comment.permalink_url,
+        "comment_time": comment.created_time,
+        "commenter_id": comment.from_id or None,
+        "commenter_name": comment.from_name,
+        "reply": task["reply_text"],
+        "job_id": job["job_id"]
+    }
+
+def log_reply(task):
+    """Mirror a posted reply to the job's Google Sheet, if it has one"""
+    job = task["job"]
+    if not job["sheet_id"] or job["dry_run"]:
+        return task
+    post = task["post"]
+    comment = task["comment"]
+    store_data_in_sheet({
+        "Post ID": post.id,
+        "Post Content": post.message,
+        "Post URL": post.permalink_url,
+        "Post Time": post.created_time or 'Unknown',
+        "Comment ID": comment.full_id,
+        "Comment Content": comment.message or 'No comment message',
+        "Comment URL": comment.permalink_url or 'No comment URL',
+        "Comment Time": comment.created_time or 'Unknown',
+        "Commenter Name": comment.from_name,
+        "Reply": task["reply_text"],
+    }, job["sheet_id"], job["credentials_dict"], job["sheet_name"])
+    return task
+
+def build_reply_pipeline(check=check_comment, should_stop=None, on_complete=None) -> Pipeline:
+    """
+    The check -> generate -> post -> log pipeline shared by the scheduled crawl and the
+    real-time webhook worker. Each stage has its own worker pool (PIPELINE_WORKERS).
+    """
+    return Pipeline(
+        [
+            Stage("check", check, PIPELINE_WORKERS["check"]),
+            Stage("generate", generate_reply, PIPELINE_WORKERS["generate"]),
+            Stage("post", post_reply, PIPELINE_WORKERS["post"]),
+            # A reply that made it to Facebook is always logged, even after a stop
+            Stage("log", log_reply, PIPELINE_WORKERS["log"], finish_on_stop=True),
+        ],
+        queue_size=PIPELINE_QUEUE_SIZE,
+        should_stop=should_stop,
+        on_complete=on_complete
+    )
+
+def run_end_reason(reply_pipeline: Pipeline, stop_event: threading.Event, duration_seconds: Optional[int]) -> str:
+    """How a run's window ended: drained, duration or stopped"""
+    if not reply_pipeline.stopped:
+        return "drained"
+    if not stop_event.is_set():
+        logger.info(f"Stopping this job execution due to duration_seconds ({duration_seconds} seconds)")
+        return "duration"
+    logger.info("Stopping process_comments early due to manual stop")
+    return "stopped"
+
+def dry_run_comments(dry_run: DryRun, job: Dict[str, Any], chunks, should_stop, stop_event: threading.Event) -> Dict[str, Any]:
+    """
+    The shadow half of process_comments. Comments go from the crawl stream straight into
+    the pipeline, without the durable queue, and no watermark moves, so a real run that
+    follows sees the same comments. Returns the dry run's report.
+    """
+    def comment_tasks():
+        for chunk in chunks():
+            for comment in chunk['comments']:
+                yield {"job": job, "post": chunk['post'], "comment": comment}
+
+    reply_pipeline = build_reply_pipeline(should_stop=should_stop)
+    try:
+        reply_pipeline.run(comment_tasks())
+    except GraphAPIError as e:
+        logger.error(f"Dry run crawl of page {job['page_id']} failed part way, reporting what was fetched: {e}")
+    ended_by = run_end_reason(reply_pipeline, stop_event, dry_run.duration_seconds)
+    return dry_run.report(ended_by, reply_pipeline.counts)
+
 # Updated process_comments function (same as before but with duration_seconds)
-def process_comments(config: FacebookConfig, sheet_id: str, credentials_dict: dict, sheet_name: str, duration_seconds: Optional[int] = None):
-    global is_running, blacklisted_users
-    ###
-    replied_comments = set()
+def process_comments(config: FacebookConfig, sheet_id: Optional[str], credentials_dict: Optional[dict], sheet_name: Optional[str], duration_seconds: Optional[int] = None,
+                     stop_event: Optional[threading.Event] = None, job_id: str = "manual", dry_run: Optional[DryRun] = None):
+    """
+    Crawl the page and push every new comment through the reply pipeline:
+    check (dedupe, blacklist, existing replies) -> generate -> post -> log.
+    Setting stop_event (the job's own) stops the run without touching other jobs.
+    job_id labels this run's reply metrics. Replies go to the local reply log, and to the
+    sheet as well when sheet_id is given.
+    With dry_run the run posts nothing and changes no crawl state; see dry_run_comments.
+    """
+    stop_event = stop_event or threading.Event()
     
     try:
-        is_running = True
         # Set a local job_start_time for this execution only
         local_job_start_time = datetime.now()
         # Define cutoff date for posts (March 2025)
-        cutoff_date = datetime(2025, 3, 1).isoformat()
+        cutoff = datetime(2025, 3, 1)
+        cutoff_date = cutoff.isoformat()
 
         logger.info(f"Starting job execution at {local_job_start_time}")
+        if sheet_id and credentials_dict and not dry_run:
+            sheet_writer.resume(credentials_dict)
         
-        posts = get_facebook_posts(config.page_id, config.access_token)
-        page_name = get_page_name(config.page_id, config.access_token)
-
-        for post in posts:
-            # Check if we should stop based on the time elapsed for this execution
-            post_time = post.get('created_time', '')
-            if post_time < cutoff_date:
-                logger.info(f"Skipping post {post['id']} as it's before March 2025")
-                continue
-                
+        # Watermarks from earlier runs let us skip posts and comments we have already handled
+        post_watermarks = storage.get_post_watermarks(config.page_id)
+        # The crawl returns the page name, then streams posts with their new comments and the
+        # authors of their replies, one feed page at a time
+        client = GraphAPIClient(config.access_token)
+        if not dry_run:
+            metrics.job_reply_rate.start(job_id)
+        page_name, post_chunks = client.stream_page(config.page_id, int(cutoff.timestamp()), post_watermarks)
+        if sheet_id and not dry_run:
+            warmed = replied_index.warm_from_sheet(
+                config.page_id, sheet_id, sheet_name,
+                lambda: load_existing_replies(sheet_id, credentials_dict, sheet_name, config.page_id)
+            )
+            if warmed:
+                logger.info(f"Loaded {warmed} previously replied comments from sheet '{sheet_name}'")
+        job = reply_job(config, sheet_id, credentials_dict, sheet_name, page_name, job_id, dry_run)
+        crawl_run = uuid.uuid4().hex
+        crawl_done = threading.Event()
+
+        def should_stop():
             # Check duration
             if duration_seconds and datetime.now() >= local_job_start_time + timedelta(seconds=duration_seconds):
-                print('Duration time has elapsed')
-                logger.info(f"Stopping this job execution due to duration_seconds ({duration_seconds} seconds)")
-                return
-                
-            if not is_running:
-                logger.info("Stopping process_comments early due to manual stop")
-                return
-
-            post_id = post['id']
-            post_message = post.get('message', 'No post content')
-            post_permalink_url = post.get('permalink_url', 'No URL')
-            post_time = post.get('created_time', 'Unknown')
-            try:
-                comments = get_facebook_comments(post_id, config.access_token)
-            except Exception as e:
-                logger.error(f"Error fetching comment for {post_id} continuing")
-                continue
-            comments.sort(key=lambda x: x.get('created_time', ''), reverse=True)
-
-            for comment in comments:
-                # Check duration again
-                if duration_seconds and datetime.now() >= local_job_start_time + timedelta(seconds=duration_seconds):
-                    logger.info(f"Stopping this job execution due to duration_seconds ({duration_seconds} seconds)")
-                    return
-                    
-                if not is_running:
-                    logger.info("Stopping process_comments early due to manual stop")
-                    return
-
-                raw_comment_id = comment['id']
-
-                if raw_comment_id in replied_comments:
-                    logger.info(f"Skipping already replied comment: {raw_comment_id}")
-                    continue
-                comment_message = comment.get('message', 'No comment message')
-                comment_permalink_url = comment.get('permalink_url', 'No comment URL')
-                comment_time = comment.get('created_time', 'Unknown')
-                commenter_name = comment.get('from', {}).get('name', 'Anonymous')
-                commenter_id = comment.get('from', {}).get('id', '')
-                commenter_profile_link = f"https://www.facebook.com/profile.php?id={commenter_id}" if commenter_id else commenter_name
-
-                # Check if user is blacklisted
-                is_blacklisted = False
-                for blacklisted_user in blacklisted_users:
-                    if (blacklisted_user.user_id and blacklisted_user.user_id == commenter_id) or \
-                       (blacklisted_user.user_name and blacklisted_user.user_name.lower() == commenter_name.lower()):
-                        is_blacklisted = True
-                        logger.info(f"Skipping comment by blacklisted user {commenter_name} (ID: {commenter_id})")
-                        break
-                
-                if is_blacklisted:
-                    continue
-                post_id_cleaned = post_id.split('_')[-1]
-                comment_id_cleaned = raw_comment_id.split('_')[-1]
-                full_comment_id = f"{config.page_id}_{post_id_cleaned}_{comment_id_cleaned}"
-                comment_id_for_reply = raw_comment_id
-
-                replier_names = get_replier_names(comment_id_for_reply, config.access_token)
+                return True
+            return stop_event.is_set()
 
-                time.sleep(2)
-
-                if page_name in replier_names or replier_names == 'error':
-                    replied_comments.add(raw_comment_id)   ###
+        def wanted_chunks():
+            # Chunks of posts with new comments, until the stream ends or the run stops
+            for chunk in post_chunks:
+                if should_stop():
+                    return
+                post = chunk['post']
+                if chunk['complete'] and not dry_run:
+                    metrics.posts_scanned.inc(page_id=config.page_id)
+                if post.created_time < cutoff_date:
+                    logger.info(f"Skipping post {post.id} as it's before March 2025")
                     continue
-                
-                preset_reply = preset_replies_check(comment['message'])
-                reply_text, is_offensive = generate_ai_reply(
-                    comment['message'],
-                    post_message,
-                    preset_reply,
-                    commenter_name,
-                    commenter_profile_link
-                )
-                if is_offensive:
-                    logger.info(f"Skipping reply to offensive comment by {commenter_name}: {comment_message[:50]}...")
+                if chunk['unchanged']:
+                    logger.info(f"Skipping post {post.id} as it has no new comments since the last run")
                     continue
-                    
-                if reply_text:
-                    try: 
-                        post_facebook_reply(config.access_token, full_comment_id, reply_text)
-                        replied_comments.add(raw_comment_id)
-                        store_data_in_sheet({
-                            "Post ID": post_id,
-                            "Post Content": post_message,
-                            "Post URL": post_permalink_url,
-                            "Post Time": post_time,
-                            "Comment ID": full_comment_id,
-                            "Comment Content": comment_message,
-                            "Comment URL": comment_permalink_url,
-                            "Comment Time": comment_time,
-                            "Commenter Name": commenter_name,
-                            "Reply": reply_text,
-                        }, sheet_id, credentials_dict, sheet_name)
-                    except Exception as e:
-                        logger.error(f"Failed to post reply or store data: {e}")
+                yield chunk
+
+        def crawl():
+            # New comments go to the durable queue as each page of them arrives; once a post's
+            # last chunk is there its watermark can move on, since anything this run does not
+            # finish is picked up by the next one
+            newest_post_time = None
+            newest_comment_times = {}  # post_id -> newest new comment, for posts still streaming
+            try:
+                for chunk in wanted_chunks():
+                    post = chunk['post']
+                    newest_post_time = newest_post_time or post.created_time
+                    comments = chunk['comments']
+                    if comments:
+                        newest_comment_times.setdefault(post.id, comments[0].created_time)
+                        comment_queue.enqueue(config.page_id, [
+                            {"post": post, "comment": comment, "crawl_run": crawl_run} for comment in comments
+                        ], engagement=post.comment_count)
+                    if not chunk['complete']:
+                        continue
+                    newest_comment_time = newest_comment_times.pop(post.id, None)
+                    if chunk['fetch_failed']:
+                        logger.error(f"Error fetching comment for {post.id} continuing")
+                        continue
+                    storage.set_post_watermark(config.page_id, post.id, post.updated_time, newest_comment_time)
+            except GraphAPIError as e:
+                logger.error(f"Crawl of page {config.page_id} failed part way, replying to what was fetched: {e}")
+            finally:
+                crawl_done.set()
+            storage.set_page_watermark(config.page_id, newest_post_time, datetime.now().isoformat())
+
+        if dry_run:
+            return dry_run_comments(dry_run, job, wanted_chunks, should_stop, stop_event)
+
+        comment_queue.purge()
+        crawler = threading.Thread(target=crawl, name=f"crawl-{config.page_id}", daemon=True)
+        crawler.start()
+
+        def comment_tasks():
+            # Replies start as soon as the first comments are queued, while the crawl goes on
+            for task in comment_queue.tasks(config.page_id, job, should_stop, batch_size=PIPELINE_QUEUE_SIZE,
+                                            more=lambda: not crawl_done.is_set()):
+                if task.get("crawl_run") != crawl_run:
+                    # Queued by an earlier run: its reply authors may be out of date (retries
+                    # within this run are already cleared by the queue)
+                    task["comment"].reply_authors = None
+                yield task
+
+        reply_pipeline = build_reply_pipeline(should_stop=should_stop, on_complete=comment_queue.complete)
+        try:
+            reply_pipeline.run(comment_tasks())
+        finally:
+            crawler.join()
+            # Tasks abandoned by a stop go straight back to the queue for the next run
+            released = comment_queue.release(config.page_id)
+            if released:
+                logger.info(f"Returned {released} unfinished comments to the queue")
+
+        ended_by = run_end_reason(reply_pipeline, stop_event, duration_seconds)
+        logger.info(f"Job execution finished, stage counts: {reply_pipeline.counts}")
+        window = comment_queue.window_report(config.page_id, ended_by, reply_pipeline.counts["check"]["in"])
+        if window["unprocessed"]:
+            busiest = ", ".join(f"{post['post_id']} ({post['unprocessed']})" for post in window["top_backlog_posts"][:3])
+            logger.warning(
+                f"Window for page {config.page_id} ended ({ended_by}) with {window['unprocessed']} comments "
+                f"unprocessed, {window['unprocessed_due']} of them due; most left on posts {busiest}"
+            )
+        # Push this run's rows out now instead of waiting for the next timed flush
+        if sheet_id:
+            sheet_writer.flush()
 
     except Exception as e:
         logger.error(f"Error in scheduled task: {e}")
     finally:
-        pass
+        if not dry_run:
+            metrics.job_reply_rate.finish(job_id)
 
-def daily_job_runner(job_id: str, config, google_sheet_id: str, credentials_dict: dict, sheet_name: str, start_time: str, duration_seconds: int):
+def daily_job_runner(job: ScheduledJob):
     """
-    Runs the daily recurring job
+    One run of a daily job, started by the scheduler at the job's start time
     """
     dhaka_tz = pytz.timezone('Asia/Dhaka')
-    
-    while job_id in active_jobs and not stop_flags.get(job_id, False):
+    request = AIReplyRequest.model_validate(credential_store.with_secrets(job.settings))
+    current_dhaka_time = datetime.now(dhaka_tz)
+    logger.info(f"Job {job.job_id}: Starting execution at {current_dhaka_time.strftime('%Y-%m-%d %H:%M:%S %Z')}")
+
+    sheet = request.google_credentials
+    process_comments(
+        request.config,
+        request.google_sheet_id,
+        sheet.credentials if sheet else None,
+        sheet.sheet_name if sheet else None,
+        request.duration_seconds,
+        stop_event=job.stop_event,
+        job_id=job.job_id
+    )
+
+    logger.info(f"Job {job.job_id}: Completed execution")
+
+# With JOB_WORKER_PROCESSES set this process only keeps the schedules; worker.py processes run them
+job_scheduler = JobScheduler(daily_job_runner, get_next_dhaka_time, owns=lambda job: not JOB_WORKER_PROCESSES)
+shard_ring = HashRing(JOB_WORKER_PROCESSES) if JOB_WORKER_PROCESSES else None
+worker_processes = []  # One subprocess per shard
+
+@app.on_event("startup")
+def load_rate_limits():
+    rate_limiter.reload()
+
+@app.on_event("startup")
+def load_scheduled_jobs():
+    loaded = job_scheduler.load()
+    if loaded:
+        logger.info(f"Restored {loaded} daily jobs from the local store")
+    for job in job_scheduler.jobs():
+        if "credentials_ref" not in job.settings:
+            # Saved by an older version with its secrets inline: move them to the credentials file
+            job.settings = scheduled_job_settings(job.job_id, job.settings)
+            storage.save_scheduled_job(job.job_id, job.start_time, job.duration_seconds, job.settings, job.created_at)
+        # Sheet rows the last process did not get to are flushed now, not at the job's next run
+        settings = credential_store.with_secrets(job.settings)
+        sheet = settings.get("google_credentials")
+        if settings.get("google_sheet_id") and sheet:
+            sheet_writer.resume(sheet["credentials"])
+    worker_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker.py")
+    for shard in range(JOB_WORKER_PROCESSES):
+        command = [sys.executable, worker_script, "--shard", str(shard), "--shards", str(JOB_WORKER_PROCESSES)]
+        if JOB_WORKER_METRICS_PORT:
+            command += ["--metrics-port", str(JOB_WORKER_METRICS_PORT + shard)]
+        worker_processes.append(subprocess.Popen(command))
+    if worker_processes:
+        logger.info(f"Started {len(worker_processes)} job worker processes")
+
+@app.on_event("shutdown")
+async def close_graph_client():
+    await graph_api.close_async_client()
+
+@app.on_event("shutdown")
+def stop_scheduled_jobs():
+    job_scheduler.shutdown()
+    for process in worker_processes:
+        process.terminate()
+    for process in worker_processes:
         try:
-            # Calculate next occurrence
-            next_run_time = get_next_dhaka_time(start_time)
-            seconds_to_wait = calculate_seconds_until_dhaka_time(next_run_time)
-            
-            logger.info(f"Job {job_id}: Next run scheduled for {next_run_time.strftime('%Y-%m-%d %H:%M:%S %Z')}")
-            logger.info(f"Job {job_id}: Waiting {seconds_to_wait} seconds until next run")
-            
-            # Wait until it's time to run (check every minute for stop signal)
-            start_wait = time.time()
-            while time.time() - start_wait < seconds_to_wait:
-                if stop_flags.get(job_id, False):
-                    logger.info(f"Job {job_id}: Stopped during wait period")
-                    return
-                time.sleep(60)  # Check every minute
-            
-            # Check again if job should stop
-            if stop_flags.get(job_id, False):
-                logger.info(f"Job {job_id}: Stopped before execution")
-                return
-                
-            # Run the job
-            current_dhaka_time = datetime.now(dhaka_tz)
-            logger.info(f"Job {job_id}: Starting execution at {current_dhaka_time.strftime('%Y-%m-%d %H:%M:%S %Z')}")
-            
-            process_comments(config, google_sheet_id, credentials_dict, sheet_name, duration_seconds)
-            
-            logger.info(f"Job {job_id}: Completed execution")
-            
-        except Exception as e:
-            logger.error(f"Error in daily job {job_id}: {e}")
-            # Wait a bit before retrying
-            time.sleep(300)  # Wait 5 minutes before retry
-    
-    # Cleanup when job stops
-    if job_id in active_jobs:
-        del active_jobs[job_id]
-    if job_id in stop_flags:
-        del stop_flags[job_id]
-    logger.info(f"Job {job_id}: Terminated")
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+def check_sheet_settings(sheet_id: Optional[str], credentials: Optional[GoogleCredentials]):
+    if sheet_id and credentials is None:
+        raise HTTPException(status_code=400, detail="google_credentials are required to mirror replies to a sheet")
+
+def scheduled_job_settings(job_id: str, settings: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    A daily job's settings as kept in replybot.db: the page token and the service-account
+    key go to the owner-only credentials file, and the settings keep a reference to them
+    """
+    settings, secrets = credential_store.split_secrets(settings)
+    credential_store.save(job_id, secrets)
+    settings["credentials_ref"] = job_id
+    return settings
 
 @app.post("/start-daily-reply")
 def start_daily_reply(request: AIReplyRequest):
-    global active_jobs, stop_flags
-    
     # Validate time format
     try:
         get_next_dhaka_time(request.start_time)
     except ValueError as e:
         return {"error": f"Invalid time format: {str(e)}"}
+    check_sheet_settings(request.google_sheet_id, request.google_credentials)
     
     # Generate a unique job ID
     job_id = f"daily_{int(time.time())}"
+    suffix = 1
+    while job_scheduler.get(job_id) is not None:
+        suffix += 1
+        job_id = f"daily_{int(time.time())}_{suffix}"
     
-    # Create stop flag for this job
-    stop_flags[job_id] = False
-    
-    # Store job info
-    active_jobs[job_id] = {
-        "start_time": request.start_time,
-        "duration_seconds": request.duration_seconds,
-        "created_at": datetime.now().isoformat(),
-        "config": request.config,
-        "google_sheet_id": request.google_sheet_id,
-        "sheet_name": request.google_credentials.sheet_name
-    }
-    
-    # Start the daily job thread
-    thread = threading.Thread(
-        target=daily_job_runner,
-        args=(
-            job_id,
-            request.config,
-            request.google_sheet_id,
-            request.google_credentials.credentials,
-            request.google_credentials.sheet_name,
-            request.start_time,
-            request.duration_seconds
-        )
-    )
-    thread.daemon = True
-    thread.start()
-    
-    # Calculate next run info for response
-    next_run_time = get_next_dhaka_time(request.start_time)
+    # The request is stored so the job can be restored after a restart
+    job = ScheduledJob(job_id, request.start_time, request.duration_seconds,
+                       scheduled_job_settings(job_id, request.model_dump()))
+    job_scheduler.add(job)
     
     return {
         "status": f"Daily reply bot scheduled for {request.start_time} Dhaka time, running for {request.duration_seconds} seconds each day",
         "job_id": job_id,
         "start_time": request.start_time,
         "duration_seconds": request.duration_seconds,
-        "next_run_dhaka": next_run_time.strftime('%Y-%m-%d %H:%M:%S %Z'),
-        "sheet_link": f"https://docs.google.com/spreadsheets/d/{request.google_sheet_id}/edit",
-        "sheet_name": request.google_credentials.sheet_name
+        "next_run_dhaka": job.next_run.strftime('%Y-%m-%d %H:%M:%S %Z'),
+        "sheet_link": sheet_link(request.google_sheet_id),
+        "sheet_name": request.google_credentials.sheet_name if request.google_sheet_id else None
     }
 
 @app.post("/stop-daily-reply")
 def stop_daily_reply(job_id: str = None):
-    global active_jobs, stop_flags, is_running
-    
     if job_id:
         # Stop specific job
-        if job_id in active_jobs:
-            stop_flags[job_id] = True
-            is_running = False
+        if job_scheduler.remove(job_id):
+            credential_store.delete(job_id)
             return {"status": f"Daily job {job_id} stopped"}
         else:
             return {"status": "Job not found"}
     else:
         # Stop all jobs
-        for jid in list(active_jobs.keys()):
-            stop_flags[jid] = True
-        is_running = False
+        for job in job_scheduler.jobs():
+            job_scheduler.remove(job.job_id)
+            credential_store.delete(job.job_id)
         return {"status": "All daily jobs stopped"}
 
 @app.get("/active-daily-jobs")
@@ -807,19 +1228,280 @@ def get_active_daily_jobs():
     dhaka_tz = pytz.timezone('Asia/Dhaka')
     current_dhaka_time = datetime.now(dhaka_tz)
     
+    # Jobs in worker processes show up as running through their page lease
+    leases = storage.get_page_leases() if shard_ring else {}
     job_info = []
-    for job_id, job_data in active_jobs.items():
-        next_run = get_next_dhaka_time(job_data["start_time"])
+    for job in job_scheduler.jobs():
+        page_id = job.settings["config"]["page_id"]
         job_info.append({
-            "job_id": job_id,
-            "start_time": job_data["start_time"],
-            "duration_seconds": job_data["duration_seconds"],
-            "next_run_dhaka": next_run.strftime('%Y-%m-%d %H:%M:%S %Z'),
-            "created_at": job_data["created_at"]
+            "job_id": job.job_id,
+            "page_id": page_id,
+            "shard": shard_ring.shard_for(page_id) if shard_ring else None,
+            "start_time": job.start_time,
+            "duration_seconds": job.duration_seconds,
+            "next_run_dhaka": job.next_run.strftime('%Y-%m-%d %H:%M:%S %Z') if job.next_run else None,
+            "created_at": job.created_at,
+            "running": job.running_since is not None or page_id in leases,
+            "running_since": job.running_since.isoformat() if job.running_since else None,
+            "last_run": job.last_run.isoformat() if job.last_run else None,
+            "runs": job.runs
         })
     
     return {
         "active_jobs": job_info,
         "count": len(job_info),
+        "running": sum(1 for job in job_info if job["running"]),
+        "max_workers": job_scheduler.max_workers,
         "current_dhaka_time": current_dhaka_time.strftime('%Y-%m-%d %H:%M:%S %Z')
-    }
\ No newline at end of file
+    }
+
+@app.get("/job-workers")
+def get_job_workers():
+    return {
+        "worker_processes": JOB_WORKER_PROCESSES,
+        "workers": [
+            {"shard": shard, "pid": process.pid, "alive": process.poll() is None}
+            for shard, process in enumerate(worker_processes)
+        ],
+        "page_leases": storage.get_page_leases()
+    }
+
+
+class DryRunRequest(BaseModel):
+    config: Optional[FacebookConfig] = None
+    duration_seconds: Optional[int] = None
+    job_id: Optional[str] = None  # Shadow this daily job's page and window instead
+
+dry_runs = {}  # run_id -> DryRun still running
+
+def run_dry_run(dry_run: DryRun, config: FacebookConfig):
+    try:
+        process_comments(config, None, None, None, dry_run.duration_seconds, stop_event=dry_run.stop_event,
+                         job_id=dry_run.run_id, dry_run=dry_run)
+        if dry_run.report_data is None:
+            storage.finish_dry_run(dry_run.run_id, {"error": "The dry run failed before it could report, see the logs"})
+    finally:
+        dry_runs.pop(dry_run.run_id, None)
+
+@app.post("/start-dry-run")
+def start_dry_run(request: DryRunRequest):
+    """
+    Shadow a reply run: crawl, checks and reply generation run for real, replies are kept
+    locally instead of being posted and no crawl state changes. The report (comments per
+    second, external calls, how many comments fit in duration_seconds) is at /dry-run/{run_id}.
+    """
+    config, duration_seconds = request.config, request.duration_seconds
+    if request.job_id:
+        job = job_scheduler.get(request.job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Daily job {request.job_id} not found")
+        config = FacebookConfig.model_validate(credential_store.with_secrets(job.settings)["config"])
+        duration_seconds = duration_seconds or job.duration_seconds
+    if config is None:
+        raise HTTPException(status_code=400, detail="Give either config or the job_id of a daily job")
+
+    dry_run = DryRun(config.page_id, duration_seconds)
+    dry_runs[dry_run.run_id] = dry_run
+    threading.Thread(target=run_dry_run, args=(dry_run, config), name=dry_run.run_id, daemon=True).start()
+    return {
+        "status": "success",
+        "run_id": dry_run.run_id,
+        "page_id": config.page_id,
+        "duration_seconds": duration_seconds
+    }
+
+@app.get("/dry-run/{run_id}")
+def get_dry_run(run_id: str):
+    run = storage.get_dry_run(run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail=f"Dry run {run_id} not found")
+    return {"status": "running" if run["finished_at"] is None else "finished", **run}
+
+@app.get("/dry-run/{run_id}/replies")
+def get_dry_run_replies(run_id: str, cursor: Optional[int] = None, limit: int = Query(50, ge=1, le=500)):
+    """The replies the dry run would have posted, newest first; pass next_cursor back as cursor"""
+    entries = storage.query_dry_run_replies(run_id, cursor, limit)
+    return {
+        "status": "success",
+        "replies": [reply_log_row(entry) for entry in entries],
+        "count": len(entries),
+        "next_cursor": entries[-1]["id"] if len(entries) == limit else None
+    }
+
+@app.post("/stop-dry-run/{run_id}")
+def stop_dry_run(run_id: str):
+    dry_run = dry_runs.get(run_id)
+    if dry_run is None:
+        return {"status": "Dry run not running"}
+    dry_run.stop_event.set()
+    return {"status": f"Dry run {run_id} stopping, its report will follow"}
+
+
+class RealtimeReplyRequest(BaseModel):
+    config: FacebookConfig
+    google_sheet_id: Optional[str] = None
+    google_credentials: Optional[GoogleCredentials] = None
+
+realtime_pages = {}  # page_id -> reply job for pages answered straight from webhook events
+webhook_queue = WebhookQueue()
+webhook_worker = None
+webhook_posts = OrderedDict()  # post_id -> Post, most recent last
+webhook_lock = threading.Lock()
+WEBHOOK_POST_CACHE_SIZE = 1000
+WEBHOOK_RETRY_POLL_SECONDS = float(os.getenv("WEBHOOK_RETRY_POLL_SECONDS", "30"))
+# Same durable table as comment_queue, but its own lease owner, so a scheduled run that
+# releases its unfinished tasks never hands back one the webhook worker is still on
+realtime_queue = CommentQueue()
+
+def webhook_post_details(job: Dict[str, Any], post_id: str):
+    """Webhook events carry no post text, so look it up once per post and keep it around"""
+    with webhook_lock:
+        details = webhook_posts.get(post_id)
+        if details is not None:
+            webhook_posts.move_to_end(post_id)
+            return details
+    data = GraphAPIClient(job["access_token"]).get(post_id, {"fields": "message,permalink_url,created_time"})
+    details = Post.from_graph({**data, "id": post_id})
+    with webhook_lock:
+        webhook_posts[post_id] = details
+        while len(webhook_posts) > WEBHOOK_POST_CACHE_SIZE:
+            webhook_posts.popitem(last=False)
+    return details
+
+def check_webhook_comment(task):
+    # Webhook events carry only the post ID and link; fill in the rest before the usual checks
+    post = webhook_post_details(task["job"], task["post"].id)
+    permalink_url = task.get("post_permalink_url")
+    if permalink_url and permalink_url != post.permalink_url:
+        post = Post(post.id, post.message, post.created_time, post.updated_time, permalink_url)
+    task["post"] = post
+    return check_comment(task)
+
+def webhook_tasks():
+    """
+    Webhook comments go through the durable comment queue, so one whose check or post fails
+    is retried with backoff like a crawled comment. Each new comment is queued and leased by
+    ID: one a scheduled run already holds is left to it. Every WEBHOOK_RETRY_POLL_SECONDS
+    the real-time pages' failed comments that are due again are leased as well.
+    """
+    retried_at = time.monotonic()
+    while True:
+        event = webhook_queue.get(timeout=WEBHOOK_RETRY_POLL_SECONDS)
+        if time.monotonic() - retried_at >= WEBHOOK_RETRY_POLL_SECONDS:
+            retried_at = time.monotonic()
+            for page_id, job in list(realtime_pages.items()):
+                yield from realtime_queue.lease(page_id, job, PIPELINE_QUEUE_SIZE, min_attempts=1)
+        if event is None:
+            continue
+        job = realtime_pages.get(event["page_id"])
+        if job is None:
+            logger.info(f"Dropping webhook comment for page {event['page_id']}: real-time replies were stopped")
+            continue
+        post = Post(event["post_id"], permalink_url=event.get("post_permalink_url"))
+        comment = Comment.from_graph(event["comment"], post.id, event["page_id"])
+        realtime_queue.enqueue(event["page_id"], [
+            {"post": post, "comment": comment, "post_permalink_url": event.get("post_permalink_url")}
+        ])
+        yield from realtime_queue.lease(event["page_id"], job, 1, comment_ids=[comment.id])
+
+def run_webhook_worker():
+    # Runs for the life of the process; the same stages as a scheduled crawl, fed by webhooks
+    reply_pipeline = build_reply_pipeline(check=check_webhook_comment, on_complete=realtime_queue.complete)
+    reply_pipeline.run(webhook_tasks())
+
+@app.get("/webhook")
+def verify_webhook(mode: str = Query(None, alias="hub.mode"),
+                   token: str = Query(None, alias="hub.verify_token"),
+                   challenge: str = Query(None, alias="hub.challenge")):
+    """Subscription handshake: echo the challenge when the verify token matches"""
+    expected_token = verify_token()
+    if mode == "subscribe" and expected_token and token == expected_token:
+        logger.info("Webhook subscription verified")
+        return PlainTextResponse(challenge or "")
+    raise HTTPException(status_code=403, detail="Webhook verification failed")
+
+@app.post("/webhook")
+async def receive_webhook(request: Request):
+    """
+    Page feed change events. Only the signature check and parsing happen here; new
+    comments are queued for the real-time worker so Facebook gets its 200 right away.
+    """
+    body = await request.body()
+    if not verify_signature(body, request.headers.get("X-Hub-Signature-256")):
+        webhook_queue.count("rejected")
+        raise HTTPException(status_code=403, detail="Invalid webhook signature")
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Webhook body is not valid JSON")
+
+    queued = 0
+    for event in comment_events(payload):
+        webhook_queue.count("received")
+        if event["page_id"] not in realtime_pages:
+            webhook_queue.count("ignored")
+            continue
+        queued += webhook_queue.put(event)
+    return {"status": "success", "queued": queued}
+
+@app.post("/start-realtime-reply")
+async def start_realtime_reply(request: RealtimeReplyRequest):
+    """
+    Reply to new comments on this page as their webhook events arrive. The Graph call runs
+    on the event loop and the sheet read on the sheet writer's executor, so a slow Graph or
+    Sheets response does not hold up other requests.
+    """
+    global webhook_worker
+    check_sheet_settings(request.google_sheet_id, request.google_credentials)
+    try:
+        page_name = await AsyncGraphAPIClient(request.config.access_token).get_page_name(request.config.page_id)
+    except GraphAPIError as e:
+        logger.error(f"Error fetching page name: {e}")
+        page_name = None
+    if page_name is None:
+        raise HTTPException(status_code=400, detail="Could not fetch the page name, check the access token")
+    credentials_dict, sheet_name = None, None
+    if request.google_sheet_id:
+        credentials_dict = request.google_credentials.credentials
+        sheet_name = request.google_credentials.sheet_name
+        warmed = await sheet_writer.run_async(
+            replied_index.warm_from_sheet,
+            request.config.page_id, request.google_sheet_id, sheet_name,
+            lambda: load_existing_replies(request.google_sheet_id, credentials_dict, sheet_name, request.config.page_id)
+        )
+        if warmed:
+            logger.info(f"Loaded {warmed} previously replied comments from sheet '{sheet_name}'")
+    realtime_pages[request.config.page_id] = reply_job(
+        request.config, request.google_sheet_id, credentials_dict, sheet_name, page_name,
+        job_id=f"realtime_{request.config.page_id}"
+    )
+
+    with webhook_lock:
+        if webhook_worker is None or not webhook_worker.is_alive():
+            webhook_worker = threading.Thread(target=run_webhook_worker, name="webhook-worker", daemon=True)
+            webhook_worker.start()
+
+    return {
+        "status": "success",
+        "message": f"Real-time replies enabled for page {page_name}",
+        "page_id": request.config.page_id,
+        "sheet_link": sheet_link(request.google_sheet_id),
+        "sheet_name": sheet_name
+    }
+
+@app.post("/stop-realtime-reply")
+def stop_realtime_reply(page_id: str = None):
+    if page_id:
+        if realtime_pages.pop(page_id, None) is None:
+            return {"status": "Page not found"}
+        return {"status": f"Real-time replies stopped for page {page_id}"}
+    realtime_pages.clear()
+    return {"status": "Real-time replies stopped for all pages"}
+
+@app.get("/webhook-stats")
+def get_webhook_stats():
+    return {
+        **webhook_queue.stats(),
+        "pages": list(realtime_pages.keys()),
+        "worker_alive": webhook_worker is not None and webhook_worker.is_alive()
+    }
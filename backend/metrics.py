@@ -0,0 +1,278 @@
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Content type of the Prometheus text exposition format served by /metrics
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterable[Tuple[str, Sequence[str], Sequence[str], float]]:
+        """(suffix, label names, label values, value) for every series"""
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, names, values, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(names, values)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [("", self.labelnames, key, value) for key, value in items]
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down. Either set() it, or pass `collect`, which returns
+    (label values, value) pairs when /metrics is scraped, to derive it from live state.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 collect: Optional[Callable[[], Iterable[Tuple[LabelValues, float]]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self.collect = collect or self._collect_set
+
+    def set(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _collect_set(self) -> List[Tuple[LabelValues, float]]:
+        with self._lock:
+            return sorted(self._values.items())
+
+    def samples(self):
+        return [("", self.labelnames, key, value) for key, value in self.collect()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series: Dict[LabelValues, List[float]] = {}  # Bucket counts, then sum and count
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, **labels: str) -> int:
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return int(series[-1]) if series else 0
+
+    def counts(self) -> Dict[LabelValues, int]:
+        """Observations so far for every label set"""
+        with self._lock:
+            return {key: int(series[-1]) for key, series in self._series.items()}
+
+    def quantile(self, q: float, **labels: str) -> Optional[float]:
+        """Estimate a quantile by interpolating within its bucket, like histogram_quantile()"""
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            if not series or not series[-1]:
+                return None
+            counts = series[:len(self.buckets)]
+            total = series[-1]
+        rank = q * total
+        cumulative = 0.0
+        lower = 0.0
+        for bound, count in zip(self.buckets, counts):
+            if cumulative + count >= rank and count:
+                if math.isinf(bound):
+                    return lower
+                return lower + (bound - lower) * (rank - cumulative) / count
+            cumulative += count
+            lower = bound if not math.isinf(bound) else lower
+        return lower
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        names = self.labelnames + ("le",)
+        samples = []
+        for key, series in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                samples.append(("_bucket", names, key + (_format_value(bound),), cumulative))
+            samples.append(("_sum", self.labelnames, key, series[-2]))
+            samples.append(("_count", self.labelnames, key, series[-1]))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class JobReplyRate:
+    """Replies per minute of each job's current run, or of its last run once it has finished"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._runs: Dict[str, List[Optional[float]]] = {}  # job_id -> [started, replies, ended]
+
+    def start(self, job_id: str):
+        with self._lock:
+            self._runs[job_id] = [time.monotonic(), 0, None]
+
+    def record(self, job_id: str):
+        with self._lock:
+            run = self._runs.get(job_id)
+            if run is None:
+                run = self._runs[job_id] = [time.monotonic(), 0, None]
+            run[1] += 1
+
+    def finish(self, job_id: str):
+        with self._lock:
+            run = self._runs.get(job_id)
+            if run is not None:
+                run[2] = time.monotonic()
+
+    def collect(self) -> List[Tuple[LabelValues, float]]:
+        now = time.monotonic()
+        with self._lock:
+            runs = sorted((job_id, tuple(run)) for job_id, run in self._runs.items())
+        samples = []
+        for job_id, (started, replies, ended) in runs:
+            minutes = ((ended or now) - started) / 60.0
+            samples.append(((job_id,), replies / minutes if minutes > 0 else 0.0))
+        return samples
+
+
+registry = Registry()
+job_reply_rate = JobReplyRate()
+
+posts_scanned = registry.register(Counter(
+    "replybot_posts_scanned_total", "Posts returned by page crawls", ["page_id"]))
+comments_scanned = registry.register(Counter(
+    "replybot_comments_scanned_total", "Comments checked by the reply pipeline", ["page_id"]))
+comments_skipped = registry.register(Counter(
+    "replybot_comments_skipped_total",
+    "Comments left without a reply, by reason (already_replied, blacklisted, offensive, spam, "
+    "forbidden_phrase, ai_failure, empty_reply)",
+    ["page_id", "reason"]))
+replies_posted = registry.register(Counter(
+    "replybot_replies_posted_total", "Replies posted to Facebook", ["page_id", "job_id"]))
+job_replies_per_minute = registry.register(Gauge(
+    "replybot_job_replies_per_minute", "Reply rate of each job's current or last run", ["job_id"],
+    collect=job_reply_rate.collect))
+comments_unprocessed = registry.register(Gauge(
+    "replybot_comments_unprocessed", "Comments still queued when the page's last run window ended", ["page_id"]))
+stage_seconds = registry.register(Histogram(
+    "replybot_pipeline_stage_seconds", "Time one item spends in a reply pipeline stage", ["stage"]))
+external_call_seconds = registry.register(Histogram(
+    "replybot_external_call_seconds", "Latency of Graph API, LLM and Google Sheets calls", ["service", "endpoint"]))
+external_call_errors = registry.register(Counter(
+    "replybot_external_call_errors_total", "Failed Graph API, LLM and Google Sheets calls", ["service", "endpoint"]))
+sleep_seconds = registry.register(Counter(
+    "replybot_sleep_seconds_total", "Time spent waiting on rate limits, Graph usage throttling and retry backoff",
+    ["reason"]))
+
+
+def observe_call(service: str, endpoint: str, seconds: float, error: bool = False):
+    external_call_seconds.observe(seconds, service=service, endpoint=endpoint)
+    if error:
+        external_call_errors.inc(service=service, endpoint=endpoint)
+
+
+def serve(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serve /metrics from a background thread, for processes without the FastAPI app (job workers)"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,261 @@
+import logging
+import os
+import threading
+import unicodedata
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# A trailing '*' matches any word that starts with the term (inflections, compounds);
+# everything else must match whole words so "ass" never fires on "class" or "বাল" on "বালক".
+DEFAULT_BLOCKED_TERMS = [
+    "fuck*", "shit*", "bitch*", "bastard*", "asshole*", "motherfucker*", "dickhead*", "slut*", "whore*",
+    "retard*", "kill yourself", "son of a bitch",
+    "চুদ*", "চোদ*", "খানকি*", "মাগি*", "মাগী*", "বাল", "শুয়োরের বাচ্চা", "কুত্তার বাচ্চা", "হারামজাদা*",
+    "হারামি*", "শালা", "বেশ্যা*",
+]
+
+# Comments that are nothing but one of these phrases are safe to reply to without asking the LLM
+DEFAULT_SAFE_PHRASES = [
+    "nice", "good", "great", "wow", "love", "love it", "thanks", "thank you", "thank you so much",
+    "congratulations", "congrats", "amazing", "awesome", "beautiful", "best wishes", "hi", "hello",
+    "ধন্যবাদ", "অনেক ধন্যবাদ", "শুভ কামনা", "শুভ কামনা রইলো", "শুভকামনা", "অভিনন্দন", "সুন্দর",
+    "অসাধারণ", "চমৎকার", "ভালো", "ভালোবাসা", "আলহামদুলিল্লাহ", "মাশাআল্লাহ",
+]
+
+DUPLICATE_MIN_LENGTH = int(os.getenv("MODERATION_DUPLICATE_MIN_LENGTH", "20"))
+DUPLICATE_MAX_DISTANCE = int(os.getenv("MODERATION_DUPLICATE_MAX_DISTANCE", "3"))
+DUPLICATE_MAX_REPEATS = int(os.getenv("MODERATION_DUPLICATE_MAX_REPEATS", "3"))
+DUPLICATE_WINDOW = int(os.getenv("MODERATION_DUPLICATE_WINDOW", "5000"))
+
+
+def is_word_char(char: str) -> bool:
+    # Bengali vowel signs are combining marks, not alphanumerics, but they belong to the word
+    return char.isalnum() or unicodedata.category(char).startswith('M')
+
+
+def normalize_text(text: str) -> str:
+    text = unicodedata.normalize("NFC", text or "").lower()
+    text = "".join(char if is_word_char(char) else " " for char in text)
+    return " ".join(text.split())
+
+
+class AhoCorasick:
+    """
+    Multi-pattern matcher: one pass over the text finds every lexicon term, however many
+    terms there are. Built once and shared read-only between workers.
+    """
+
+    def __init__(self, terms: Iterable[str]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[Tuple[str, bool]]] = [[]]
+        self.terms: List[str] = []
+        for term in terms:
+            prefix = term.strip().endswith("*")
+            pattern = normalize_text(term.strip().rstrip("*"))
+            if pattern:
+                self.terms.append(term.strip())
+                self._add(pattern, prefix)
+        self._build()
+
+    def _add(self, pattern: str, prefix: bool):
+        state = 0
+        for char in pattern:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = next_state
+        self.output[state].append((pattern, prefix))
+
+    def _build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                candidate = self.goto[fallback].get(char, 0)
+                # Root children fail back to the root, not to themselves
+                self.fail[next_state] = candidate if candidate != next_state else 0
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def search(self, text: str) -> Set[str]:
+        """Return the lexicon patterns found in `text` on word boundaries"""
+        text = normalize_text(text)
+        found = set()
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for pattern, prefix in self.output[state]:
+                start = index - len(pattern) + 1
+                if start > 0 and is_word_char(text[start - 1]):
+                    continue
+                if not prefix and index + 1 < len(text) and is_word_char(text[index + 1]):
+                    continue
+                found.add(pattern)
+        return found
+
+
+def simhash(text: str, bits: int = 64) -> int:
+    """64-bit SimHash over character trigrams; similar texts land a few bits apart"""
+    weights = [0] * bits
+    grams = [text[i:i + 3] for i in range(max(1, len(text) - 2))]
+    for gram in grams:
+        value = hash(gram) & ((1 << bits) - 1)
+        for bit in range(bits):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit in range(bits) if weights[bit] > 0)
+
+
+class NearDuplicateDetector:
+    """
+    Remembers the SimHash of the last `window` comments per page and flags a comment once
+    at least `max_repeats` earlier comments are within `max_distance` bits of it.
+    Fingerprints are split into bands so a lookup only compares candidates sharing a band.
+    A comment checked again under the same ID (a retried task) is not recorded twice, so it
+    never counts as a repeat of itself.
+    """
+
+    BANDS = 4
+    BAND_BITS = 16
+
+    def __init__(self, max_distance: int = DUPLICATE_MAX_DISTANCE, max_repeats: int = DUPLICATE_MAX_REPEATS,
+                 window: int = DUPLICATE_WINDOW, min_length: int = DUPLICATE_MIN_LENGTH):
+        self.max_distance = max_distance
+        self.max_repeats = max_repeats
+        self.window = window
+        self.min_length = min_length
+        self._lock = threading.Lock()
+        # page_id -> (recent (fingerprint, comment_id), fingerprint counts, band index, comment_id -> fingerprint)
+        self._pages: Dict[str, Tuple[deque, Dict[int, int], List[Dict[int, Set[int]]], Dict[str, int]]] = {}
+
+    def _bands(self, fingerprint: int) -> List[int]:
+        mask = (1 << self.BAND_BITS) - 1
+        return [(fingerprint >> (band * self.BAND_BITS)) & mask for band in range(self.BANDS)]
+
+    def check(self, page_id: str, text: str, comment_id: Optional[str] = None) -> bool:
+        """
+        Record the comment and return True when it is part of a flood of near-identical
+        comments. With comment_id a comment already recorded is only looked up.
+        """
+        normalized = normalize_text(text)
+        if len(normalized) < self.min_length:
+            return False  # Short greetings repeat legitimately
+        fingerprint = simhash(normalized)
+        bands = self._bands(fingerprint)
+        with self._lock:
+            recent, counts, index, seen = self._pages.setdefault(
+                page_id, (deque(), {}, [{} for _ in range(self.BANDS)], {})
+            )
+            candidates = set()
+            for band, key in enumerate(bands):
+                candidates.update(index[band].get(key, ()))
+            repeats = sum(
+                counts[other] for other in candidates if bin(other ^ fingerprint).count("1") <= self.max_distance
+            )
+            if comment_id is not None and comment_id in seen:
+                # Already recorded: leave its own earlier record out of the count
+                if bin(seen[comment_id] ^ fingerprint).count("1") <= self.max_distance:
+                    repeats -= 1
+                return repeats >= self.max_repeats
+
+            recent.append((fingerprint, comment_id))
+            if comment_id is not None:
+                seen[comment_id] = fingerprint
+            counts[fingerprint] = counts.get(fingerprint, 0) + 1
+            if counts[fingerprint] == 1:
+                for band, key in enumerate(bands):
+                    index[band].setdefault(key, set()).add(fingerprint)
+            if len(recent) > self.window:
+                expired, expired_id = recent.popleft()
+                seen.pop(expired_id, None)
+                counts[expired] -= 1
+                if not counts[expired]:
+                    del counts[expired]
+                    for band, key in enumerate(self._bands(expired)):
+                        bucket = index[band][key]
+                        bucket.discard(expired)
+                        if not bucket:
+                            del index[band][key]
+        return repeats >= self.max_repeats
+
+
+def load_terms(path: Optional[str]) -> List[str]:
+    if not path:
+        return []
+    try:
+        with open(path, encoding="utf-8") as lexicon_file:
+            return [line.strip() for line in lexicon_file if line.strip() and not line.startswith("#")]
+    except OSError as e:
+        logger.error(f"Could not read moderation lexicon {path}: {e}")
+        return []
+
+
+class LocalModerator:
+    """
+    Cheap checks run before any LLM call. check() returns one of:
+      "offensive" - the lexicon matched, skip the comment
+      "spam"      - part of a near-duplicate flood, skip the comment
+      "clean"     - only a known safe phrase or emoji, reply without LLM classification
+      "uncertain" - let the LLM classifier decide
+    """
+
+    VERDICTS = ("offensive", "spam", "clean", "uncertain")
+
+    def __init__(self, blocked_terms: Optional[Iterable[str]] = None, safe_phrases: Optional[Iterable[str]] = None,
+                 detector: Optional[NearDuplicateDetector] = None):
+        self._lock = threading.Lock()
+        self.configure(
+            blocked_terms if blocked_terms is not None
+            else DEFAULT_BLOCKED_TERMS + load_terms(os.getenv("MODERATION_LEXICON_PATH")),
+            safe_phrases if safe_phrases is not None else DEFAULT_SAFE_PHRASES
+        )
+        self.detector = detector or NearDuplicateDetector()
+        self.counts = {verdict: 0 for verdict in self.VERDICTS}
+
+    def configure(self, blocked_terms: Iterable[str], safe_phrases: Iterable[str]):
+        matcher = AhoCorasick(blocked_terms)
+        safe = {normalize_text(phrase) for phrase in safe_phrases if normalize_text(phrase)}
+        with self._lock:
+            self.matcher = matcher
+            self.safe_phrases = safe
+
+    def check(self, page_id: str, text: str, comment_id: Optional[str] = None) -> Tuple[str, Optional[str]]:
+        """Return (verdict, reason); comment_id keeps a re-checked comment from counting as its own duplicate"""
+        matches = self.matcher.search(text)
+        if matches:
+            verdict, reason = "offensive", f"lexicon: {sorted(matches)[0]}"
+        elif self.detector.check(page_id, text, comment_id):
+            verdict, reason = "spam", "near-duplicate flood"
+        else:
+            normalized = normalize_text(text)
+            if not normalized or normalized in self.safe_phrases:
+                verdict, reason = "clean", "safe phrase" if normalized else "no words"
+            else:
+                verdict, reason = "uncertain", None
+        with self._lock:
+            self.counts[verdict] += 1
+        return verdict, reason
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            total = sum(self.counts.values())
+            return {
+                "checked": total,
+                "counts": dict(self.counts),
+                "hit_rates": {
+                    verdict: round(count / total, 4) if total else 0.0 for verdict, count in self.counts.items()
+                },
+                "blocked_terms": len(self.matcher.terms),
+                "safe_phrases": len(self.safe_phrases)
+            }
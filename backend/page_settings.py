@@ -0,0 +1,115 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import storage
+from blacklist import Blacklist
+from presets import PresetIndex
+
+GLOBAL_SCOPE = ""  # Settings every page falls back to
+
+
+class PageSettings:
+    """
+    Additional instructions, preset replies and blacklists, each kept per page with the
+    global scope ("") as the fallback:
+      instructions - the page's own text if it has any, else the global text
+      presets      - the page's presets are tried first, then the global ones
+      blacklist    - a user is skipped if either the page or the global list has them
+    Instructions and presets are stored in the local SQLite store like the blacklist, so
+    worker processes see the same settings after reload().
+    """
+
+    def __init__(self, default_presets: Optional[Dict[str, str]] = None):
+        self._lock = threading.Lock()
+        self._default_presets = dict(default_presets or {})
+        self._instructions: Dict[str, str] = {}
+        self._presets: Dict[str, Dict[str, str]] = {}
+        self._indexes: Dict[str, PresetIndex] = {}
+        self._blacklists: Dict[str, Blacklist] = {}
+        self._loaded = False
+
+    def _ensure_loaded(self):
+        # Called with the lock held
+        if self._loaded:
+            return
+        self._instructions.clear()
+        self._presets = {GLOBAL_SCOPE: dict(self._default_presets)}
+        for page_id, name, value in storage.load_page_settings():
+            if name == "instructions":
+                self._instructions[page_id] = value
+            elif name == "presets":
+                self._presets[page_id] = value
+        self._indexes = {page_id: PresetIndex(presets) for page_id, presets in self._presets.items()}
+        self._loaded = True
+
+    def reload(self):
+        """Pick up changes other processes made to the store"""
+        with self._lock:
+            self._loaded = False
+            self._ensure_loaded()
+            blacklists = list(self._blacklists.values())
+        for page_blacklist in blacklists:
+            page_blacklist.reload()
+
+    def instructions(self, page_id: Optional[str] = None) -> str:
+        with self._lock:
+            self._ensure_loaded()
+            return self._instructions.get(page_id or GLOBAL_SCOPE) or self._instructions.get(GLOBAL_SCOPE, "")
+
+    def set_instructions(self, text: str, page_id: str = GLOBAL_SCOPE):
+        """An empty text for a page removes its override so it uses the global instructions again"""
+        with self._lock:
+            self._ensure_loaded()
+            storage.set_page_setting(page_id, "instructions", text)
+            self._instructions[page_id] = text
+
+    def presets(self, page_id: str = GLOBAL_SCOPE) -> Dict[str, str]:
+        with self._lock:
+            self._ensure_loaded()
+            return dict(self._presets.get(page_id, {}))
+
+    def set_presets(self, updates: Dict[str, str], page_id: str = GLOBAL_SCOPE) -> Tuple[List[str], List[str]]:
+        """Add or update presets in one scope; returns (new keywords, updated keywords)"""
+        with self._lock:
+            self._ensure_loaded()
+            presets = self._presets.setdefault(page_id, {})
+            index = self._indexes.setdefault(page_id, PresetIndex())
+            new_keys = [key for key in updates if key not in presets]
+            updated_keys = [key for key in updates if key in presets]
+            for key, reply in updates.items():
+                presets[key] = reply
+                index.set(key, reply)
+            storage.set_page_setting(page_id, "presets", presets)
+            return new_keys, updated_keys
+
+    def match_preset(self, comment: str, page_id: Optional[str] = None) -> Optional[str]:
+        with self._lock:
+            self._ensure_loaded()
+            indexes = [self._indexes.get(page_id)] if page_id else []
+            indexes.append(self._indexes.get(GLOBAL_SCOPE))
+        for index in indexes:
+            reply = index.match(comment) if index is not None else None
+            if reply is not None:
+                return reply
+        return None
+
+    def blacklist(self, page_id: str = GLOBAL_SCOPE) -> Blacklist:
+        with self._lock:
+            page_blacklist = self._blacklists.get(page_id)
+            if page_blacklist is None:
+                page_blacklist = self._blacklists[page_id] = Blacklist(page_id)
+            return page_blacklist
+
+    def is_blacklisted(self, page_id: Optional[str], user_id: Optional[str], user_name: Optional[str]) -> bool:
+        if self.blacklist(GLOBAL_SCOPE).contains(user_id, user_name):
+            return True
+        return bool(page_id) and self.blacklist(page_id).contains(user_id, user_name)
+
+    def scopes(self) -> List[str]:
+        """Page IDs with settings of their own"""
+        with self._lock:
+            self._ensure_loaded()
+            pages = set(self._instructions) | set(self._presets)
+        pages.update(storage.load_blacklist_scopes())
+        pages.discard(GLOBAL_SCOPE)
+        return sorted(pages)
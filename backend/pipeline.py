@@ -0,0 +1,120 @@
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterable, List, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()  # Sentinel that tells a stage worker its input is exhausted
+
+
+class Stage:
+    """
+    One step of the pipeline. `func` takes an item and returns the item to hand to the
+    next stage, or None to drop it (e.g. a skipped comment).
+    Stages marked `finish_on_stop` keep draining after a stop so work that already reached
+    them (a posted reply that still has to be logged) is not lost.
+    """
+
+    def __init__(self, name: str, func: Callable[[Any], Any], workers: int = 1, finish_on_stop: bool = False):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.finish_on_stop = finish_on_stop
+
+
+class Pipeline:
+    """
+    Runs items through a chain of stages, each backed by its own worker threads and
+    joined by bounded queues so a slow stage applies back-pressure instead of piling
+    up work in memory.
+
+    on_complete(item, ok) fires once for every item that leaves the pipeline: ok is
+    True when the last stage finished or a stage dropped it, False when a stage raised.
+    Items abandoned because of a stop never complete.
+    """
+
+    def __init__(self, stages: List[Stage], queue_size: int = 50,
+                 should_stop: Optional[Callable[[], bool]] = None,
+                 on_complete: Optional[Callable[[Any, bool], None]] = None):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.should_stop = should_stop or (lambda: False)
+        self.on_complete = on_complete or (lambda item, ok: None)
+        self.stopped = False
+        self.counts = {stage.name: {"in": 0, "out": 0, "dropped": 0, "errors": 0} for stage in stages}
+        self._lock = threading.Lock()
+
+    def _check_stop(self) -> bool:
+        if not self.stopped and self.should_stop():
+            self.stopped = True
+        return self.stopped
+
+    def _count(self, stage: Stage, key: str):
+        with self._lock:
+            self.counts[stage.name][key] += 1
+
+    def _complete(self, item: Any, ok: bool):
+        try:
+            self.on_complete(item, ok)
+        except Exception as e:
+            logger.error(f"Pipeline completion callback failed: {e}")
+
+    def _worker(self, stage: Stage, inbox: queue.Queue, outbox: Optional[queue.Queue]):
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                return
+            if self._check_stop() and not stage.finish_on_stop:
+                continue  # Drain the queue without doing the work
+            self._count(stage, "in")
+            started = time.monotonic()
+            try:
+                result = stage.func(item)
+            except Exception as e:
+                metrics.stage_seconds.observe(time.monotonic() - started, stage=stage.name)
+                logger.error(f"Stage {stage.name} failed: {e}")
+                self._count(stage, "errors")
+                self._complete(item, False)
+                continue
+            metrics.stage_seconds.observe(time.monotonic() - started, stage=stage.name)
+            if result is None:
+                self._count(stage, "dropped")
+                self._complete(item, True)
+                continue
+            self._count(stage, "out")
+            if outbox is None:
+                self._complete(result, True)
+            else:
+                outbox.put(result)
+
+    def run(self, items: Iterable[Any]):
+        """Feed `items` through every stage and block until the pipeline is drained"""
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        threads = []
+        for index, stage in enumerate(self.stages):
+            outbox = queues[index + 1] if index + 1 < len(self.stages) else None
+            stage_threads = [
+                threading.Thread(target=self._worker, args=(stage, queues[index], outbox),
+                                 name=f"pipeline-{stage.name}-{n}", daemon=True)
+                for n in range(stage.workers)
+            ]
+            for thread in stage_threads:
+                thread.start()
+            threads.append(stage_threads)
+
+        try:
+            for item in items:
+                if self._check_stop():
+                    break
+                queues[0].put(item)
+        finally:
+            # Close each stage only after every worker of the previous stage has exited
+            for index, stage in enumerate(self.stages):
+                for _ in range(stage.workers):
+                    queues[index].put(_DONE)
+                for thread in threads[index]:
+                    thread.join()
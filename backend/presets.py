@@ -0,0 +1,74 @@
+import re
+import threading
+from typing import Dict, FrozenSet, Optional, Set
+
+# Share of a preset's keyword tokens that must appear in a comment for the preset to match
+MATCH_THRESHOLD = 0.75
+
+
+def tokenize(text: str) -> FrozenSet[str]:
+    return frozenset(re.sub(r"[^\w\s]", "", text).lower().split())
+
+
+class PresetIndex:
+    """
+    Preset keywords kept as pre-tokenized sets plus an inverted index (token -> presets),
+    so matching a comment only scores presets that share at least one token with it.
+    Ties go to the preset added first, like the old linear scan over the dict.
+    """
+
+    def __init__(self, presets: Optional[Dict[str, str]] = None):
+        self._lock = threading.Lock()
+        self._tokens: Dict[str, FrozenSet[str]] = {}
+        self._replies: Dict[str, str] = {}
+        self._order: Dict[str, int] = {}
+        self._index: Dict[str, Set[str]] = {}
+        self._next_order = 0
+        for keyword, reply in (presets or {}).items():
+            self.set(keyword, reply)
+
+    def set(self, keyword: str, reply: str):
+        """Add or update one preset, touching only the index entries of its own tokens"""
+        tokens = tokenize(keyword)
+        with self._lock:
+            self._unindex(keyword)
+            if keyword not in self._order:
+                self._order[keyword] = self._next_order
+                self._next_order += 1
+            self._replies[keyword] = reply
+            self._tokens[keyword] = tokens
+            for token in tokens:
+                self._index.setdefault(token, set()).add(keyword)
+
+    def remove(self, keyword: str):
+        with self._lock:
+            self._unindex(keyword)
+            self._replies.pop(keyword, None)
+            self._order.pop(keyword, None)
+
+    def _unindex(self, keyword: str):
+        for token in self._tokens.pop(keyword, ()):
+            keywords = self._index.get(token)
+            if keywords is not None:
+                keywords.discard(keyword)
+                if not keywords:
+                    del self._index[token]
+
+    def match(self, comment: str) -> Optional[str]:
+        comment_tokens = tokenize(comment)
+        with self._lock:
+            overlap: Dict[str, int] = {}
+            for token in comment_tokens:
+                for keyword in self._index.get(token, ()):
+                    overlap[keyword] = overlap.get(keyword, 0) + 1
+            best = None
+            for keyword, shared in overlap.items():
+                # Keywords without tokens are never indexed, so len() is never zero here
+                if shared / len(self._tokens[keyword]) >= MATCH_THRESHOLD:
+                    if best is None or self._order[keyword] < self._order[best]:
+                        best = keyword
+            return self._replies[best] if best is not None else None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._replies)
@@ -0,0 +1,93 @@
+import math
+import os
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+PRIORITY_RECENCY_WEIGHT = float(os.getenv("PRIORITY_RECENCY_WEIGHT", "1.0"))
+PRIORITY_RECENCY_HALF_LIFE_HOURS = float(os.getenv("PRIORITY_RECENCY_HALF_LIFE_HOURS", "24"))
+PRIORITY_ENGAGEMENT_WEIGHT = float(os.getenv("PRIORITY_ENGAGEMENT_WEIGHT", "0.5"))
+PRIORITY_WAIT_WEIGHT = float(os.getenv("PRIORITY_WAIT_WEIGHT", "0.5"))
+PRIORITY_WAIT_HORIZON_HOURS = float(os.getenv("PRIORITY_WAIT_HORIZON_HOURS", "24"))
+# Comments one post may have in each fairness tier; 0 turns the quotas off
+PRIORITY_POST_QUOTA = int(os.getenv("PRIORITY_POST_QUOTA", "20"))
+PRIORITY_REFRESH_SECONDS = float(os.getenv("PRIORITY_REFRESH_SECONDS", "300"))
+
+# (comment_id, post_id, comment_time, post_engagement, queued_at)
+PriorityInput = Tuple[str, str, Optional[float], int, float]
+
+
+def graph_timestamp(value: Optional[str]) -> Optional[float]:
+    """Unix time of a Graph API timestamp such as 2025-05-01T10:00:00+0000"""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S%z").timestamp()
+    except ValueError:
+        return None
+
+
+class CommentPrioritizer:
+    """
+    Orders queued comments so the run window goes to the ones that matter most.
+
+    Each comment scores
+        recency_weight    * 0.5 ** (comment age / recency half-life)
+      + engagement_weight * log(1 + post comments) / log(1 + comments on the busiest post)
+      + wait_weight       * min(1, time in the queue / wait horizon)
+    so fresh comments and busy posts come first while anything left over from earlier
+    runs keeps gaining ground.
+
+    Fairness quotas: within each post, comments are ranked by score and split into tiers
+    of `post_quota`. Tier 0 of every post is served before tier 1 of any post, so one busy
+    post cannot take the whole window from the others.
+    """
+
+    def __init__(self, recency_weight: float = PRIORITY_RECENCY_WEIGHT,
+                 recency_half_life_hours: float = PRIORITY_RECENCY_HALF_LIFE_HOURS,
+                 engagement_weight: float = PRIORITY_ENGAGEMENT_WEIGHT, wait_weight: float = PRIORITY_WAIT_WEIGHT,
+                 wait_horizon_hours: float = PRIORITY_WAIT_HORIZON_HOURS, post_quota: int = PRIORITY_POST_QUOTA):
+        self.recency_weight = recency_weight
+        self.recency_half_life_hours = recency_half_life_hours
+        self.engagement_weight = engagement_weight
+        self.wait_weight = wait_weight
+        self.wait_horizon_hours = wait_horizon_hours
+        self.post_quota = post_quota
+
+    def score(self, comment_time: Optional[float], engagement: int, max_engagement: int, queued_at: float,
+              now: float) -> float:
+        recency = 0.0
+        if comment_time is not None and self.recency_half_life_hours > 0:
+            age_hours = max(0.0, now - comment_time) / 3600
+            recency = 0.5 ** (age_hours / self.recency_half_life_hours)
+        popularity = math.log1p(engagement) / math.log1p(max_engagement) if max_engagement > 0 else 0.0
+        wait = min(1.0, max(0.0, now - queued_at) / 3600 / self.wait_horizon_hours) if self.wait_horizon_hours > 0 else 0.0
+        return self.recency_weight * recency + self.engagement_weight * popularity + self.wait_weight * wait
+
+    def prioritize(self, rows: Iterable[PriorityInput], now: Optional[float] = None) -> List[Tuple[float, int, str]]:
+        """(priority, tier, comment_id) for every row, ready for storage.set_comment_priorities"""
+        now = now or time.time()
+        rows = list(rows)
+        max_engagement = max((engagement for _, _, _, engagement, _ in rows), default=0)
+        by_post: Dict[str, List[Tuple[float, str]]] = {}
+        for comment_id, post_id, comment_time, engagement, queued_at in rows:
+            score = self.score(comment_time, engagement, max_engagement, queued_at, now)
+            by_post.setdefault(post_id, []).append((score, comment_id))
+
+        priorities = []
+        for scored in by_post.values():
+            scored.sort(reverse=True)
+            for rank, (score, comment_id) in enumerate(scored):
+                tier = rank // self.post_quota if self.post_quota > 0 else 0
+                priorities.append((round(score, 6), tier, comment_id))
+        return priorities
+
+    def describe(self) -> Dict[str, float]:
+        return {
+            "recency_weight": self.recency_weight,
+            "recency_half_life_hours": self.recency_half_life_hours,
+            "engagement_weight": self.engagement_weight,
+            "wait_weight": self.wait_weight,
+            "wait_horizon_hours": self.wait_horizon_hours,
+            "post_quota": self.post_quota
+        }
@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import metrics
+import storage
+
+logger = logging.getLogger(__name__)
+
+# Default quotas as (requests per minute, burst). Override with RATE_LIMIT_<NAME>="per_minute[:burst]",
+# e.g. RATE_LIMIT_GEMINI="1000:50"
+DEFAULT_LIMITS = {
+    "gemini": (60, 10),
+    "graph_read": (600, 50),
+    "graph_write": (60, 5),
+    "sheets_write": (60, 10),
+}
+
+
+class TokenBucket:
+    """
+    Classic token bucket: refills at `per_minute / 60` tokens per second up to `burst`.
+    Callers only wait when the bucket is empty, so idle quota is spent immediately.
+    """
+
+    def __init__(self, name: str, per_minute: float, burst: int):
+        self.name = name
+        self._lock = threading.Lock()
+        self.configure(per_minute, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.acquired = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def configure(self, per_minute: float, burst: int):
+        with self._lock:
+            self.per_minute = float(per_minute)
+            self.rate = self.per_minute / 60.0
+            self.burst = max(1, int(burst))
+            if hasattr(self, "tokens"):
+                self.tokens = min(self.tokens, self.burst)
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _take(self, tokens: int, waited: float) -> float:
+        """Take the tokens if they are there and return 0, else return how long to wait for them"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                self.acquired += tokens
+                if waited:
+                    self.waits += 1
+                    self.wait_seconds += waited
+                    self.max_wait_seconds = max(self.max_wait_seconds, waited)
+                    metrics.sleep_seconds.inc(waited, reason=f"rate_limit_{self.name}")
+                return 0.0
+            return (tokens - self.tokens) / self.rate if self.rate > 0 else 1.0
+
+    def acquire(self, tokens: int = 1) -> float:
+        """Take `tokens` from the bucket, sleeping until they are available. Returns the time waited."""
+        tokens = min(tokens, self.burst)
+        waited = 0.0
+        while True:
+            delay = self._take(tokens, waited)
+            if not delay:
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+    async def acquire_async(self, tokens: int = 1) -> float:
+        """acquire() for coroutines: waits without blocking the event loop"""
+        tokens = min(tokens, self.burst)
+        waited = 0.0
+        while True:
+            delay = self._take(tokens, waited)
+            if not delay:
+                return waited
+            await asyncio.sleep(delay)
+            waited += delay
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                "per_minute": self.per_minute,
+                "burst": self.burst,
+                "available_tokens": round(self.tokens, 2),
+                "acquired": self.acquired,
+                "waits": self.waits,
+                "wait_seconds": round(self.wait_seconds, 3),
+                "max_wait_seconds": round(self.max_wait_seconds, 3)
+            }
+
+
+def _limit_from_env(name: str, default: tuple) -> tuple:
+    raw = os.getenv(f"RATE_LIMIT_{name.upper()}")
+    if not raw:
+        return default
+    try:
+        per_minute, _, burst = raw.partition(":")
+        return float(per_minute), int(burst) if burst else default[1]
+    except ValueError:
+        logger.error(f"Ignoring invalid RATE_LIMIT_{name.upper()}={raw!r}")
+        return default
+
+
+class RateLimiter:
+    """
+    Registry of named token buckets shared by every worker thread. The configured limits are
+    totals: when job worker processes run alongside the API process, each of the `shares`
+    processes gets an equal slice of every quota, since buckets are not shared between them.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, tuple]] = None, shares: int = 1):
+        self._lock = threading.Lock()
+        self.shares = max(1, shares)
+        self.limits: Dict[str, tuple] = {}  # name -> (per_minute, burst) totals
+        self.buckets: Dict[str, TokenBucket] = {}
+        for name, default in (limits or DEFAULT_LIMITS).items():
+            self.limits[name] = _limit_from_env(name, default)
+            self.buckets[name] = TokenBucket(name, *self._share(*self.limits[name]))
+
+    def _share(self, per_minute: float, burst: int) -> tuple:
+        return per_minute / self.shares, max(1, math.ceil(burst / self.shares))
+
+    def set_shares(self, shares: int):
+        """Split every quota between `shares` processes"""
+        with self._lock:
+            self.shares = max(1, shares)
+            limits = dict(self.limits)
+        for name, (per_minute, burst) in limits.items():
+            self.bucket(name).configure(*self._share(per_minute, burst))
+
+    def bucket(self, name: str) -> TokenBucket:
+        with self._lock:
+            bucket = self.buckets.get(name)
+            if bucket is None:
+                raise KeyError(f"Unknown rate limit bucket '{name}'")
+            return bucket
+
+    def acquire(self, name: str, tokens: int = 1) -> float:
+        return self.bucket(name).acquire(tokens)
+
+    async def acquire_async(self, name: str, tokens: int = 1) -> float:
+        return await self.bucket(name).acquire_async(tokens)
+
+    def configure(self, name: str, per_minute: float, burst: int):
+        """Set the total limit; this process takes its share of it"""
+        bucket = self.bucket(name)
+        with self._lock:
+            self.limits[name] = (per_minute, burst)
+        bucket.configure(*self._share(per_minute, burst))
+
+    def save(self, name: str, per_minute: float, burst: int):
+        """configure() and keep the limit in the store, so restarts and worker processes use it too"""
+        self.configure(name, per_minute, burst)
+        storage.set_rate_limit(name, per_minute, burst)
+
+    def reload(self):
+        """Pick up limits saved by other processes"""
+        for name, limit in storage.get_rate_limits().items():
+            with self._lock:
+                known, current = name in self.buckets, self.limits.get(name)
+            if known and current != limit:
+                self.configure(name, *limit)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Per-process bucket state: per_minute and burst are this process's share"""
+        with self._lock:
+            buckets = list(self.buckets.values())
+            limits = dict(self.limits)
+        snapshot = {}
+        for bucket in buckets:
+            per_minute, burst = limits[bucket.name]
+            snapshot[bucket.name] = {**bucket.snapshot(), "total_per_minute": per_minute, "total_burst": burst,
+                                     "shares": self.shares}
+        return snapshot
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,111 @@
+import sys
+from typing import Any, Dict, List, Optional
+
+
+def intern_id(value: Any) -> str:
+    """Page and post IDs repeat on every comment, so keep one copy of each"""
+    return sys.intern(str(value)) if value is not None else ""
+
+
+def short_id(object_id: str) -> str:
+    """Last segment of a <page>_<post> or <post>_<comment> ID"""
+    return object_id.rsplit('_', 1)[-1]
+
+
+class Post:
+    """The post fields the reply stages use, shared by every comment task of the post"""
+
+    __slots__ = ("id", "message", "created_time", "updated_time", "permalink_url", "comment_count")
+
+    def __init__(self, id: str, message: Optional[str] = None, created_time: Optional[str] = None,
+                 updated_time: Optional[str] = None, permalink_url: Optional[str] = None,
+                 comment_count: Optional[int] = None):
+        self.id = intern_id(id)
+        self.message = message or 'No post content'
+        self.created_time = created_time or ''
+        self.updated_time = updated_time
+        self.permalink_url = permalink_url or 'No URL'
+        self.comment_count = comment_count
+
+    @classmethod
+    def from_graph(cls, data: Dict[str, Any]) -> "Post":
+        summary = (data.get('comments') or {}).get('summary') or {}
+        return cls(data['id'], data.get('message'), data.get('created_time'), data.get('updated_time'),
+                   data.get('permalink_url'), summary.get('total_count', data.get('comment_count')))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "message": self.message,
+            "created_time": self.created_time,
+            "updated_time": self.updated_time,
+            "permalink_url": self.permalink_url,
+            "comment_count": self.comment_count
+        }
+
+
+class Comment:
+    """
+    The comment fields the reply stages use. reply_authors is None when the nested reply
+    expansion was truncated, so the check stage knows it still needs a remote lookup.
+    Derived strings (full_id, profile_link) are only built for comments that get that far.
+    """
+
+    __slots__ = ("id", "post_id", "page_id", "message", "created_time", "permalink_url", "from_id", "from_name",
+                 "reply_authors", "_full_id")
+
+    def __init__(self, id: str, post_id: str, page_id: str, message: str = '', created_time: Optional[str] = None,
+                 permalink_url: Optional[str] = None, from_id: str = '', from_name: str = 'Anonymous',
+                 reply_authors: Optional[List[str]] = None):
+        self.id = id
+        self.post_id = intern_id(post_id)
+        self.page_id = intern_id(page_id)
+        self.message = message
+        self.created_time = created_time
+        self.permalink_url = permalink_url
+        self.from_id = from_id
+        self.from_name = from_name
+        self.reply_authors = reply_authors
+        self._full_id = None
+
+    @classmethod
+    def from_graph(cls, data: Dict[str, Any], post_id: str, page_id: str) -> "Comment":
+        """
+        Build from a Graph API comment, flattening its nested reply expansion into
+        reply_authors. Dicts from to_dict() (already flattened) are accepted too.
+        """
+        if 'reply_authors' in data:
+            reply_authors = data['reply_authors']
+        else:
+            replies = data.get('comments')
+            if replies is None:
+                reply_authors = []
+            elif replies.get('paging', {}).get('next'):
+                reply_authors = None
+            else:
+                reply_authors = [reply.get('from', {}).get('name', '[Unknown]') for reply in replies.get('data', [])]
+        author = data.get('from') or {}
+        return cls(data['id'], post_id, page_id, data.get('message', ''), data.get('created_time'),
+                   data.get('permalink_url'), intern_id(author.get('id', '')), author.get('name', 'Anonymous'),
+                   reply_authors)
+
+    @property
+    def full_id(self) -> str:
+        """<page>_<post>_<comment>, the ID replies are posted to"""
+        if self._full_id is None:
+            self._full_id = f"{self.page_id}_{short_id(self.post_id)}_{short_id(self.id)}"
+        return self._full_id
+
+    @property
+    def profile_link(self) -> str:
+        return f"https://www.facebook.com/profile.php?id={self.from_id}" if self.from_id else self.from_name
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "message": self.message,
+            "created_time": self.created_time,
+            "permalink_url": self.permalink_url,
+            "from": {"id": self.from_id, "name": self.from_name},
+            "reply_authors": self.reply_authors
+        }
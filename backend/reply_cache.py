@@ -0,0 +1,153 @@
+import hashlib
+import os
+import re
+import sys
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import storage
+
+REPLY_CACHE_SIZE = int(os.getenv("REPLY_CACHE_SIZE", "10000"))
+REPLY_CACHE_TTL_SECONDS = int(os.getenv("REPLY_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+# How many comments on the same post may get the same cached reply before we ask the LLM again
+REPLY_CACHE_MAX_REUSE_PER_POST = int(os.getenv("REPLY_CACHE_MAX_REUSE_PER_POST", "3"))
+REPLY_CACHE_PERSIST = os.getenv("REPLY_CACHE_PERSIST", "false").lower() in ("1", "true", "yes")
+# Cap on persisted entries; expired and excess rows are pruned at startup and every PRUNE_EVERY puts
+REPLY_CACHE_PERSIST_SIZE = int(os.getenv("REPLY_CACHE_PERSIST_SIZE", "100000"))
+REPLY_CACHE_PRUNE_EVERY = 500
+
+
+def normalize_comment(text: str) -> str:
+    """
+    Fold the variations that don't change what a reply should say: case, punctuation,
+    spacing and stretched letters ("niceeee"). Emoji are kept since they carry the meaning.
+    """
+    text = unicodedata.normalize("NFC", text or "").lower()
+    text = "".join(" " if unicodedata.category(char).startswith("P") else char for char in text)
+    text = re.sub(r"(.)\1{2,}", r"\1\1", text)
+    return " ".join(text.split())
+
+
+def cache_key(comment: str, post_id: str, instructions: str) -> str:
+    raw = "\x1f".join((post_id or "", instructions or "", normalize_comment(comment)))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class ReplyCache:
+    """
+    LRU cache of generated replies with a TTL, keyed on the normalized comment, the post
+    and the additional instructions. Offensive verdicts are cached too so repeated abuse
+    is skipped without an LLM call. With persist=True entries are written through to the
+    local SQLite store and read back on a miss, so the cache survives restarts; the table
+    is pruned of expired entries and capped at persist_size rows.
+    """
+
+    def __init__(self, max_entries: int = REPLY_CACHE_SIZE, ttl_seconds: int = REPLY_CACHE_TTL_SECONDS,
+                 max_reuse_per_post: int = REPLY_CACHE_MAX_REUSE_PER_POST, persist: bool = REPLY_CACHE_PERSIST,
+                 persist_size: int = REPLY_CACHE_PERSIST_SIZE):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_reuse_per_post = max_reuse_per_post
+        self.persist = persist
+        self.persist_size = persist_size
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.memory_bytes = 0
+        self._puts_since_prune = 0
+        self.counts = {"hits": 0, "misses": 0, "reuse_capped": 0, "evictions": 0, "expirations": 0, "pruned": 0}
+        if self.persist:
+            self._prune()
+
+    def _prune(self):
+        """Expired rows are otherwise only dropped when their exact key is read again"""
+        self.counts["pruned"] += storage.prune_reply_cache(time.time() - self.ttl_seconds, self.persist_size)
+        self._puts_since_prune = 0
+
+    @staticmethod
+    def _entry_size(key: str, entry: Dict[str, Any]) -> int:
+        return sys.getsizeof(key) + sys.getsizeof(entry) + sys.getsizeof(entry["reply"])
+
+    def _insert(self, key: str, entry: Dict[str, Any]):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.memory_bytes -= self._entry_size(key, old)
+        self._entries[key] = entry
+        self.memory_bytes += self._entry_size(key, entry)
+        while len(self._entries) > self.max_entries:
+            evicted_key, evicted = self._entries.popitem(last=False)
+            self.memory_bytes -= self._entry_size(evicted_key, evicted)
+            self.counts["evictions"] += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.memory_bytes -= self._entry_size(key, entry)
+
+    def get(self, comment: str, post_id: str, instructions: str) -> Optional[Tuple[str, bool]]:
+        """Return (reply, is_offensive) for a usable cached entry, or None on a miss"""
+        key = cache_key(comment, post_id, instructions)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self.persist:
+                entry = storage.get_reply_cache_entry(key)
+                if entry is not None:
+                    self._insert(key, entry)
+            if entry is not None and now - entry["created_at"] > self.ttl_seconds:
+                self._remove(key)
+                if self.persist:
+                    storage.delete_reply_cache_entry(key)
+                self.counts["expirations"] += 1
+                entry = None
+            if entry is None:
+                self.counts["misses"] += 1
+                return None
+            if not entry["offensive"] and entry["uses"] >= self.max_reuse_per_post:
+                # Let the LLM write a fresh reply so the post doesn't fill up with copies
+                self.counts["reuse_capped"] += 1
+                self.counts["misses"] += 1
+                return None
+            entry["uses"] += 1
+            self._entries.move_to_end(key)
+            self.counts["hits"] += 1
+            if self.persist:
+                storage.put_reply_cache_entry(key, entry)
+            return entry["reply"], entry["offensive"]
+
+    def put(self, comment: str, post_id: str, instructions: str, reply: str, offensive: bool):
+        key = cache_key(comment, post_id, instructions)
+        with self._lock:
+            existing = self._entries.get(key)
+            if existing is not None and existing["offensive"] == offensive:
+                return  # Keep the original reply and its reuse count
+            entry = {"reply": reply, "offensive": offensive, "created_at": time.time(), "uses": 1}
+            self._insert(key, entry)
+            if self.persist:
+                storage.put_reply_cache_entry(key, entry)
+                self._puts_since_prune += 1
+                if self._puts_since_prune >= REPLY_CACHE_PRUNE_EVERY:
+                    self._prune()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.memory_bytes = 0
+            if self.persist:
+                storage.clear_reply_cache()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.counts["hits"] + self.counts["misses"]
+            return {
+                **self.counts,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hit_ratio": round(self.counts["hits"] / lookups, 4) if lookups else 0.0,
+                "memory_bytes": self.memory_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "max_reuse_per_post": self.max_reuse_per_post,
+                "persist": self.persist
+            }
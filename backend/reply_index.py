@@ -0,0 +1,70 @@
+import threading
+from typing import Dict, Iterable, Set
+
+import storage
+
+
+def comment_key(comment_id: str) -> str:
+    """
+    Comments show up as <comment>, <post>_<comment> or <page>_<post>_<comment>
+    depending on where the ID came from, so index on the last segment only
+    """
+    return str(comment_id).split('_')[-1]
+
+
+class RepliedCommentIndex:
+    """
+    In-memory hash set of handled comment IDs per page, backed by the SQLite store.
+    With shared_store=True a miss is checked against the store as well, for when other
+    processes (sharded workers, the webhook worker) add to the same pages.
+    """
+
+    def __init__(self, shared_store: bool = False):
+        self._ids: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.shared_store = shared_store
+
+    def _page_ids(self, page_id: str) -> Set[str]:
+        ids = self._ids.get(page_id)
+        if ids is None:
+            ids = storage.load_replied_comment_ids(page_id)
+            self._ids[page_id] = ids
+        return ids
+
+    def contains(self, page_id: str, comment_id: str) -> bool:
+        key = comment_key(comment_id)
+        with self._lock:
+            ids = self._page_ids(page_id)
+            if key in ids:
+                return True
+            if self.shared_store and storage.is_comment_replied(page_id, key):
+                ids.add(key)
+                return True
+            return False
+
+    def add(self, page_id: str, comment_id: str, reason: str = "replied"):
+        self.add_many(page_id, [comment_id], reason)
+
+    def add_many(self, page_id: str, comment_ids: Iterable[str], reason: str = "replied") -> int:
+        with self._lock:
+            ids = self._page_ids(page_id)
+            new_ids = {comment_key(comment_id) for comment_id in comment_ids if comment_id} - ids
+            if new_ids:
+                storage.add_replied_comments(page_id, new_ids, reason)
+                ids.update(new_ids)
+            return len(new_ids)
+
+    def size(self, page_id: str) -> int:
+        with self._lock:
+            return len(self._page_ids(page_id))
+
+    def warm_from_sheet(self, page_id: str, sheet_id: str, sheet_name: str, loader) -> int:
+        """
+        Seed the index from the reply log sheet once per sheet; later runs read the local store
+        """
+        source = f"sheet:{page_id}:{sheet_id}:{sheet_name}"
+        if storage.is_source_warmed(source):
+            return 0
+        added = self.add_many(page_id, loader(), reason="sheet")
+        storage.mark_source_warmed(source)
+        return added
@@ -0,0 +1,186 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import storage
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_MAX_WORKERS = int(os.getenv("SCHEDULER_MAX_WORKERS", "4"))
+
+
+class ScheduledJob:
+    """
+    A daily job: its settings, when it runs next and whether a run is in progress.
+    stop_event is set when the job is removed so a running execution stops right away.
+    """
+
+    def __init__(self, job_id: str, start_time: str, duration_seconds: int, settings: Dict[str, Any],
+                 created_at: Optional[str] = None):
+        self.job_id = job_id
+        self.start_time = start_time
+        self.duration_seconds = duration_seconds
+        self.settings = settings
+        self.created_at = created_at or datetime.now().isoformat()
+        self.next_run: Optional[datetime] = None
+        self.running_since: Optional[datetime] = None
+        self.last_run: Optional[datetime] = None
+        self.runs = 0
+        self.stop_event = threading.Event()
+
+
+class JobScheduler:
+    """
+    One dispatcher thread holding every job's next run time in a heap. It sleeps on a
+    condition until the earliest run is due, so jobs start on time and adding or removing
+    a job wakes it at once. Due jobs run on a bounded worker pool; a job never overlaps
+    with its own previous run. Schedules are kept in the local SQLite store and reloaded
+    with load() after a restart.
+
+    `owns` decides which jobs this scheduler runs. Jobs it does not own are still listed
+    with their next run time (recomputed on every read) but never dispatched, which is how the API process hands
+    jobs to sharded worker processes.
+    """
+
+    def __init__(self, run_job: Callable[[ScheduledJob], None], next_run_time: Callable[[str], datetime],
+                 max_workers: int = SCHEDULER_MAX_WORKERS, owns: Optional[Callable[[ScheduledJob], bool]] = None):
+        self.run_job = run_job
+        self.next_run_time = next_run_time
+        self.max_workers = max_workers
+        self.owns = owns or (lambda job: True)
+        self._jobs: Dict[str, ScheduledJob] = {}
+        self._heap: List[Tuple[float, int, str]] = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+        self._shutdown = False
+
+    def start(self):
+        with self._condition:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._shutdown = False
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="job")
+            self._thread = threading.Thread(target=self._dispatch, name="job-scheduler", daemon=True)
+            self._thread.start()
+
+    def load(self) -> int:
+        """Restore the schedules saved by a previous process"""
+        count = 0
+        for job_id, start_time, duration_seconds, settings, created_at in storage.load_scheduled_jobs():
+            if job_id not in self._jobs:
+                self.add(ScheduledJob(job_id, start_time, duration_seconds, settings, created_at), persist=False)
+                count += 1
+        return count
+
+    def sync(self) -> Tuple[int, int]:
+        """Match the store, which other processes may have changed; returns (added, removed)"""
+        stored = {row[0]: row for row in storage.load_scheduled_jobs()}
+        removed = [job_id for job_id in list(self._jobs) if job_id not in stored]
+        for job_id in removed:
+            self.remove(job_id, forget=False)
+        added = 0
+        for job_id, start_time, duration_seconds, settings, created_at in stored.values():
+            if job_id not in self._jobs:
+                self.add(ScheduledJob(job_id, start_time, duration_seconds, settings, created_at), persist=False)
+                added += 1
+        return added, len(removed)
+
+    def _push(self, job: ScheduledJob):
+        # Called with the condition held
+        job.next_run = self.next_run_time(job.start_time)
+        if not self.owns(job):
+            return
+        heapq.heappush(self._heap, (job.next_run.timestamp(), next(self._sequence), job.job_id))
+        self._condition.notify()
+
+    def add(self, job: ScheduledJob, persist: bool = True):
+        if persist:
+            storage.save_scheduled_job(job.job_id, job.start_time, job.duration_seconds, job.settings, job.created_at)
+        with self._condition:
+            self._jobs[job.job_id] = job
+            self._push(job)
+        self.start()
+
+    def remove(self, job_id: str, forget: bool = True) -> bool:
+        """
+        Unschedule a job and stop its current run, if any. Its heap entry is skipped when it
+        comes up. forget=False keeps the saved schedule (another process removed it already).
+        """
+        with self._condition:
+            job = self._jobs.pop(job_id, None)
+        if job is None:
+            return False
+        job.stop_event.set()
+        if forget:
+            storage.delete_scheduled_job(job_id)
+        return True
+
+    def _refresh(self, job: ScheduledJob) -> ScheduledJob:
+        # Called with the condition held. Nothing advances next_run for jobs another process
+        # runs, so work it out again from the start time
+        if not self.owns(job):
+            job.next_run = self.next_run_time(job.start_time)
+        return job
+
+    def get(self, job_id: str) -> Optional[ScheduledJob]:
+        with self._condition:
+            job = self._jobs.get(job_id)
+            return self._refresh(job) if job is not None else None
+
+    def jobs(self) -> List[ScheduledJob]:
+        with self._condition:
+            return [self._refresh(job) for job in self._jobs.values()]
+
+    def shutdown(self, wait: bool = False):
+        """Stop running executions without forgetting the schedules"""
+        with self._condition:
+            self._shutdown = True
+            jobs = list(self._jobs.values())
+            executor = self._executor
+            self._condition.notify()
+        for job in jobs:
+            job.stop_event.set()
+        if wait and executor is not None:
+            executor.shutdown(wait=True)
+
+    def _dispatch(self):
+        while True:
+            with self._condition:
+                while not self._shutdown:
+                    if self._heap:
+                        delay = self._heap[0][0] - datetime.now().timestamp()
+                        if delay <= 0:
+                            break
+                        self._condition.wait(delay)
+                    else:
+                        self._condition.wait()
+                if self._shutdown:
+                    return
+                _, _, job_id = heapq.heappop(self._heap)
+                job = self._jobs.get(job_id)
+                if job is None:
+                    continue  # Removed since it was scheduled
+                if job.running_since is not None:
+                    continue  # Still running; it is rescheduled when that run ends
+                job.running_since = datetime.now()
+            self._executor.submit(self._run, job)
+
+    def _run(self, job: ScheduledJob):
+        try:
+            self.run_job(job)
+        except Exception as e:
+            logger.error(f"Error in daily job {job.job_id}: {e}")
+        finally:
+            with self._condition:
+                job.last_run = job.running_since
+                job.running_since = None
+                job.runs += 1
+                if self._jobs.get(job.job_id) is job and not self._shutdown:
+                    self._push(job)
@@ -0,0 +1,66 @@
+import bisect
+import hashlib
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple
+
+import storage
+
+logger = logging.getLogger(__name__)
+
+# Worker processes to run daily jobs in; 0 runs them inside the API process
+JOB_WORKER_PROCESSES = int(os.getenv("JOB_WORKER_PROCESSES", "0"))
+PAGE_LEASE_SECONDS = float(os.getenv("PAGE_LEASE_SECONDS", "120"))
+# Worker N serves its metrics on this port + N; 0 leaves worker metrics off
+JOB_WORKER_METRICS_PORT = int(os.getenv("JOB_WORKER_METRICS_PORT", "0"))
+
+
+def _hash(key: str) -> int:
+    return int(hashlib.md5(key.encode("utf-8")).hexdigest()[:16], 16)
+
+
+class HashRing:
+    """
+    Consistent hashing of page IDs onto shards. Each shard owns `replicas` points on the
+    ring, so pages spread evenly and changing the shard count only moves about 1/N of them.
+    """
+
+    def __init__(self, shards: int, replicas: int = 100):
+        self.shards = shards
+        self._points: List[Tuple[int, int]] = sorted(
+            (_hash(f"shard-{shard}-{replica}"), shard) for shard in range(shards) for replica in range(replicas)
+        )
+        self._keys = [point for point, _ in self._points]
+
+    def shard_for(self, page_id: str) -> int:
+        index = bisect.bisect(self._keys, _hash(page_id)) % len(self._points)
+        return self._points[index][1]
+
+
+@contextmanager
+def page_lease(page_id: str, owner: str, ttl_seconds: float = PAGE_LEASE_SECONDS) -> Iterator[bool]:
+    """
+    Hold the page's lease for the duration of the block, renewing it in the background.
+    Yields False (and holds nothing) when another process already has the page.
+    """
+    if not storage.acquire_page_lease(page_id, owner, ttl_seconds):
+        yield False
+        return
+    done = threading.Event()
+
+    def renew():
+        while not done.wait(ttl_seconds / 3):
+            if not storage.acquire_page_lease(page_id, owner, ttl_seconds):
+                logger.error(f"Lost the lease on page {page_id} to another process")
+                return
+
+    renewer = threading.Thread(target=renew, name=f"lease-{page_id}", daemon=True)
+    renewer.start()
+    try:
+        yield True
+    finally:
+        done.set()
+        renewer.join()
+        storage.release_page_lease(page_id, owner)
@@ -0,0 +1,195 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import gspread
+from google.oauth2 import service_account
+
+import metrics
+import storage
+from rate_limit import rate_limiter
+
+logger = logging.getLogger(__name__)
+
+SHEET_HEADERS = ["Post ID", "Post Content", "Post URL", "Post Time", "Comment ID",
+                 "Comment Content", "Comment URL", "Comment Time", "Commenter Name", "Reply"]
+
+SHEETS_FLUSH_ROWS = int(os.getenv("SHEETS_FLUSH_ROWS", "25"))
+SHEETS_FLUSH_SECONDS = float(os.getenv("SHEETS_FLUSH_SECONDS", "10"))
+SHEETS_IO_THREADS = int(os.getenv("SHEETS_IO_THREADS", "2"))
+# How long a flush may hold its outbox rows before another process can take them over
+SHEETS_CLAIM_SECONDS = float(os.getenv("SHEETS_CLAIM_SECONDS", "300"))
+
+
+def credentials_key(credentials_dict: dict) -> str:
+    return hashlib.sha256(json.dumps(credentials_dict, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class SheetWriter:
+    """
+    Buffers reply rows and writes them to Google Sheets in batches from a background thread.
+
+    Rows go to a write-ahead table in the local SQLite store before enqueue() returns and are
+    only deleted after append_rows succeeds, so a crash or a Sheets outage never loses them.
+    Credentials are kept in memory only; rows left over from a previous process are flushed
+    once a job registers the same credentials again. Job worker processes share the outbox,
+    so each flush claims its rows first and no row is appended by two processes.
+
+    gspread has no async API, so coroutines hand Sheets calls to run_async(), which runs
+    them on a small executor of its own instead of the event loop's shared default pool.
+    """
+
+    def __init__(self, flush_rows: int = SHEETS_FLUSH_ROWS, flush_seconds: float = SHEETS_FLUSH_SECONDS):
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._credentials: Dict[str, dict] = {}
+        self._clients: Dict[str, gspread.Client] = {}
+        self._worksheets: Dict[Tuple[str, str, str], gspread.Worksheet] = {}
+        self.counts = {"enqueued": 0, "flushed_rows": 0, "flushes": 0, "failed_flushes": 0}
+        self.last_error: Optional[str] = None
+        self._executor = ThreadPoolExecutor(max_workers=SHEETS_IO_THREADS, thread_name_prefix="sheets-io")
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    def register_credentials(self, credentials_dict: dict) -> str:
+        key = credentials_key(credentials_dict)
+        with self._lock:
+            self._credentials.setdefault(key, credentials_dict)
+        return key
+
+    def client(self, key: str) -> gspread.Client:
+        """One authorized client per credential set, built on first use"""
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                creds = service_account.Credentials.from_service_account_info(
+                    self._credentials[key],
+                    scopes=['https://www.googleapis.com/auth/spreadsheets']
+                )
+                client = gspread.authorize(creds)
+                self._clients[key] = client
+            return client
+
+    def worksheet(self, key: str, sheet_id: str, sheet_name: str) -> gspread.Worksheet:
+        """Open the worksheet once, creating it or fixing its header row on first use"""
+        cache_key = (key, sheet_id, sheet_name)
+        worksheet = self._worksheets.get(cache_key)
+        if worksheet is not None:
+            return worksheet
+        spreadsheet = self.client(key).open_by_key(sheet_id)
+        try:
+            worksheet = spreadsheet.worksheet(sheet_name)
+            existing_headers = worksheet.row_values(1)
+            if not existing_headers or existing_headers != SHEET_HEADERS:
+                worksheet.insert_row(SHEET_HEADERS, index=1)
+                logger.info(f"Added headers to existing sheet '{sheet_name}'")
+        except gspread.exceptions.WorksheetNotFound:
+            worksheet = spreadsheet.add_worksheet(title=sheet_name, rows=1, cols=11)
+            worksheet.update([SHEET_HEADERS])
+            logger.info(f"Created new sheet '{sheet_name}' with headers")
+        self._worksheets[cache_key] = worksheet
+        return worksheet
+
+    def enqueue(self, row: List[Any], sheet_id: str, credentials_dict: dict, sheet_name: str):
+        key = self.register_credentials(credentials_dict)
+        pending = storage.add_sheet_outbox_row(sheet_id, sheet_name, key, row)
+        with self._lock:
+            self.counts["enqueued"] += 1
+        self.start()
+        if pending >= self.flush_rows:
+            self._wakeup.set()
+
+    def resume(self, credentials_dict: dict):
+        """
+        Register a job's credentials and start the writer, so rows an earlier process left in
+        the outbox under them go out even if the job never enqueues a row of its own
+        """
+        self.register_credentials(credentials_dict)
+        self.start()
+        self._wakeup.set()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="sheet-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Background sheet flush failed: {e}")
+
+    def flush(self) -> int:
+        """Write every buffered row whose credentials are known; returns the number of rows written"""
+        written = 0
+        with self._flush_lock:
+            with self._lock:
+                keys = list(self._credentials)
+            # Rows under other credentials wait for a job with those credentials to come back
+            groups: Dict[Tuple[str, str, str], List[Tuple[int, List[Any]]]] = {}
+            for row_id, sheet_id, sheet_name, key, row in storage.claim_sheet_outbox_rows(
+                    self.owner, keys, SHEETS_CLAIM_SECONDS):
+                groups.setdefault((key, sheet_id, sheet_name), []).append((row_id, row))
+
+            for (key, sheet_id, sheet_name), rows in groups.items():
+                try:
+                    worksheet = self.worksheet(key, sheet_id, sheet_name)
+                    rate_limiter.acquire("sheets_write")
+                    started = time.monotonic()
+                    try:
+                        worksheet.append_rows([row for _, row in rows])
+                    except Exception:
+                        metrics.observe_call("sheets", "append_rows", time.monotonic() - started, error=True)
+                        raise
+                    metrics.observe_call("sheets", "append_rows", time.monotonic() - started)
+                except Exception as e:
+                    # Drop the cached worksheet in case it was deleted or renamed, and retry next flush
+                    self._worksheets.pop((key, sheet_id, sheet_name), None)
+                    with self._lock:
+                        self.counts["failed_flushes"] += 1
+                        self.last_error = str(e)
+                    logger.error(f"Error storing data in Google Sheets: {e}")
+                    storage.release_sheet_outbox_rows([row_id for row_id, _ in rows], self.owner)
+                    continue
+                storage.delete_sheet_outbox_rows([row_id for row_id, _ in rows])
+                written += len(rows)
+                with self._lock:
+                    self.counts["flushes"] += 1
+                    self.counts["flushed_rows"] += len(rows)
+                logger.info(f"Stored {len(rows)} rows in Google Sheets sheet '{sheet_name}'")
+        return written
+
+    async def run_async(self, func: Callable[..., Any], *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def flush_async(self) -> int:
+        return await self.run_async(self.flush)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self.counts,
+                "pending_rows": storage.count_sheet_outbox_rows(),
+                "flush_rows": self.flush_rows,
+                "flush_seconds": self.flush_seconds,
+                "clients": len(self._clients),
+                "last_error": self.last_error
+            }
+
+
+sheet_writer = SheetWriter()
@@ -0,0 +1,941 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+# Local SQLite store for state that has to survive restarts
+DB_PATH = os.getenv(
+    "REPLYBOT_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "replybot.db")
+)
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS post_watermarks (
+        post_id TEXT PRIMARY KEY,
+        page_id TEXT NOT NULL,
+        updated_time TEXT,
+        last_comment_time TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS page_watermarks (
+        page_id TEXT PRIMARY KEY,
+        last_post_time TEXT,
+        last_crawl_time TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS replied_comments (
+        comment_id TEXT PRIMARY KEY,
+        page_id TEXT NOT NULL,
+        reason TEXT,
+        recorded_at TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_replied_comments_page ON replied_comments (page_id)",
+    """
+    CREATE TABLE IF NOT EXISTS reply_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        page_id TEXT NOT NULL,
+        comment_id TEXT NOT NULL,
+        full_comment_id TEXT,
+        post_id TEXT,
+        post_message TEXT,
+        post_url TEXT,
+        post_time TEXT,
+        comment_message TEXT,
+        comment_url TEXT,
+        comment_time TEXT,
+        commenter_id TEXT,
+        commenter_name TEXT,
+        reply TEXT,
+        job_id TEXT,
+        source TEXT NOT NULL DEFAULT 'reply',
+        replied_at REAL NOT NULL
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_reply_log_comment ON reply_log (page_id, comment_id)",
+    "CREATE INDEX IF NOT EXISTS idx_reply_log_page ON reply_log (page_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_reply_log_post ON reply_log (page_id, post_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_reply_log_commenter_id ON reply_log (page_id, commenter_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_reply_log_commenter_name ON reply_log (page_id, commenter_name COLLATE NOCASE, id)",
+    "CREATE INDEX IF NOT EXISTS idx_reply_log_time ON reply_log (page_id, replied_at)",
+    """
+    CREATE TABLE IF NOT EXISTS dry_runs (
+        run_id TEXT PRIMARY KEY,
+        page_id TEXT NOT NULL,
+        report_json TEXT,
+        started_at REAL NOT NULL,
+        finished_at REAL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS dry_run_replies (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        run_id TEXT NOT NULL,
+        page_id TEXT NOT NULL,
+        comment_id TEXT NOT NULL,
+        full_comment_id TEXT,
+        post_id TEXT,
+        post_message TEXT,
+        post_url TEXT,
+        post_time TEXT,
+        comment_message TEXT,
+        comment_url TEXT,
+        comment_time TEXT,
+        commenter_id TEXT,
+        commenter_name TEXT,
+        reply TEXT,
+        job_id TEXT,
+        source TEXT NOT NULL DEFAULT 'dry_run',
+        replied_at REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_dry_run_replies_run ON dry_run_replies (run_id, id)",
+    """
+    CREATE TABLE IF NOT EXISTS reply_index_sources (
+        source TEXT PRIMARY KEY,
+        warmed_at TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS sheet_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sheet_id TEXT NOT NULL,
+        sheet_name TEXT NOT NULL,
+        credentials_key TEXT NOT NULL,
+        row_json TEXT NOT NULL,
+        created_at TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_sheet_outbox_credentials ON sheet_outbox (credentials_key, id)",
+    """
+    CREATE TABLE IF NOT EXISTS blacklisted_users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT,
+        user_name TEXT,
+        page_id TEXT NOT NULL DEFAULT ''
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS reply_cache (
+        cache_key TEXT PRIMARY KEY,
+        reply TEXT,
+        offensive INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        uses INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_reply_cache_created ON reply_cache (created_at)",
+    """
+    CREATE TABLE IF NOT EXISTS comment_tasks (
+        comment_id TEXT PRIMARY KEY,
+        page_id TEXT NOT NULL,
+        post_id TEXT NOT NULL,
+        task_json TEXT NOT NULL,
+        state TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        lease_owner TEXT,
+        lease_expires REAL,
+        next_attempt_at REAL NOT NULL,
+        last_error TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        comment_time REAL,
+        post_engagement INTEGER NOT NULL DEFAULT 0,
+        priority REAL NOT NULL DEFAULT 0,
+        priority_tier INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_comment_tasks_ready ON comment_tasks (page_id, state, next_attempt_at)",
+    """
+    CREATE TABLE IF NOT EXISTS page_settings (
+        page_id TEXT NOT NULL,
+        name TEXT NOT NULL,
+        value_json TEXT NOT NULL,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (page_id, name)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS page_leases (
+        page_id TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS scheduled_jobs (
+        job_id TEXT PRIMARY KEY,
+        start_time TEXT NOT NULL,
+        duration_seconds INTEGER NOT NULL,
+        settings_json TEXT NOT NULL,
+        created_at TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS rate_limits (
+        name TEXT PRIMARY KEY,
+        per_minute REAL NOT NULL,
+        burst INTEGER NOT NULL,
+        updated_at REAL NOT NULL
+    )
+    """,
+]
+
+# Columns added after the first release; "duplicate column" means the database already has them
+MIGRATIONS = [
+    "ALTER TABLE blacklisted_users ADD COLUMN page_id TEXT NOT NULL DEFAULT ''",
+    "ALTER TABLE comment_tasks ADD COLUMN comment_time REAL",
+    "ALTER TABLE comment_tasks ADD COLUMN post_engagement INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE comment_tasks ADD COLUMN priority REAL NOT NULL DEFAULT 0",
+    "ALTER TABLE comment_tasks ADD COLUMN priority_tier INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE sheet_outbox ADD COLUMN claimed_by TEXT",
+    "ALTER TABLE sheet_outbox ADD COLUMN claimed_until REAL",
+]
+POST_MIGRATION_SCHEMA = [
+    "CREATE INDEX IF NOT EXISTS idx_blacklisted_users_page ON blacklisted_users (page_id)",
+    "CREATE INDEX IF NOT EXISTS idx_comment_tasks_priority ON comment_tasks (page_id, state, priority_tier, priority)",
+]
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = set()
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Return a connection owned by the calling thread, creating the schema on first use
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "path", None) != DB_PATH:
+        conn = sqlite3.connect(DB_PATH, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+        _local.path = DB_PATH
+    with _schema_lock:
+        if DB_PATH not in _schema_ready:
+            for statement in SCHEMA:
+                conn.execute(statement)
+            for statement in MIGRATIONS:
+                try:
+                    conn.execute(statement)
+                except sqlite3.OperationalError as e:
+                    if "duplicate column" not in str(e):
+                        raise
+            for statement in POST_MIGRATION_SCHEMA:
+                conn.execute(statement)
+            conn.commit()
+            _schema_ready.add(DB_PATH)
+    return conn
+
+
+# ---- Crawl watermarks ----
+
+def get_post_watermarks(page_id: str) -> Dict[str, Dict[str, Optional[str]]]:
+    conn = get_connection()
+    rows = conn.execute(
+        "SELECT post_id, updated_time, last_comment_time FROM post_watermarks WHERE page_id = ?",
+        (page_id,)
+    ).fetchall()
+    return {
+        row["post_id"]: {"updated_time": row["updated_time"], "last_comment_time": row["last_comment_time"]}
+        for row in rows
+    }
+
+
+def set_post_watermark(page_id: str, post_id: str, updated_time: Optional[str], last_comment_time: Optional[str]):
+    conn = get_connection()
+    conn.execute(
+        """
+        INSERT INTO post_watermarks (post_id, page_id, updated_time, last_comment_time)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(post_id) DO UPDATE SET
+            updated_time = excluded.updated_time,
+            last_comment_time = COALESCE(excluded.last_comment_time, post_watermarks.last_comment_time)
+        """,
+        (post_id, page_id, updated_time, last_comment_time)
+    )
+    conn.commit()
+
+
+def get_page_watermark(page_id: str) -> Dict[str, Optional[str]]:
+    conn = get_connection()
+    row = conn.execute(
+        "SELECT last_post_time, last_crawl_time FROM page_watermarks WHERE page_id = ?",
+        (page_id,)
+    ).fetchone()
+    if row is None:
+        return {"last_post_time": None, "last_crawl_time": None}
+    return {"last_post_time": row["last_post_time"], "last_crawl_time": row["last_crawl_time"]}
+
+
+def set_page_watermark(page_id: str, last_post_time: Optional[str], last_crawl_time: str):
+    conn = get_connection()
+    conn.execute(
+        """
+        INSERT INTO page_watermarks (page_id, last_post_time, last_crawl_time)
+        VALUES (?, ?, ?)
+        ON CONFLICT(page_id) DO UPDATE SET
+            last_post_time = COALESCE(excluded.last_post_time, page_watermarks.last_post_time),
+            last_crawl_time = excluded.last_crawl_time
+        """,
+        (page_id, last_post_time, last_crawl_time)
+    )
+    conn.commit()
+
+
+def clear_watermarks(page_id: str):
+    conn = get_connection()
+    conn.execute("DELETE FROM post_watermarks WHERE page_id = ?", (page_id,))
+    conn.execute("DELETE FROM page_watermarks WHERE page_id = ?", (page_id,))
+    conn.commit()
+
+
+# ---- Replied comment index ----
+
+def load_replied_comment_ids(page_id: str) -> Set[str]:
+    conn = get_connection()
+    rows = conn.execute("SELECT comment_id FROM replied_comments WHERE page_id = ?", (page_id,))
+    return {row["comment_id"] for row in rows}
+
+
+def add_replied_comments(page_id: str, comment_ids: Iterable[str], reason: str):
+    conn = get_connection()
+    recorded_at = datetime.now().isoformat()
+    conn.executemany(
+        "INSERT OR IGNORE INTO replied_comments (comment_id, page_id, reason, recorded_at) VALUES (?, ?, ?, ?)",
+        ((comment_id, page_id, reason, recorded_at) for comment_id in comment_ids)
+    )
+    conn.commit()
+
+
+def is_comment_replied(page_id: str, comment_id: str) -> bool:
+    conn = get_connection()
+    row = conn.execute(
+        "SELECT 1 FROM replied_comments WHERE comment_id = ? AND page_id = ?", (comment_id, page_id)
+    ).fetchone()
+    return row is not None
+
+
+# ---- Reply log ----
+
+REPLY_LOG_COLUMNS = ("page_id", "comment_id", "full_comment_id", "post_id", "post_message", "post_url", "post_time",
+                     "comment_message", "comment_url", "comment_time", "commenter_id", "commenter_name", "reply",
+                     "job_id", "source", "replied_at")
+
+
+def add_reply_log_entries(entries: Iterable[Dict[str, Any]]) -> int:
+    """
+    Record replies (dicts keyed by REPLY_LOG_COLUMNS). A comment is logged once per page;
+    entries for comments already in the log are ignored. Returns how many were added.
+    """
+    conn = get_connection()
+    now = time.time()
+    cursor = conn.executemany(
+        f"INSERT OR IGNORE INTO reply_log ({', '.join(REPLY_LOG_COLUMNS)}) "
+        f"VALUES ({', '.join('?' for _ in REPLY_LOG_COLUMNS)})",
+        (
+            tuple(entry.get(column) for column in REPLY_LOG_COLUMNS[:-2])
+            + (entry.get("source") or "reply", entry.get("replied_at") or now)
+            for entry in entries
+        )
+    )
+    conn.commit()
+    return cursor.rowcount
+
+
+def _reply_log_filters(page_id: str, post_id: Optional[str], commenter: Optional[str], since: Optional[float],
+                       until: Optional[float]) -> Tuple[str, List[Any]]:
+    clauses, params = ["page_id = ?"], [page_id]
+    if post_id:
+        clauses.append("post_id = ?")
+        params.append(post_id)
+    if commenter:
+        # Commenter IDs are numeric; anything else is matched against the name
+        if commenter.isdigit():
+            clauses.append("commenter_id = ?")
+        else:
+            clauses.append("commenter_name = ? COLLATE NOCASE")
+        params.append(commenter)
+    # Imported sheet rows carry their own (older) times, so ids are not in replied_at order
+    # and the time bounds have to be checked on replied_at itself
+    if since is not None:
+        clauses.append("replied_at >= ?")
+        params.append(since)
+    if until is not None:
+        clauses.append("replied_at < ?")
+        params.append(until)
+    return " AND ".join(clauses), params
+
+
+def query_reply_log(page_id: str, post_id: Optional[str] = None, commenter: Optional[str] = None,
+                    since: Optional[float] = None, until: Optional[float] = None, before_id: Optional[int] = None,
+                    limit: int = 50) -> List[Dict[str, Any]]:
+    """
+    Newest replies first. Pages are keyed on the row id: pass the last id of one page as
+    before_id to get the next, which stays fast however deep the log goes.
+    """
+    where, params = _reply_log_filters(page_id, post_id, commenter, since, until)
+    if before_id is not None:
+        where += " AND id < ?"
+        params.append(before_id)
+    conn = get_connection()
+    rows = conn.execute(
+        f"SELECT id, {', '.join(REPLY_LOG_COLUMNS)} FROM reply_log WHERE {where} ORDER BY id DESC LIMIT ?",
+        params + [limit]
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def count_reply_log(page_id: str, post_id: Optional[str] = None, commenter: Optional[str] = None,
+                    since: Optional[float] = None, until: Optional[float] = None) -> int:
+    where, params = _reply_log_filters(page_id, post_id, commenter, since, until)
+    conn = get_connection()
+    return conn.execute(f"SELECT COUNT(*) FROM reply_log WHERE {where}", params).fetchone()[0]
+
+
+def get_reply_log_entry(page_id: str, comment_id: str) -> Optional[Dict[str, Any]]:
+    conn = get_connection()
+    row = conn.execute(
+        f"SELECT id, {', '.join(REPLY_LOG_COLUMNS)} FROM reply_log WHERE page_id = ? AND comment_id = ?",
+        (page_id, comment_id)
+    ).fetchone()
+    return dict(row) if row is not None else None
+
+
+def reply_log_post_counts(page_id: str, limit: int = 10) -> List[Tuple[str, int]]:
+    """(post_id, replies) for the posts with the most replies"""
+    conn = get_connection()
+    rows = conn.execute(
+        "SELECT post_id, COUNT(*) AS replies FROM reply_log WHERE page_id = ? GROUP BY post_id ORDER BY replies DESC LIMIT ?",
+        (page_id, limit)
+    ).fetchall()
+    return [(row["post_id"], row["replies"]) for row in rows]
+
+
+# ---- Dry runs ----
+
+def start_dry_run(run_id: str, page_id: str):
+    conn = get_connection()
+    conn.execute("INSERT INTO dry_runs (run_id, page_id, started_at) VALUES (?, ?, ?)", (run_id, page_id, time.time()))
+    conn.commit()
+
+
+def finish_dry_run(run_id: str, report: Dict[str, Any]):
+    conn = get_connection()
+    conn.execute(
+        "UPDATE dry_runs SET report_json = ?, finished_at = ? WHERE run_id = ?",
+        (json.dumps(report, ensure_ascii=False), time.time(), run_id)
+    )
+    conn.commit()
+
+
+def get_dry_run(run_id: str) -> Optional[Dict[str, Any]]:
+    conn = get_connection()
+    row = conn.execute(
+        "SELECT run_id, page_id, report_json, started_at, finished_at FROM dry_runs WHERE run_id = ?", (run_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    return {
+        "run_id": row["run_id"],
+        "page_id": row["page_id"],
+        "report": json.loads(row["report_json"]) if row["report_json"] else None,
+        "started_at": row["started_at"],
+        "finished_at": row["finished_at"]
+    }
+
+
+def add_dry_run_reply(run_id: str, entry: Dict[str, Any]):
+    """Record a reply a dry run would have posted (entry keyed like the reply log)"""
+    conn = get_connection()
+    conn.execute(
+        f"INSERT INTO dry_run_replies (run_id, {', '.join(REPLY_LOG_COLUMNS)}) "
+        f"VALUES (?, {', '.join('?' for _ in REPLY_LOG_COLUMNS)})",
+        (run_id,) + tuple(entry.get(column) for column in REPLY_LOG_COLUMNS[:-2]) + ("dry_run", time.time())
+    )
+    conn.commit()
+
+
+def query_dry_run_replies(run_id: str, before_id: Optional[int] = None, limit: int = 50) -> List[Dict[str, Any]]:
+    conn = get_connection()
+    rows = conn.execute(
+        f"SELECT id, {', '.join(REPLY_LOG_COLUMNS)} FROM dry_run_replies "
+        f"WHERE run_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+        (run_id, before_id if before_id is not None else 2 ** 63 - 1, limit)
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def is_source_warmed(source: str) -> bool:
+    conn = get_connection()
+    row = conn.execute("SELECT 1 FROM reply_index_sources WHERE source = ?", (source,)).fetchone()
+    return row is not None
+
+
+def mark_source_warmed(source: str):
+    conn = get_connection()
+    conn.execute(
+        "INSERT OR REPLACE INTO reply_index_sources (source, warmed_at) VALUES (?, ?)",
+        (source, datetime.now().isoformat())
+    )
+    conn.commit()
+
+
+# ---- Reply cache ----
+
+def get_reply_cache_entry(cache_key: str) -> Optional[Dict[str, Any]]:
+    conn = get_connection()
+    row = conn.execute(
+        "SELECT reply, offensive, created_at, uses FROM reply_cache WHERE cache_key = ?", (cache_key,)
+    ).fetchone()
+    if row is None:
+        return None
+    return {"reply": row["reply"], "offensive": bool(row["offensive"]), "created_at": row["created_at"], "uses": row["uses"]}
+
+
+def put_reply_cache_entry(cache_key: str, entry: Dict[str, Any]):
+    conn = get_connection()
+    conn.execute(
+        "INSERT OR REPLACE INTO reply_cache (cache_key, reply, offensive, created_at, uses) VALUES (?, ?, ?, ?, ?)",
+        (cache_key, entry["reply"], int(entry["offensive"]), entry["created_at"], entry["uses"])
+    )
+    conn.commit()
+
+
+def delete_reply_cache_entry(cache_key: str):
+    conn = get_connection()
+    conn.execute("DELETE FROM reply_cache WHERE cache_key = ?", (cache_key,))
+    conn.commit()
+
+
+def prune_reply_cache(before: float, max_rows: int) -> int:
+    """Drop entries created before `before`, then the oldest beyond max_rows; returns how many went"""
+    conn = get_connection()
+    removed = conn.execute("DELETE FROM reply_cache WHERE created_at < ?", (before,)).rowcount
+    if max_rows > 0:
+        removed += conn.execute(
+            "DELETE FROM reply_cache WHERE created_at < "
+            "(SELECT created_at FROM reply_cache ORDER BY created_at DESC LIMIT 1 OFFSET ?)",
+            (max_rows - 1,)
+        ).rowcount
+    conn.commit()
+    return removed
+
+
+def clear_reply_cache():
+    conn = get_connection()
+    conn.execute("DELETE FROM reply_cache")
+    conn.commit()
+
+
+# ---- Sheets write-ahead buffer ----
+
+def add_sheet_outbox_row(sheet_id: str, sheet_name: str, credentials_key: str, row: List[Any]) -> int:
+    """Buffer a row for the sheet writer and return how many rows are now pending"""
+    conn = get_connection()
+    conn.execute(
+        "INSERT INTO sheet_outbox (sheet_id, sheet_name, credentials_key, row_json, created_at) VALUES (?, ?, ?, ?, ?)",
+        (sheet_id, sheet_name, credentials_key, json.dumps(row, ensure_ascii=False), datetime.now().isoformat())
+    )
+    conn.commit()
+    return count_sheet_outbox_rows()
+
+
+def claim_sheet_outbox_rows(owner: str, credentials_keys: List[str], claim_seconds: float,
+                            limit: int = 1000) -> List[Tuple[int, str, str, str, List[Any]]]:
+    """
+    Claim the oldest buffered rows written with one of `credentials_keys` that no other
+    writer holds, so processes sharing the store never append the same row twice. Rows for
+    credentials no job has registered since a restart stay put without holding back the
+    rest. A claim that runs out (its writer died) can be taken over.
+    """
+    if not credentials_keys:
+        return []
+    conn = get_connection()
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute(
+            "SELECT id, sheet_id, sheet_name, credentials_key, row_json FROM sheet_outbox "
+            f"WHERE credentials_key IN ({', '.join('?' for _ in credentials_keys)}) "
+            "AND (claimed_until IS NULL OR claimed_until < ?) ORDER BY id LIMIT ?",
+            (*credentials_keys, now, limit)
+        ).fetchall()
+        conn.executemany(
+            "UPDATE sheet_outbox SET claimed_by = ?, claimed_until = ? WHERE id = ?",
+            ((owner, now + claim_seconds, row["id"]) for row in rows)
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return [
+        (row["id"], row["sheet_id"], row["sheet_name"], row["credentials_key"], json.loads(row["row_json"]))
+        for row in rows
+    ]
+
+
+def release_sheet_outbox_rows(row_ids: List[int], owner: str):
+    """Hand claimed rows back after a failed write so the next flush, in any process, retries them"""
+    conn = get_connection()
+    conn.executemany(
+        "UPDATE sheet_outbox SET claimed_by = NULL, claimed_until = NULL WHERE id = ? AND claimed_by = ?",
+        ((row_id, owner) for row_id in row_ids)
+    )
+    conn.commit()
+
+
+def delete_sheet_outbox_rows(row_ids: List[int]):
+    conn = get_connection()
+    conn.executemany("DELETE FROM sheet_outbox WHERE id = ?", ((row_id,) for row_id in row_ids))
+    conn.commit()
+
+
+def count_sheet_outbox_rows() -> int:
+    conn = get_connection()
+    return conn.execute("SELECT COUNT(*) FROM sheet_outbox").fetchone()[0]
+
+
+# ---- Blacklist ----
+
+def load_blacklist(page_id: str = "") -> List[Tuple[int, Optional[str], Optional[str]]]:
+    conn = get_connection()
+    rows = conn.execute("SELECT id, user_id, user_name FROM blacklisted_users WHERE page_id = ? ORDER BY id", (page_id,))
+    return [(row["id"], row["user_id"], row["user_name"]) for row in rows]
+
+
+def add_blacklist_entries(users: List[Tuple[Optional[str], Optional[str]]], page_id: str = "") -> List[int]:
+    """Insert (user_id, user_name) pairs and return their row IDs in the same order"""
+    conn = get_connection()
+    entry_ids = []
+    for user_id, user_name in users:
+        cursor = conn.execute(
+            "INSERT INTO blacklisted_users (user_id, user_name, page_id) VALUES (?, ?, ?)", (user_id, user_name, page_id)
+        )
+        entry_ids.append(cursor.lastrowid)
+    conn.commit()
+    return entry_ids
+
+
+def delete_blacklist_entries(entry_ids: List[int]):
+    conn = get_connection()
+    conn.executemany("DELETE FROM blacklisted_users WHERE id = ?", ((entry_id,) for entry_id in entry_ids))
+    conn.commit()
+
+
+def clear_blacklist(page_id: str = ""):
+    conn = get_connection()
+    conn.execute("DELETE FROM blacklisted_users WHERE page_id = ?", (page_id,))
+    conn.commit()
+
+
+# ---- Comment work queue ----
+# States: queued -> in_progress -> replied | skipped, or back to queued for a retry until failed
+
+def enqueue_comment_tasks(page_id: str, tasks: List[Tuple[str, str, Dict[str, Any], Optional[float], int]]) -> int:
+    """
+    Queue (comment_id, post_id, task, comment_time, post_engagement) rows; comments already
+    in the queue are left alone apart from picking up their post's latest engagement
+    """
+    conn = get_connection()
+    now = time.time()
+    cursor = conn.executemany(
+        """
+        INSERT OR IGNORE INTO comment_tasks
+            (comment_id, page_id, post_id, task_json, state, next_attempt_at, created_at, updated_at,
+             comment_time, post_engagement)
+        VALUES (?, ?, ?, ?, 'queued', ?, ?, ?, ?, ?)
+        """,
+        ((comment_id, page_id, post_id, json.dumps(task, ensure_ascii=False), now, now, now, comment_time, engagement)
+         for comment_id, post_id, task, comment_time, engagement in tasks)
+    )
+    added = cursor.rowcount
+    engagement_by_post = {post_id: engagement for _, post_id, _, _, engagement in tasks}
+    conn.executemany(
+        "UPDATE comment_tasks SET post_engagement = ? WHERE page_id = ? AND post_id = ? AND state = 'queued'",
+        ((engagement, page_id, post_id) for post_id, engagement in engagement_by_post.items())
+    )
+    conn.commit()
+    return added
+
+
+def lease_comment_tasks(page_id: str, owner: str, limit: int, lease_seconds: float,
+                        comment_ids: Optional[List[str]] = None,
+                        min_attempts: int = 0) -> List[Tuple[str, Dict[str, Any], int]]:
+    """
+    Claim up to `limit` tasks that are due, including in-progress tasks whose lease ran out
+    (their worker died). Returns (comment_id, task, attempts), highest priority first:
+    the lowest fairness tier, then the highest score. comment_ids limits the claim to those
+    comments, min_attempts to tasks that failed at least that often.
+    """
+    conn = get_connection()
+    now = time.time()
+    filters, params = "", [page_id, now, now, min_attempts]
+    if comment_ids is not None:
+        filters = f"AND comment_id IN ({', '.join('?' * len(comment_ids))})"
+        params += comment_ids
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute(
+            f"""
+            SELECT comment_id, task_json, attempts FROM comment_tasks
+            WHERE page_id = ? AND (
+                (state = 'queued' AND next_attempt_at <= ?) OR (state = 'in_progress' AND lease_expires < ?)
+            ) AND attempts >= ? {filters}
+            ORDER BY priority_tier, priority DESC, next_attempt_at LIMIT ?
+            """,
+            params + [limit]
+        ).fetchall()
+        conn.executemany(
+            "UPDATE comment_tasks SET state = 'in_progress', lease_owner = ?, lease_expires = ?, updated_at = ? WHERE comment_id = ?",
+            ((owner, now + lease_seconds, now, row["comment_id"]) for row in rows)
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return [(row["comment_id"], json.loads(row["task_json"]), row["attempts"]) for row in rows]
+
+
+def finish_comment_task(comment_id: str, state: str, error: Optional[str] = None):
+    conn = get_connection()
+    conn.execute(
+        """
+        UPDATE comment_tasks SET state = ?, last_error = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ?
+        WHERE comment_id = ?
+        """,
+        (state, error, time.time(), comment_id)
+    )
+    conn.commit()
+
+
+def retry_comment_task(comment_id: str, delay: float, error: Optional[str], max_attempts: int,
+                       task: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Count a failed attempt and queue the task again after `delay`, or mark it failed; returns
+    the new state. `task`, when given, replaces the stored task.
+    """
+    conn = get_connection()
+    now = time.time()
+    conn.execute(
+        """
+        UPDATE comment_tasks SET
+            attempts = attempts + 1,
+            state = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'queued' END,
+            task_json = COALESCE(?, task_json),
+            next_attempt_at = ?, last_error = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ?
+        WHERE comment_id = ?
+        """,
+        (max_attempts, json.dumps(task) if task is not None else None, now + delay, error, now, comment_id)
+    )
+    conn.commit()
+    row = conn.execute("SELECT state FROM comment_tasks WHERE comment_id = ?", (comment_id,)).fetchone()
+    return row["state"] if row else "failed"
+
+
+def release_comment_tasks(page_id: str, owner: str) -> int:
+    """Hand back tasks this owner leased but never finished, without counting an attempt"""
+    conn = get_connection()
+    cursor = conn.execute(
+        """
+        UPDATE comment_tasks SET state = 'queued', lease_owner = NULL, lease_expires = NULL, updated_at = ?
+        WHERE page_id = ? AND state = 'in_progress' AND lease_owner = ?
+        """,
+        (time.time(), page_id, owner)
+    )
+    conn.commit()
+    return cursor.rowcount
+
+
+def get_comment_priority_inputs(page_id: str) -> List[Tuple[str, str, Optional[float], int, float]]:
+    """(comment_id, post_id, comment_time, post_engagement, created_at) of every queued task"""
+    conn = get_connection()
+    rows = conn.execute(
+        """
+        SELECT comment_id, post_id, comment_time, post_engagement, created_at FROM comment_tasks
+        WHERE page_id = ? AND state = 'queued'
+        """,
+        (page_id,)
+    )
+    return [
+        (row["comment_id"], row["post_id"], row["comment_time"], row["post_engagement"], row["created_at"])
+        for row in rows
+    ]
+
+
+def set_comment_priorities(priorities: Iterable[Tuple[float, int, str]]):
+    """Store (priority, priority_tier, comment_id) triples"""
+    conn = get_connection()
+    conn.executemany("UPDATE comment_tasks SET priority = ?, priority_tier = ? WHERE comment_id = ?", priorities)
+    conn.commit()
+
+
+def comment_task_backlog(page_id: str, limit: int = 10) -> List[Tuple[str, int, float]]:
+    """(post_id, pending tasks, oldest comment_time) for the posts with the most unfinished tasks"""
+    conn = get_connection()
+    rows = conn.execute(
+        """
+        SELECT post_id, COUNT(*) AS pending, MIN(comment_time) AS oldest FROM comment_tasks
+        WHERE page_id = ? AND state IN ('queued', 'in_progress')
+        GROUP BY post_id ORDER BY pending DESC LIMIT ?
+        """,
+        (page_id, limit)
+    )
+    return [(row["post_id"], row["pending"], row["oldest"]) for row in rows]
+
+
+def requeue_failed_comment_tasks(page_id: str) -> int:
+    conn = get_connection()
+    now = time.time()
+    cursor = conn.execute(
+        """
+        UPDATE comment_tasks SET state = 'queued', attempts = 0, next_attempt_at = ?, updated_at = ?
+        WHERE page_id = ? AND state = 'failed'
+        """,
+        (now, now, page_id)
+    )
+    conn.commit()
+    return cursor.rowcount
+
+
+def purge_comment_tasks(before: float) -> int:
+    """Drop replied and skipped tasks last touched before `before`; they only matter as history"""
+    conn = get_connection()
+    cursor = conn.execute(
+        "DELETE FROM comment_tasks WHERE state IN ('replied', 'skipped') AND updated_at < ?", (before,)
+    )
+    conn.commit()
+    return cursor.rowcount
+
+
+def comment_task_stats(page_id: Optional[str] = None) -> Dict[str, Any]:
+    conn = get_connection()
+    where, params = ("WHERE page_id = ?", (page_id,)) if page_id else ("", ())
+    counts = {
+        row["state"]: row["count"] for row in conn.execute(
+            f"SELECT state, COUNT(*) AS count FROM comment_tasks {where} GROUP BY state", params
+        )
+    }
+    row = conn.execute(
+        f"SELECT MIN(created_at) AS oldest, SUM(next_attempt_at <= ?) AS due FROM comment_tasks "
+        f"{where + ' AND' if where else 'WHERE'} state = 'queued'",
+        (time.time(),) + params
+    ).fetchone()
+    return {"counts": counts, "oldest_queued_at": row["oldest"], "due": row["due"] or 0}
+
+
+# ---- Scheduled jobs ----
+
+def save_scheduled_job(job_id: str, start_time: str, duration_seconds: int, settings: Dict[str, Any], created_at: str):
+    conn = get_connection()
+    conn.execute(
+        "INSERT OR REPLACE INTO scheduled_jobs (job_id, start_time, duration_seconds, settings_json, created_at) VALUES (?, ?, ?, ?, ?)",
+        (job_id, start_time, duration_seconds, json.dumps(settings, ensure_ascii=False), created_at)
+    )
+    conn.commit()
+
+
+def load_scheduled_jobs() -> List[Tuple[str, str, int, Dict[str, Any], str]]:
+    conn = get_connection()
+    rows = conn.execute(
+        "SELECT job_id, start_time, duration_seconds, settings_json, created_at FROM scheduled_jobs ORDER BY created_at"
+    )
+    return [
+        (row["job_id"], row["start_time"], row["duration_seconds"], json.loads(row["settings_json"]), row["created_at"])
+        for row in rows
+    ]
+
+
+def delete_scheduled_job(job_id: str):
+    conn = get_connection()
+    conn.execute("DELETE FROM scheduled_jobs WHERE job_id = ?", (job_id,))
+    conn.commit()
+
+
+def load_blacklist_scopes() -> List[str]:
+    conn = get_connection()
+    return [row["page_id"] for row in conn.execute("SELECT DISTINCT page_id FROM blacklisted_users")]
+
+
+# ---- Per-page settings ----
+# page_id "" holds the global settings every page falls back to
+
+def get_page_setting(page_id: str, name: str) -> Optional[Any]:
+    conn = get_connection()
+    row = conn.execute(
+        "SELECT value_json FROM page_settings WHERE page_id = ? AND name = ?", (page_id, name)
+    ).fetchone()
+    return json.loads(row["value_json"]) if row else None
+
+
+def set_page_setting(page_id: str, name: str, value: Any):
+    conn = get_connection()
+    conn.execute(
+        "INSERT OR REPLACE INTO page_settings (page_id, name, value_json, updated_at) VALUES (?, ?, ?, ?)",
+        (page_id, name, json.dumps(value, ensure_ascii=False), time.time())
+    )
+    conn.commit()
+
+
+def load_page_settings() -> List[Tuple[str, str, Any]]:
+    conn = get_connection()
+    rows = conn.execute("SELECT page_id, name, value_json FROM page_settings")
+    return [(row["page_id"], row["name"], json.loads(row["value_json"])) for row in rows]
+
+
+# ---- Page leases ----
+# A worker process holds a page's lease while it runs a job for it, so no two processes
+# ever work on the same page at once
+
+def acquire_page_lease(page_id: str, owner: str, ttl_seconds: float) -> bool:
+    """Take or extend the lease; fails while another owner holds an unexpired one"""
+    conn = get_connection()
+    now = time.time()
+    cursor = conn.execute(
+        """
+        INSERT INTO page_leases (page_id, owner, expires_at) VALUES (?, ?, ?)
+        ON CONFLICT(page_id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+        WHERE page_leases.owner = excluded.owner OR page_leases.expires_at < ?
+        """,
+        (page_id, owner, now + ttl_seconds, now)
+    )
+    conn.commit()
+    return cursor.rowcount > 0
+
+
+def release_page_lease(page_id: str, owner: str):
+    conn = get_connection()
+    conn.execute("DELETE FROM page_leases WHERE page_id = ? AND owner = ?", (page_id, owner))
+    conn.commit()
+
+
+def get_page_leases() -> Dict[str, Dict[str, Any]]:
+    conn = get_connection()
+    rows = conn.execute("SELECT page_id, owner, expires_at FROM page_leases WHERE expires_at >= ?", (time.time(),))
+    return {row["page_id"]: {"owner": row["owner"], "expires_at": row["expires_at"]} for row in rows}
+
+
+# ---- Rate limits ----
+
+def set_rate_limit(name: str, per_minute: float, burst: int):
+    conn = get_connection()
+    conn.execute(
+        "INSERT OR REPLACE INTO rate_limits (name, per_minute, burst, updated_at) VALUES (?, ?, ?, ?)",
+        (name, per_minute, burst, time.time())
+    )
+    conn.commit()
+
+
+def get_rate_limits() -> Dict[str, Tuple[float, int]]:
+    """Limits changed through the API, as (per_minute, burst) totals across all processes"""
+    conn = get_connection()
+    rows = conn.execute("SELECT name, per_minute, burst FROM rate_limits")
+    return {row["name"]: (row["per_minute"], row["burst"]) for row in rows}
@@ -0,0 +1,72 @@
+import json
+from typing import Any, Callable, Dict, List, Optional
+
+import pytest
+import requests
+
+import credential_store
+import graph_api
+import storage
+from rate_limit import RateLimiter
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path, monkeypatch):
+    """Every test gets its own SQLite store and credentials file instead of the ones in backend/"""
+    monkeypatch.setattr(storage, "DB_PATH", str(tmp_path / "replybot.db"))
+    monkeypatch.setattr(credential_store, "CREDENTIALS_PATH", str(tmp_path / "replybot.credentials.json"))
+    return storage
+
+
+def graph_response(status: int = 200, body: Any = None, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps(body if body is not None else {}).encode("utf-8")
+    response.headers.update(headers or {})
+    response.url = "https://graph.test/"
+    return response
+
+
+class StubSession:
+    """
+    Stands in for the shared requests session. `handler(method, url, kwargs)` returns a
+    Response or raises; every call is kept in `calls`.
+    """
+
+    def __init__(self, handler: Callable[[str, str, Dict[str, Any]], requests.Response]):
+        self.handler = handler
+        self.calls: List[Dict[str, Any]] = []
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        self.calls.append({"method": method, "url": url, **kwargs})
+        return self.handler(method, url, kwargs)
+
+
+@pytest.fixture
+def graph(monkeypatch):
+    """
+    Route graph_api through a StubSession with unthrottled buckets, a fresh usage throttle
+    and a sleep that only records how long it was asked to wait. Set graph.handler, or
+    graph.responses for a fixed sequence.
+    """
+
+    class Graph:
+        responses: List[Any] = []
+        sleeps: List[float] = []
+
+        @staticmethod
+        def handler(method, url, kwargs):
+            response = Graph.responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+    session = StubSession(lambda method, url, kwargs: Graph.handler(method, url, kwargs))
+    Graph.session = session
+    Graph.limiter = RateLimiter({"graph_read": (1e6, 1000), "graph_write": (1e6, 1000)})
+    Graph.throttle = graph_api.UsageThrottle()
+    monkeypatch.setattr(graph_api, "_session", session)
+    monkeypatch.setattr(graph_api, "rate_limiter", Graph.limiter)
+    monkeypatch.setattr(graph_api, "usage_throttle", Graph.throttle)
+    monkeypatch.setattr(graph_api.time, "sleep", Graph.sleeps.append)
+    return Graph
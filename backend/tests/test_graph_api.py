@@ -0,0 +1,259 @@
+import json
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+
+import graph_api
+from graph_api import GraphAPIClient, GraphAPIError
+from conftest import graph_response
+
+
+def client() -> GraphAPIClient:
+    return GraphAPIClient("token", base_url="https://graph.test")
+
+
+def batch_answer(body=None, code=200):
+    return {"code": code, "body": json.dumps(body if body is not None else {})}
+
+
+# ---- Batch requests ----
+
+def test_batch_splits_into_chunks_and_decodes_bodies(graph):
+    def handler(method, url, kwargs):
+        items = json.loads(kwargs["data"]["batch"])
+        return graph_response(body=[batch_answer({"url": item["relative_url"]}) for item in items])
+    graph.handler = handler
+
+    urls = [f"{n}/comments" for n in range(120)]
+    results = client().batch(urls)
+
+    assert [len(json.loads(call["data"]["batch"])) for call in graph.session.calls] == [50, 50, 20]
+    assert all(call["method"] == "POST" and call["url"] == "https://graph.test/" for call in graph.session.calls)
+    assert [result["url"] for result in results] == urls
+    # Every request inside a batch counts against the read quota
+    assert graph.limiter.snapshot()["graph_read"]["acquired"] == 120
+
+
+def test_batch_returns_none_for_failed_items(graph):
+    graph.responses = [graph_response(body=[
+        batch_answer({"data": [1]}),
+        batch_answer({"error": {"message": "gone"}}, code=404),
+        None,
+        {"code": 200, "body": "not json"},
+    ])]
+    assert client().batch(["a", "b", "c", "d"]) == [{"data": [1]}, None, None, None]
+
+
+def test_batch_raises_when_the_whole_request_fails(graph):
+    graph.responses = [graph_response(status=400, body={"error": {"code": 100}})]
+    with pytest.raises(GraphAPIError):
+        client().batch(["a"])
+
+
+def test_iter_pages_follows_paging_links(graph):
+    graph.responses = [
+        graph_response(body={"data": [1, 2], "paging": {"next": "https://graph.test/v22.0/p/feed?after=x"}}),
+        graph_response(body={"data": [3]}),
+    ]
+    assert list(client().iter_pages("p/feed", {"fields": "id"})) == [[1, 2], [3]]
+    first, second = graph.session.calls
+    assert first["params"] == {"access_token": "token", "fields": "id"}
+    # The paging link already carries the token and query
+    assert second["url"].endswith("after=x") and second["params"] is None
+
+
+# ---- Retries ----
+
+def test_get_is_retried_after_a_server_error(graph):
+    graph.responses = [graph_response(status=500), graph_response(body={"name": "Page"})]
+    assert client().get_page_name("p") == "Page"
+    assert len(graph.session.calls) == 2
+    assert len(graph.sleeps) == 1
+
+
+def test_get_is_retried_after_a_connection_error(graph):
+    graph.responses = [requests.exceptions.ConnectionError("reset"), graph_response(body={"name": "Page"})]
+    assert client().get_page_name("p") == "Page"
+    assert len(graph.session.calls) == 2
+
+
+def test_retry_after_header_sets_the_delay(graph):
+    graph.responses = [graph_response(status=429, headers={"Retry-After": "7"}), graph_response(body={})]
+    client().get("p")
+    assert graph.sleeps == [7.0]
+
+
+def test_retries_stop_after_max_retries(graph):
+    graph.handler = lambda method, url, kwargs: graph_response(status=503)
+    with pytest.raises(GraphAPIError):
+        client().get("p")
+    assert len(graph.session.calls) == graph_api.MAX_RETRIES + 1
+
+
+def test_post_is_not_retried_after_a_server_error(graph):
+    # The reply may have been posted even though Facebook answered 500
+    graph.responses = [graph_response(status=500), graph_response(body={"id": "r"})]
+    with pytest.raises(GraphAPIError):
+        client().post("c/comments", {"message": "hi"})
+    assert len(graph.session.calls) == 1
+
+
+def test_post_is_not_retried_after_a_connection_error(graph):
+    graph.responses = [requests.exceptions.ConnectionError("reset")]
+    with pytest.raises(GraphAPIError):
+        client().post("c/comments", {"message": "hi"})
+    assert len(graph.session.calls) == 1
+
+
+def test_post_is_retried_when_throttled(graph):
+    graph.responses = [
+        graph_response(status=400, body={"error": {"code": 613, "message": "Calls to this api have exceeded the rate limit"}}),
+        graph_response(body={"id": "r"}),
+    ]
+    assert client().post("c/comments", {"message": "hi"}) == {"id": "r"}
+    assert len(graph.session.calls) == 2
+    assert graph.limiter.snapshot()["graph_write"]["acquired"] == 2
+
+
+def test_other_client_errors_are_not_retried(graph):
+    graph.responses = [graph_response(status=400, body={"error": {"code": 100, "message": "Invalid parameter"}})]
+    with pytest.raises(GraphAPIError):
+        client().get("p")
+    assert len(graph.session.calls) == 1
+
+
+# ---- Usage throttling ----
+
+def usage_header(**usage):
+    return {"X-App-Usage": json.dumps(usage)}
+
+
+def test_high_usage_spaces_out_the_next_call(graph):
+    graph.responses = [
+        graph_response(body={}, headers=usage_header(call_count=90, total_time=10, total_cputime=5)),
+        graph_response(body={}),
+    ]
+    client().get("p")
+    assert graph.sleeps == []
+    client().get("p")
+    # 90% is 60% of the way from the 75% threshold to 100%
+    assert graph.sleeps == [pytest.approx(0.6 * graph_api.UsageThrottle.MAX_DELAY_SECONDS)]
+
+
+def test_low_usage_does_not_throttle(graph):
+    graph.responses = [graph_response(body={}, headers=usage_header(call_count=40)), graph_response(body={})]
+    client().get("p")
+    client().get("p")
+    assert graph.sleeps == []
+
+
+def test_regain_access_time_blocks_calls():
+    throttle = graph_api.UsageThrottle()
+    throttle.update({"X-Business-Use-Case-Usage": json.dumps({
+        "123": [{"type": "pages", "call_count": 100, "estimated_time_to_regain_access": 2}]
+    })})
+    assert throttle.usage_percent == 100
+    assert 119 < throttle.delay() <= 120
+
+
+def test_malformed_usage_headers_are_ignored():
+    throttle = graph_api.UsageThrottle()
+    throttle.update({"X-App-Usage": "not json", "X-Page-Usage": json.dumps({"call_count": 10})})
+    assert throttle.usage_percent == 10
+    assert throttle.delay() == 0
+
+
+def test_endpoint_names_collapse_object_ids():
+    assert graph_api.endpoint_name("GET", "https://graph.test/v22.0/123_456/comments") == "GET /{id}/comments"
+    assert graph_api.endpoint_name("POST", "https://graph.test/") == "POST /"
+
+
+def test_requests_carry_the_access_token(graph):
+    graph.responses = [graph_response(body={"name": "Page"})]
+    client().get_page_name("p")
+    call = graph.session.calls[0]
+    assert urlparse(call["url"]).path == "/v22.0/p"
+    assert call["params"] == {"access_token": "token", "fields": "name"}
+    assert not parse_qs(urlparse(call["url"]).query)
+
+
+# ---- Incremental crawl ----
+
+def graph_comment(n, created_time="2025-05-01T10:00:00+0000"):
+    return {"id": f"200_{n}", "message": f"comment {n}", "created_time": created_time, "from": {"id": str(n)}}
+
+
+def feed_post(comments, next_page=None, updated_time="2025-05-01T12:00:00+0000"):
+    nested = {"data": comments}
+    if next_page:
+        nested["paging"] = {"next": f"https://graph.test/v22.0/100_200/comments?after={next_page}"}
+    return {"id": "100_200", "created_time": "2025-05-01T09:00:00+0000", "updated_time": updated_time,
+            "comments": nested}
+
+
+def crawl(graph, post, pages=None, watermarks=None):
+    """Stream one feed page holding `post`; follow-up comment pages come from `pages` by cursor"""
+    def handler(method, url, kwargs):
+        if method == "GET":
+            return graph_response(body={"name": "Page", "feed": {"data": [post]}})
+        answers = []
+        for item in json.loads(kwargs["data"]["batch"]):
+            body = (pages or {}).get(parse_qs(urlparse(item["relative_url"]).query)["after"][0])
+            answers.append(batch_answer(body) if body is not None else batch_answer(code=500))
+        return graph_response(body=answers)
+    graph.handler = handler
+    name, chunks = client().stream_page("100", post_watermarks=watermarks)
+    return name, list(chunks)
+
+
+def comment_ids(chunks):
+    return [comment.id for chunk in chunks for comment in chunk["comments"]]
+
+
+def test_truncated_comment_pages_are_followed_in_batches(graph):
+    page_2 = {"data": [graph_comment(3), graph_comment(4)],
+              "paging": {"next": "https://graph.test/v22.0/100_200/comments?after=c3"}}
+    page_3 = {"data": [graph_comment(5)]}
+    name, chunks = crawl(graph, feed_post([graph_comment(1), graph_comment(2)], "c2"), {"c2": page_2, "c3": page_3})
+    assert name == "Page"
+    assert comment_ids(chunks) == ["200_1", "200_2", "200_3", "200_4", "200_5"]
+    assert [chunk["complete"] for chunk in chunks] == [False, False, True]
+    assert [call["method"] for call in graph.session.calls] == ["GET", "POST", "POST"]
+
+
+def test_comments_that_come_round_again_are_streamed_once(graph):
+    # A new comment pushed 200_2 onto the second page while the first was being read
+    page_2 = {"data": [graph_comment(2), graph_comment(3)]}
+    _, chunks = crawl(graph, feed_post([graph_comment(1), graph_comment(2)], "c2"), {"c2": page_2})
+    assert comment_ids(chunks) == ["200_1", "200_2", "200_3"]
+
+
+def test_failed_follow_up_page_ends_the_post(graph):
+    _, chunks = crawl(graph, feed_post([graph_comment(1)], "c1"))
+    assert comment_ids(chunks) == ["200_1"]
+    assert chunks[-1]["complete"] and chunks[-1]["fetch_failed"]
+
+
+def test_comments_from_the_watermark_second_are_kept(graph):
+    watermark = "2025-05-01T10:00:00+0000"
+    comments = [
+        graph_comment(3, "2025-05-01T10:00:05+0000"),
+        graph_comment(2, watermark),
+        graph_comment(1, "2025-05-01T09:59:59+0000"),
+    ]
+    _, chunks = crawl(graph, feed_post(comments, "c1"), watermarks={
+        "100_200": {"updated_time": "2025-05-01T11:00:00+0000", "last_comment_time": watermark}
+    })
+    assert comment_ids(chunks) == ["200_3", "200_2"]
+    # An older comment ends the post, so its next page is never fetched
+    assert chunks[-1]["complete"] and len(graph.session.calls) == 1
+
+
+def test_post_not_updated_since_its_watermark_is_unchanged(graph):
+    updated_time = "2025-05-01T12:00:00+0000"
+    _, chunks = crawl(graph, feed_post([graph_comment(1)], "c1", updated_time=updated_time), watermarks={
+        "100_200": {"updated_time": updated_time, "last_comment_time": "2025-05-01T10:00:00+0000"}
+    })
+    assert len(chunks) == 1
+    assert chunks[0]["unchanged"] and chunks[0]["complete"] and chunks[0]["comments"] == []
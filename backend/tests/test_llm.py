@@ -0,0 +1,166 @@
+import json
+
+import pytest
+
+import llm
+from llm import FakeBackend, parse_moderated_reply
+from rate_limit import RateLimiter
+
+
+@pytest.fixture
+def model(monkeypatch):
+    """A FakeBackend installed as the shared model, recording every prompt it gets"""
+    import main
+    prompts = []
+    answers = {}
+
+    def responder(prompt):
+        prompts.append(prompt)
+        for marker, answer in answers.items():
+            if marker in prompt:
+                return answer
+        return FakeBackend.default_response(prompt)
+
+    backend = FakeBackend(responder)
+    backend.prompts = prompts
+    backend.answers = answers
+    monkeypatch.setattr(main, "rate_limiter", RateLimiter({"gemini": (1e6, 1000)}))
+    llm.set_llm(backend)
+    yield backend
+    llm.set_llm(None)
+
+
+def reply(mode="two_call", **kwargs):
+    import main
+    main.llm_reply_mode = mode
+    info = {}
+    try:
+        result = main.generate_ai_reply("Love this!", "New menu", result_info=info, **kwargs)
+    finally:
+        main.llm_reply_mode = "two_call"
+    return result, info
+
+
+# ---- Backend ----
+
+def test_get_llm_builds_the_model_once(monkeypatch):
+    builds = []
+    monkeypatch.setattr(llm, "build_backend", lambda: builds.append(1) or FakeBackend())
+    llm.set_llm(None)
+    try:
+        assert llm.get_llm() is llm.get_llm()
+        assert len(builds) == 1
+    finally:
+        llm.set_llm(None)
+
+
+def test_failed_build_is_not_cached(monkeypatch):
+    def build():
+        raise ValueError("Gemini API key not found in environment variables")
+
+    monkeypatch.setattr(llm, "build_backend", build)
+    llm.set_llm(None)
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            llm.get_llm()
+    monkeypatch.setattr(llm, "build_backend", FakeBackend)
+    assert isinstance(llm.get_llm(), FakeBackend)
+    llm.set_llm(None)
+
+
+def test_backends_must_implement_generate():
+    class Incomplete(llm.LLMBackend):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_fake_backend_counts_calls_and_errors():
+    def responder(prompt):
+        if prompt == "boom":
+            raise RuntimeError("model unavailable")
+        return "ok"
+
+    backend = FakeBackend(responder)
+    assert backend.generate("hi") == "ok"
+    with pytest.raises(RuntimeError):
+        backend.generate("boom")
+    stats = backend.stats()
+    assert (stats["backend"], stats["calls"], stats["errors"]) == ("fake", 2, 1)
+
+
+def test_fake_backend_async():
+    import asyncio
+    assert asyncio.run(FakeBackend(lambda prompt: prompt.upper()).agenerate("hi")) == "HI"
+
+
+# ---- Single-call answers ----
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"offensive": false, "reply": " Thanks! "}', (False, "Thanks!")),
+    ('```json\n{"offensive": "yes", "reply": ""}\n```', (True, "")),
+    ('Sure! {"offensive": false, "reply": "Hi"} Hope that helps', (False, "Hi")),
+])
+def test_parse_moderated_reply(text, expected):
+    assert parse_moderated_reply(text) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "Thanks!", '{"reply": "Hi"}', '{"offensive": false, "reply": ""}', '{"offensive": false', '["offensive"]',
+])
+def test_unusable_single_call_answers_are_rejected(text):
+    assert parse_moderated_reply(text) is None
+
+
+# ---- Reply modes ----
+
+def test_two_call_mode_classifies_then_replies(model):
+    (text, skip), info = reply()
+    assert (text, skip) == ("Thank you so much for your kind words!", False)
+    assert (info["llm_mode"], info["llm_calls"], info["llm_outcome"]) == ("two_call", 2, "reply")
+    assert "Answer only with 'yes' or 'no'" in model.prompts[0]
+
+
+def test_offensive_comment_gets_no_reply(model):
+    model.answers["Answer only with 'yes' or 'no'"] = "Yes"
+    (text, skip), info = reply()
+    assert (text, skip) == ("", True)
+    assert (info["llm_calls"], info["llm_outcome"]) == (1, "offensive")
+
+
+def test_locally_cleared_comment_skips_classification(model):
+    (_, skip), info = reply(skip_classification=True)
+    assert not skip
+    assert (info["llm_mode"], info["llm_calls"]) == ("reply_only", 1)
+
+
+def test_single_call_mode_makes_one_call(model):
+    model.answers[llm.SINGLE_CALL_MARKER] = json.dumps({"offensive": False, "reply": "Glad you like it!"})
+    (text, skip), info = reply("single_call")
+    assert (text, skip) == ("Glad you like it!", False)
+    assert (info["llm_mode"], info["llm_calls"]) == ("single_call", 1)
+
+
+def test_unparseable_single_call_falls_back_to_two_calls(model):
+    model.answers[llm.SINGLE_CALL_MARKER] = "Glad you like it!"
+    (text, skip), info = reply("single_call")
+    assert not skip
+    assert (info["llm_mode"], info["llm_calls"]) == ("single_call_fallback", 3)
+
+
+def test_generic_replies_are_dropped(model):
+    import main
+    model.answers["Answer only with 'yes' or 'no'"] = "no"
+    model.answers["Comment"] = main.FORBIDDEN_PHRASES[0]
+    (text, skip), info = reply()
+    assert (text, skip, info["llm_outcome"]) == ("", True, "forbidden_phrase")
+
+
+def test_model_errors_mean_no_reply(model):
+    def fail(prompt):
+        raise RuntimeError("quota exceeded")
+
+    model.responder = fail
+    (text, skip), info = reply()
+    assert (text, skip, info["llm_outcome"]) == ("", True, "error")
@@ -0,0 +1,26 @@
+from moderation import LocalModerator, NearDuplicateDetector
+
+PAGE = "100"
+FLOOD = "Visit my page for cheap followers and likes today"
+
+
+def test_near_identical_comments_become_a_flood():
+    detector = NearDuplicateDetector(max_repeats=3)
+    results = [detector.check(PAGE, f"{FLOOD}{'!' * n}", comment_id=str(n)) for n in range(5)]
+    assert results == [False, False, False, True, True]
+    assert not detector.check("101", FLOOD, comment_id="0")
+
+
+def test_rechecking_a_comment_does_not_count_it_again():
+    moderator = LocalModerator(detector=NearDuplicateDetector(max_repeats=3))
+    verdicts = [moderator.check(PAGE, FLOOD, comment_id="200_300")[0] for _ in range(5)]
+    assert verdicts == ["uncertain"] * 5
+    # Three other comments make it a flood, for them and for the original on a retry
+    for n in range(3):
+        moderator.check(PAGE, FLOOD, comment_id=f"200_{n}")
+    assert moderator.check(PAGE, FLOOD, comment_id="200_300") == ("spam", "near-duplicate flood")
+
+
+def test_short_comments_are_never_duplicates():
+    detector = NearDuplicateDetector(max_repeats=1)
+    assert not any(detector.check(PAGE, "Nice!", comment_id=str(n)) for n in range(3))
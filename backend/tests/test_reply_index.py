@@ -0,0 +1,113 @@
+import pytest
+
+import storage
+from reply_index import RepliedCommentIndex, comment_key
+
+PAGE = "100"
+
+
+@pytest.mark.parametrize("comment_id", ["300", "200_300", "100_200_300", 300])
+def test_comment_key_is_the_last_id_segment(comment_id):
+    assert comment_key(comment_id) == "300"
+
+
+def test_every_id_form_matches_the_same_comment():
+    index = RepliedCommentIndex()
+    index.add(PAGE, "100_200_300")
+    assert index.contains(PAGE, "300")
+    assert index.contains(PAGE, "200_300")
+    assert index.contains(PAGE, "100_200_300")
+    assert not index.contains(PAGE, "200_301")
+
+
+def test_pages_are_indexed_separately():
+    index = RepliedCommentIndex()
+    index.add(PAGE, "200_300")
+    assert not index.contains("101", "200_300")
+
+
+def test_add_many_counts_only_new_comments():
+    index = RepliedCommentIndex()
+    assert index.add_many(PAGE, ["200_1", "100_200_1", "2", "", None]) == 2
+    assert index.add_many(PAGE, ["1", "3"]) == 1
+    assert index.size(PAGE) == 3
+    assert storage.load_replied_comment_ids(PAGE) == {"1", "2", "3"}
+
+
+def test_index_survives_a_restart():
+    RepliedCommentIndex().add(PAGE, "100_200_300", reason="already_replied")
+    assert RepliedCommentIndex().contains(PAGE, "200_300")
+
+
+def test_shared_store_sees_comments_added_by_other_processes():
+    local, shared = RepliedCommentIndex(), RepliedCommentIndex(shared_store=True)
+    assert not local.contains(PAGE, "300")
+    assert not shared.contains(PAGE, "300")
+    RepliedCommentIndex().add(PAGE, "200_300")
+    # Without shared_store the page's IDs are only read once
+    assert not local.contains(PAGE, "300")
+    assert shared.contains(PAGE, "100_200_300")
+
+
+def test_sheet_is_only_warmed_once():
+    index = RepliedCommentIndex()
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return {"100_200_300", "100_200_301"}
+
+    assert index.warm_from_sheet(PAGE, "sheet", "Sheet1", loader) == 2
+    assert RepliedCommentIndex().warm_from_sheet(PAGE, "sheet", "Sheet1", loader) == 0
+    assert len(loads) == 1
+    assert index.contains(PAGE, "301")
+
+
+# ---- Already-replied check in the reply pipeline ----
+
+@pytest.fixture
+def check(monkeypatch):
+    import main
+    from records import Comment, Post
+    monkeypatch.setattr(main, "replied_index", RepliedCommentIndex())
+    config = main.FacebookConfig(page_id=PAGE, access_token="token")
+    job = main.reply_job(config, None, None, None, "The Page")
+
+    def check(reply_authors=None, replier_names=None, comment_id="200_300"):
+        monkeypatch.setattr(main, "get_replier_names", lambda comment_id, token: replier_names)
+        comment = Comment(comment_id, "100_200", PAGE, "Nice post", from_id="42", from_name="Alice",
+                          reply_authors=reply_authors)
+        return main.check_comment({"job": job, "post": Post("100_200"), "comment": comment})
+
+    check.index = main.replied_index
+    return check
+
+
+def test_comment_the_page_answered_is_indexed(check):
+    assert check(reply_authors=["Bob", "The Page"]) is None
+    assert check.index.contains(PAGE, "300")
+
+
+def test_truncated_replies_are_checked_remotely(check):
+    assert check(replier_names=["The Page"]) is None
+    assert check.index.contains(PAGE, "300")
+    assert check(replier_names=["Bob"], comment_id="200_301") is not None
+    assert not check.index.contains(PAGE, "301")
+
+
+def test_failed_reply_check_is_retried_not_indexed(check):
+    from graph_api import GraphAPIError
+    with pytest.raises(GraphAPIError):
+        check(replier_names="error")
+    assert not check.index.contains(PAGE, "300")
+
+
+def test_dry_runs_leave_the_shared_checks_alone():
+    import main
+    from dry_run import DryRun
+    config = main.FacebookConfig(page_id=PAGE, access_token="token")
+    live = main.reply_job(config, None, None, None, "The Page")
+    shadow = main.reply_job(config, None, None, None, "The Page", dry_run=DryRun(PAGE))
+    assert (live["moderator"], live["reply_cache"]) == (main.moderator, main.reply_cache)
+    assert shadow["moderator"] is not main.moderator
+    assert shadow["reply_cache"] is not main.reply_cache and not shadow["reply_cache"].persist
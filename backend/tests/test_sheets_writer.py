@@ -0,0 +1,44 @@
+import storage
+from sheets_writer import SheetWriter, credentials_key
+
+CREDENTIALS = {"client_email": "bot@example.iam.gserviceaccount.com"}
+
+
+class Worksheet:
+    def __init__(self):
+        self.rows = []
+
+    def append_rows(self, rows):
+        self.rows.extend(rows)
+
+
+def writer(monkeypatch) -> SheetWriter:
+    """A SheetWriter with no background thread, appending to one in-memory worksheet"""
+    sheet_writer = SheetWriter()
+    sheet_writer.sheet = Worksheet()
+    monkeypatch.setattr(sheet_writer, "start", lambda: None)
+    monkeypatch.setattr(sheet_writer, "worksheet", lambda key, sheet_id, sheet_name: sheet_writer.sheet)
+    return sheet_writer
+
+
+def test_rows_left_by_an_earlier_process_wait_for_their_credentials(monkeypatch):
+    storage.add_sheet_outbox_row("sheet", "Sheet1", credentials_key(CREDENTIALS), ["100_200", "Post"])
+    sheet_writer = writer(monkeypatch)
+    assert sheet_writer.flush() == 0
+    sheet_writer.resume(CREDENTIALS)
+    assert sheet_writer.flush() == 1
+    assert sheet_writer.sheet.rows == [["100_200", "Post"]]
+    assert storage.count_sheet_outbox_rows() == 0
+
+
+def test_failed_appends_stay_in_the_outbox(monkeypatch):
+    sheet_writer = writer(monkeypatch)
+
+    def fail(rows):
+        raise ConnectionError("Sheets unavailable")
+
+    sheet_writer.sheet.append_rows = fail
+    sheet_writer.enqueue(["100_200", "Post"], "sheet", CREDENTIALS, "Sheet1")
+    assert sheet_writer.flush() == 0
+    assert storage.count_sheet_outbox_rows() == 1
+    assert sheet_writer.counts["failed_flushes"] == 1
@@ -0,0 +1,169 @@
+import json
+
+import pytest
+
+import storage
+from webhooks import WebhookQueue, comment_events, sign_payload, verify_signature
+
+SECRET = "app-secret"
+
+
+def feed_change(**value):
+    base = {
+        "item": "comment",
+        "verb": "add",
+        "post_id": "100_200",
+        "comment_id": "200_300",
+        "parent_id": "100_200",
+        "message": "Nice!",
+        "created_time": 1714557600,
+        "from": {"id": "42", "name": "Alice"},
+        "post": {"permalink_url": "https://facebook.com/100/posts/200"},
+    }
+    base.update(value)
+    return {"field": "feed", "value": base}
+
+
+def payload(*changes, page_id="100"):
+    return {"object": "page", "entry": [{"id": page_id, "changes": list(changes)}]}
+
+
+# ---- Signatures ----
+
+def test_valid_signature_is_accepted():
+    body = json.dumps(payload(feed_change())).encode("utf-8")
+    assert verify_signature(body, sign_payload(body, SECRET), SECRET)
+
+
+def test_tampered_body_is_rejected():
+    body = json.dumps(payload(feed_change())).encode("utf-8")
+    signature = sign_payload(body, SECRET)
+    assert not verify_signature(body.replace(b"Nice", b"Mean"), signature, SECRET)
+
+
+def test_wrong_secret_is_rejected():
+    body = b"{}"
+    assert not verify_signature(body, sign_payload(body, "other-secret"), SECRET)
+
+
+def test_missing_or_malformed_signature_is_rejected():
+    body = b"{}"
+    assert not verify_signature(body, None, SECRET)
+    assert not verify_signature(body, "sha1=" + sign_payload(body, SECRET)[len("sha256="):], SECRET)
+
+
+def test_signature_needs_an_app_secret(monkeypatch):
+    monkeypatch.delenv("FB_APP_SECRET", raising=False)
+    body = b"{}"
+    assert not verify_signature(body, sign_payload(body, ""))
+    monkeypatch.setenv("FB_APP_SECRET", SECRET)
+    assert verify_signature(body, sign_payload(body, SECRET))
+
+
+# ---- Comment events ----
+
+def test_new_comment_becomes_an_event_shaped_like_a_crawled_comment():
+    events = list(comment_events(payload(feed_change())))
+    assert events == [{
+        "page_id": "100",
+        "post_id": "100_200",
+        "post_permalink_url": "https://facebook.com/100/posts/200",
+        "comment": {
+            "id": "200_300",
+            "message": "Nice!",
+            "created_time": "2024-05-01T10:00:00+0000",
+            "from": {"id": "42", "name": "Alice"},
+            "reply_authors": [],
+        },
+    }]
+
+
+def test_iso_created_time_is_kept():
+    events = list(comment_events(payload(feed_change(created_time="2024-05-01T10:00:00+0000"))))
+    assert events[0]["comment"]["created_time"] == "2024-05-01T10:00:00+0000"
+
+
+def test_edits_removals_and_other_items_are_ignored():
+    changes = [
+        feed_change(verb="edited"),
+        feed_change(verb="remove"),
+        feed_change(item="reaction"),
+        {"field": "mention", "value": feed_change()["value"]},
+    ]
+    assert list(comment_events(payload(*changes))) == []
+
+
+def test_replies_to_comments_are_ignored():
+    assert list(comment_events(payload(feed_change(parent_id="200_999")))) == []
+
+
+def test_comments_by_the_page_itself_are_ignored():
+    assert list(comment_events(payload(feed_change(**{"from": {"id": "100", "name": "The Page"}})))) == []
+
+
+def test_incomplete_changes_and_other_objects_are_ignored():
+    assert list(comment_events(payload(feed_change(comment_id=None)))) == []
+    assert list(comment_events(payload(feed_change(post_id=None)))) == []
+    assert list(comment_events({"object": "user", "entry": payload(feed_change())["entry"]})) == []
+
+
+def test_one_event_per_new_comment_across_entries():
+    body = {"object": "page", "entry": [
+        {"id": "100", "changes": [feed_change(comment_id="200_1"), feed_change(verb="edited")]},
+        {"id": "101", "changes": [feed_change(post_id="101_5", parent_id="101_5", comment_id="5_2")]},
+    ]}
+    assert [(event["page_id"], event["comment"]["id"]) for event in comment_events(body)] == [("100", "200_1"), ("101", "5_2")]
+
+
+# ---- Queue ----
+
+def test_full_queue_drops_without_blocking():
+    queue = WebhookQueue(maxsize=1)
+    event = next(comment_events(payload(feed_change())))
+    assert queue.put(event)
+    assert not queue.put(event)
+    stats = queue.stats()
+    assert (stats["queued"], stats["dropped"], stats["depth"]) == (1, 1, 1)
+    assert next(queue.events()) == event
+
+
+# ---- Real-time worker ----
+
+@pytest.fixture
+def realtime(monkeypatch):
+    """main's webhook worker wired to a fresh event queue, with page 100 answered in real time"""
+    import main
+    from work_queue import CommentQueue
+    monkeypatch.setattr(main, "webhook_queue", WebhookQueue())
+    monkeypatch.setattr(main, "realtime_queue", CommentQueue(retry_base_seconds=0, retry_max_seconds=0))
+    monkeypatch.setattr(main, "WEBHOOK_RETRY_POLL_SECONDS", 0)
+    monkeypatch.setattr(main, "realtime_pages", {"100": {"page_id": "100"}})
+    return main
+
+
+def test_webhook_comments_are_leased_from_the_durable_queue(realtime):
+    realtime.webhook_queue.put(next(comment_events(payload(feed_change()))))
+    task = next(realtime.webhook_tasks())
+    assert (task["comment"].id, task["post"].id, task["queue_attempts"]) == ("200_300", "100_200", 0)
+    assert task["comment"].permalink_url is None
+    assert storage.comment_task_stats("100")["counts"] == {"in_progress": 1}
+
+
+def test_failed_webhook_comments_are_retried(realtime):
+    tasks = realtime.webhook_tasks()
+    realtime.webhook_queue.put(next(comment_events(payload(feed_change()))))
+    task = next(tasks)
+    realtime.realtime_queue.complete(task, ok=False, error="Graph API down")
+    retried = next(tasks)
+    assert (retried["comment"].id, retried["queue_attempts"]) == ("200_300", 1)
+
+
+def test_comments_a_scheduled_run_holds_are_left_to_it(realtime):
+    from records import Comment, Post
+    from work_queue import CommentQueue
+    scheduled = CommentQueue()
+    scheduled.enqueue("100", [{"post": Post("100_200"), "comment": Comment("200_300", "100_200", "100")}])
+    assert len(list(scheduled.tasks("100", {}, should_stop=lambda: False))) == 1
+    realtime.webhook_queue.put(next(comment_events(payload(feed_change()))))
+    realtime.webhook_queue.put(next(comment_events(payload(feed_change(comment_id="200_301")))))
+    assert next(realtime.webhook_tasks())["comment"].id == "200_301"
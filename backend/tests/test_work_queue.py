@@ -0,0 +1,157 @@
+import pytest
+
+import storage
+from records import Comment, Post
+from work_queue import CommentQueue, dump_task, load_task
+
+PAGE = "100"
+
+
+class Clock:
+    def __init__(self, now: float = 1_700_000_000.0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(storage, "time", clock)
+    return clock
+
+
+def make_tasks(post_id: str = "100_1", count: int = 3):
+    post = Post(post_id, "Post", "2024-05-01T09:00:00+0000")
+    return [
+        {"post": post, "comment": Comment(f"1_{n}", post_id, PAGE, f"comment {n}", f"2024-05-01T10:0{n}:00+0000",
+                                          from_id=str(n), from_name=f"User {n}")}
+        for n in range(count)
+    ]
+
+
+def make_queue(**kwargs) -> CommentQueue:
+    kwargs.setdefault("lease_seconds", 60)
+    return CommentQueue(**kwargs)
+
+
+def lease_all(queue: CommentQueue):
+    return list(queue.tasks(PAGE, {"page_id": PAGE}, should_stop=lambda: False))
+
+
+def test_tasks_round_trip_through_the_store(clock):
+    queue = make_queue()
+    assert queue.enqueue(PAGE, make_tasks()) == 3
+    assert queue.enqueue(PAGE, make_tasks()) == 0  # Already queued
+    leased = lease_all(queue)
+    assert sorted(task["comment"].id for task in leased) == ["1_0", "1_1", "1_2"]
+    # Tasks of one post share a single Post record
+    assert len({id(task["post"]) for task in leased}) == 1
+    assert leased[0]["comment"].full_id.startswith(f"{PAGE}_1_")
+    assert all(task["queue_attempts"] == 0 for task in leased)
+
+
+def test_leased_tasks_are_hidden_until_the_lease_expires(clock):
+    first, second = make_queue(), make_queue()
+    first.enqueue(PAGE, make_tasks())
+    assert len(lease_all(first)) == 3
+    # The first worker died without finishing; nothing is available while its lease holds
+    clock.now += 59
+    assert lease_all(second) == []
+    clock.now += 2
+    taken_over = lease_all(second)
+    assert len(taken_over) == 3
+    assert storage.comment_task_stats(PAGE)["counts"] == {"in_progress": 3}
+
+
+def test_finished_tasks_are_not_leased_again(clock):
+    queue = make_queue()
+    queue.enqueue(PAGE, make_tasks())
+    replied, skipped, pending = lease_all(queue)
+    replied["posted"] = True
+    queue.complete(replied, ok=False)  # Posted, then a later stage failed: still counts as replied
+    queue.complete(skipped, ok=True)
+    clock.now += 3600
+    assert [task["comment"].id for task in lease_all(queue)] == [pending["comment"].id]
+    counts = storage.comment_task_stats(PAGE)["counts"]
+    assert (counts["replied"], counts["skipped"]) == (1, 1)
+
+
+def test_failed_tasks_are_retried_after_backoff(clock):
+    queue = make_queue(retry_base_seconds=10, retry_max_seconds=1000)
+    queue.enqueue(PAGE, make_tasks(count=1))
+    task, = lease_all(queue)
+    queue.complete(task, ok=False, error="Graph API down")
+    # Backoff is 50-100% of base * 2^attempts
+    clock.now += 4
+    assert lease_all(queue) == []
+    clock.now += 7
+    task, = lease_all(queue)
+    assert task["queue_attempts"] == 1
+    assert queue.counts["retried"] == 1
+
+
+def test_retries_check_the_live_replies_again(clock):
+    queue = make_queue(retry_base_seconds=10)
+    tasks = make_tasks(count=2)
+    for task in tasks:
+        task["comment"].reply_authors = ["Bob"]
+    queue.enqueue(PAGE, tasks)
+    failed, attempted = lease_all(queue)
+    assert failed["comment"].reply_authors == ["Bob"]
+    queue.complete(failed, ok=False, error="Graph API down")
+    # The post timed out: Facebook may have stored the reply anyway
+    attempted.update({"post_attempted": True, "reply_text": "Thanks!"})
+    queue.complete(attempted, ok=False, error="Read timed out")
+    clock.now += 3600
+    retried = {task["comment"].id: task for task in lease_all(queue)}
+    assert all(task["comment"].reply_authors is None for task in retried.values())
+    assert retried[attempted["comment"].id]["post_attempted"]
+    assert retried[attempted["comment"].id]["queue_attempts"] == 1
+
+
+def test_llm_failures_are_retried(clock):
+    queue = make_queue(retry_base_seconds=10)
+    queue.enqueue(PAGE, make_tasks(count=1))
+    task, = lease_all(queue)
+    task["llm_outcome"] = "error"
+    queue.complete(task, ok=True)
+    clock.now += 3600
+    assert len(lease_all(queue)) == 1
+
+
+def test_tasks_fail_for_good_after_max_attempts(clock):
+    queue = make_queue(max_attempts=2, retry_base_seconds=1, retry_max_seconds=1)
+    queue.enqueue(PAGE, make_tasks(count=1))
+    for _ in range(2):
+        task, = lease_all(queue)
+        queue.complete(task, ok=False)
+        clock.now += 10
+    assert lease_all(queue) == []
+    assert storage.comment_task_stats(PAGE)["counts"] == {"failed": 1}
+    assert queue.counts["failed"] == 1
+
+    assert queue.requeue_failed(PAGE) == 1
+    task, = lease_all(queue)
+    assert task["queue_attempts"] == 0
+
+
+def test_release_hands_tasks_back_without_counting_an_attempt(clock):
+    queue = make_queue()
+    queue.enqueue(PAGE, make_tasks())
+    assert len(lease_all(queue)) == 3
+    assert queue.release(PAGE) == 3
+    assert all(task["queue_attempts"] == 0 for task in lease_all(queue))
+
+
+def test_legacy_flat_tasks_still_load():
+    data = {
+        "post_id": "100_1", "post_message": "Post", "post_permalink_url": "https://facebook.com/p",
+        "post_time": "2024-05-01T09:00:00+0000",
+        "comment": {"id": "1_5", "message": "Hi", "from": {"id": "7", "name": "Bo"}, "reply_authors": []},
+    }
+    task = load_task(data, PAGE, {})
+    assert task["post"].permalink_url == "https://facebook.com/p"
+    assert (task["comment"].post_id, task["comment"].from_name) == ("100_1", "Bo")
+    assert dump_task({**task, "job": object()})["post"]["id"] == "100_1"
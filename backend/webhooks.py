@@ -0,0 +1,117 @@
+import hashlib
+import hmac
+import logging
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+
+
+def verify_token() -> str:
+    # Read on use so values from .env (loaded after the imports in main.py) are picked up
+    return os.getenv("FB_WEBHOOK_VERIFY_TOKEN", "")
+
+
+def verify_signature(body: bytes, signature_header: Optional[str], app_secret: Optional[str] = None) -> bool:
+    """Check the X-Hub-Signature-256 header ("sha256=<hex>") against an HMAC of the raw body"""
+    app_secret = app_secret if app_secret is not None else os.getenv("FB_APP_SECRET", "")
+    if not app_secret or not signature_header or not signature_header.startswith("sha256="):
+        return False
+    expected = hmac.new(app_secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature_header[len("sha256="):])
+
+
+def sign_payload(body: bytes, app_secret: str) -> str:
+    return "sha256=" + hmac.new(app_secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+
+def graph_time(value: Any) -> str:
+    """Webhooks send created_time as a unix timestamp; the Graph API returns ISO strings"""
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S+0000")
+    return value or ""
+
+
+def comment_events(payload: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """
+    Yield one event per new top-level comment in a page `feed` webhook payload, shaped like
+    the comments the crawl returns. Edits, removals, replies to comments and comments
+    written by the page itself are left out.
+    """
+    if payload.get("object") != "page":
+        return
+    for entry in payload.get("entry", []):
+        page_id = str(entry.get("id", ""))
+        for change in entry.get("changes", []):
+            value = change.get("value", {})
+            if change.get("field") != "feed" or value.get("item") != "comment" or value.get("verb") != "add":
+                continue
+            post_id = value.get("post_id")
+            if not post_id or not value.get("comment_id") or value.get("parent_id", post_id) != post_id:
+                continue
+            author = value.get("from", {})
+            if str(author.get("id", "")) == page_id:
+                continue
+            post = value.get("post", {})
+            yield {
+                "page_id": page_id,
+                "post_id": post_id,
+                "post_permalink_url": post.get("permalink_url"),
+                "comment": {
+                    "id": value["comment_id"],
+                    "message": value.get("message", ""),
+                    "created_time": graph_time(value.get("created_time")),
+                    "from": {"id": str(author.get("id", "")), "name": author.get("name", "Anonymous")},
+                    # The event has no comment link and the post's would point at the wrong thing
+                    # A comment that was just added has no replies yet
+                    "reply_authors": []
+                }
+            }
+
+
+class WebhookQueue:
+    """
+    Bounded hand-off between the /webhook endpoint and the real-time reply worker.
+    The endpoint must answer Facebook quickly, so put() never blocks: when the queue is
+    full the event is dropped and counted, and the next scheduled crawl picks it up.
+    """
+
+    def __init__(self, maxsize: int = WEBHOOK_QUEUE_SIZE):
+        self._queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self.counts = {"received": 0, "queued": 0, "ignored": 0, "dropped": 0, "rejected": 0}
+
+    def count(self, key: str, amount: int = 1):
+        with self._lock:
+            self.counts[key] += amount
+
+    def put(self, event: Dict[str, Any]) -> bool:
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.count("dropped")
+            logger.warning(f"Webhook queue full, dropping comment {event['comment']['id']}")
+            return False
+        self.count("queued")
+        return True
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """The next event, or None if none arrives within `timeout` seconds"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def events(self) -> Iterator[Dict[str, Any]]:
+        """Block for queued events forever; meant to feed a long-running pipeline"""
+        while True:
+            yield self._queue.get()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.counts, "depth": self._queue.qsize(), "max_depth": self._queue.maxsize}
@@ -0,0 +1,238 @@
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import metrics
+import storage
+from priority import PRIORITY_REFRESH_SECONDS, CommentPrioritizer, graph_timestamp
+from records import Comment, Post
+
+logger = logging.getLogger(__name__)
+
+WORK_QUEUE_LEASE_SECONDS = float(os.getenv("WORK_QUEUE_LEASE_SECONDS", "900"))
+WORK_QUEUE_MAX_ATTEMPTS = int(os.getenv("WORK_QUEUE_MAX_ATTEMPTS", "5"))
+WORK_QUEUE_RETRY_BASE_SECONDS = float(os.getenv("WORK_QUEUE_RETRY_BASE_SECONDS", "60"))
+WORK_QUEUE_RETRY_MAX_SECONDS = float(os.getenv("WORK_QUEUE_RETRY_MAX_SECONDS", "3600"))
+WORK_QUEUE_RETENTION_DAYS = float(os.getenv("WORK_QUEUE_RETENTION_DAYS", "30"))
+
+# Keys that are rebuilt for every run and must not be stored with the task
+TRANSIENT_KEYS = ("job",)
+
+
+def dump_task(task: Dict[str, Any]) -> Dict[str, Any]:
+    """JSON-ready copy of a task for the queue, with its Post and Comment records as dicts"""
+    data = {k: v for k, v in task.items() if k not in TRANSIENT_KEYS}
+    data["post"] = task["post"].to_dict()
+    data["comment"] = task["comment"].to_dict()
+    return data
+
+
+def load_task(data: Dict[str, Any], page_id: str, posts: Dict[str, Post]) -> Dict[str, Any]:
+    """
+    Rebuild a stored task. `posts` holds the Post records already loaded, so tasks of the
+    same post share one. Tasks queued before records existed kept the post fields flat.
+    """
+    post = data.get("post") or {
+        "id": data.pop("post_id"), "message": data.pop("post_message", None),
+        "permalink_url": data.pop("post_permalink_url", None), "created_time": data.pop("post_time", None)
+    }
+    record = posts.get(post["id"])
+    if record is None:
+        record = posts[post["id"]] = Post(**post)
+    data["post"] = record
+    data["comment"] = Comment.from_graph(data["comment"], record.id, page_id)
+    return data
+
+
+class CommentQueue:
+    """
+    Durable queue of comment tasks in the local SQLite store, so a run that is stopped,
+    times out or crashes resumes with the comments it had not finished.
+
+    A worker leases tasks for `lease_seconds`; a lease that runs out (the process died)
+    makes the task available again. Failed attempts are retried with exponential backoff
+    until `max_attempts`, after which the task stays failed until requeued by hand.
+
+    Tasks are leased highest priority first (see CommentPrioritizer). Priorities are
+    recomputed when a run starts leasing, when its crawl finishes and every
+    `refresh_seconds` after that.
+    """
+
+    def __init__(self, lease_seconds: float = WORK_QUEUE_LEASE_SECONDS, max_attempts: int = WORK_QUEUE_MAX_ATTEMPTS,
+                 retry_base_seconds: float = WORK_QUEUE_RETRY_BASE_SECONDS,
+                 retry_max_seconds: float = WORK_QUEUE_RETRY_MAX_SECONDS,
+                 prioritizer: Optional[CommentPrioritizer] = None, refresh_seconds: float = PRIORITY_REFRESH_SECONDS):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.prioritizer = prioritizer or CommentPrioritizer()
+        self.refresh_seconds = refresh_seconds
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self.counts = {"enqueued": 0, "leased": 0, "replied": 0, "skipped": 0, "retried": 0, "failed": 0, "released": 0}
+        self.windows: Dict[str, Dict[str, Any]] = {}  # page_id -> report on the end of its last run
+
+    def _count(self, key: str, amount: int = 1):
+        with self._lock:
+            self.counts[key] += amount
+
+    def enqueue(self, page_id: str, tasks: List[Dict[str, Any]], engagement: Optional[int] = None) -> int:
+        """
+        Queue one post's new comments, given as tasks holding the Post and Comment records;
+        engagement is the post's comment count (defaults to len(tasks))
+        """
+        engagement = len(tasks) if engagement is None else engagement
+        rows = [
+            (task["comment"].id, task["post"].id, dump_task(task), graph_timestamp(task["comment"].created_time),
+             engagement)
+            for task in tasks
+        ]
+        added = storage.enqueue_comment_tasks(page_id, rows) if rows else 0
+        self._count("enqueued", added)
+        return added
+
+    def prioritize(self, page_id: str) -> int:
+        """Rescore the page's queued tasks; returns how many were scored"""
+        priorities = self.prioritizer.prioritize(storage.get_comment_priority_inputs(page_id))
+        storage.set_comment_priorities(priorities)
+        return len(priorities)
+
+    def tasks(self, page_id: str, job: Dict[str, Any], should_stop: Callable[[], bool],
+              batch_size: int = 50, more: Optional[Callable[[], bool]] = None,
+              poll_seconds: float = 0.2) -> Iterator[Dict[str, Any]]:
+        """
+        Lease due tasks for the page batch by batch, highest priority first, until none are
+        left or the run stops. `more` says whether a crawl is still adding tasks: while it
+        returns True an empty queue is polled every `poll_seconds` instead of ending the run.
+        Tasks queued mid-crawl are leased in crawl order until the crawl ends and they are scored.
+        """
+        more = more or (lambda: False)
+        refreshed_at = None
+        crawling = more()
+        while not should_stop():
+            crawl_ended = crawling and not more()
+            crawling = crawling and not crawl_ended
+            if crawl_ended or refreshed_at is None or time.monotonic() - refreshed_at >= self.refresh_seconds:
+                scored = self.prioritize(page_id)
+                refreshed_at = time.monotonic()
+                logger.info(f"Prioritized {scored} queued comments for page {page_id}")
+            leased = self.lease(page_id, job, batch_size)
+            if not leased:
+                if not crawling:
+                    return
+                time.sleep(poll_seconds)
+                continue
+            yield from leased
+
+    def lease(self, page_id: str, job: Dict[str, Any], limit: int, comment_ids: Optional[List[str]] = None,
+              min_attempts: int = 0) -> List[Dict[str, Any]]:
+        """
+        Lease up to `limit` due tasks of the page in their current priority order, without
+        rescoring; comment_ids and min_attempts narrow the claim (see lease_comment_tasks)
+        """
+        leased = storage.lease_comment_tasks(page_id, self.owner, limit, self.lease_seconds, comment_ids, min_attempts)
+        self._count("leased", len(leased))
+        posts = {}
+        tasks = []
+        for comment_id, data, attempts in leased:
+            task = load_task(data, page_id, posts)
+            task.update({"job": job, "queue_attempts": attempts})
+            if attempts or task.get("post_attempted"):
+                # An earlier attempt failed, maybe after its reply reached Facebook: the
+                # stored reply authors cannot be trusted, so check the live replies again
+                task["comment"].reply_authors = None
+            tasks.append(task)
+        return tasks
+
+    def backoff(self, attempts: int) -> float:
+        return random.uniform(0.5, 1.0) * min(self.retry_max_seconds, self.retry_base_seconds * 2 ** attempts)
+
+    def complete(self, task: Dict[str, Any], ok: bool, error: Optional[str] = None):
+        """
+        Record how a leased task left the pipeline. A posted reply counts as replied even if
+        a later stage failed, so it is never retried into a second reply. A post that failed
+        may still have reached Facebook (a timeout or a 5xx), so the task is stored as
+        post_attempted and its retry checks the live replies before posting again.
+        """
+        comment_id = task["comment"].id
+        if task.get("posted"):
+            storage.finish_comment_task(comment_id, "replied")
+            self._count("replied")
+        elif ok and task.get("llm_outcome") != "error":
+            storage.finish_comment_task(comment_id, "skipped")
+            self._count("skipped")
+        else:
+            error = error or ("LLM call failed" if ok else "pipeline stage failed")
+            stored = None
+            if task.get("post_attempted"):
+                error = f"reply post failed, may have been posted: {error}"
+                stored = dump_task({k: v for k, v in task.items() if k != "queue_attempts"})
+            state = storage.retry_comment_task(
+                comment_id, self.backoff(task.get("queue_attempts", 0)), error, self.max_attempts, task=stored
+            )
+            self._count("failed" if state == "failed" else "retried")
+            if state == "failed":
+                logger.error(f"Giving up on comment {comment_id} after {self.max_attempts} attempts: {error}")
+
+    def release(self, page_id: str) -> int:
+        released = storage.release_comment_tasks(page_id, self.owner)
+        self._count("released", released)
+        return released
+
+    def window_report(self, page_id: str, ended_by: str, processed: int) -> Dict[str, Any]:
+        """
+        Record what a run left behind when its window ended: ended_by is "drained",
+        "duration" or "stopped", processed the comments it worked on
+        """
+        stored = storage.comment_task_stats(page_id)
+        counts = stored["counts"]
+        unprocessed = counts.get("queued", 0) + counts.get("in_progress", 0)
+        now = time.time()
+        report = {
+            "ended_at": datetime.now().isoformat(),
+            "ended_by": ended_by,
+            "processed": processed,
+            "unprocessed": unprocessed,
+            "unprocessed_due": stored["due"],
+            "top_backlog_posts": [
+                {
+                    "post_id": post_id,
+                    "unprocessed": pending,
+                    "oldest_comment_age_hours": round((now - oldest) / 3600, 1) if oldest else None
+                }
+                for post_id, pending, oldest in storage.comment_task_backlog(page_id)
+            ]
+        }
+        with self._lock:
+            self.windows[page_id] = report
+        metrics.comments_unprocessed.set(unprocessed, page_id=page_id)
+        return report
+
+    def purge(self, retention_days: float = WORK_QUEUE_RETENTION_DAYS) -> int:
+        return storage.purge_comment_tasks(time.time() - retention_days * 86400)
+
+    def requeue_failed(self, page_id: str) -> int:
+        return storage.requeue_failed_comment_tasks(page_id)
+
+    def stats(self, page_id: Optional[str] = None) -> Dict[str, Any]:
+        stored = storage.comment_task_stats(page_id)
+        counts = stored["counts"]
+        oldest = stored["oldest_queued_at"]
+        with self._lock:
+            return {
+                "states": {state: counts.get(state, 0) for state in ("queued", "in_progress", "replied", "skipped", "failed")},
+                "last_window": self.windows.get(page_id) if page_id else dict(self.windows),
+                "priority": self.prioritizer.describe(),
+                "depth": counts.get("queued", 0) + counts.get("in_progress", 0),
+                "due": stored["due"],
+                "oldest_queued_seconds": round(time.time() - oldest, 1) if oldest else None,
+                "process_counts": dict(self.counts),
+                "owner": self.owner
+            }
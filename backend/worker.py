@@ -0,0 +1,87 @@
+"""
+Runs the daily jobs for one shard of pages in its own process.
+
+    python worker.py --shard 0 --shards 4
+
+The API process starts one of these per shard when JOB_WORKER_PROCESSES is set. Pages are
+assigned to shards by consistent hashing on page_id; the schedules themselves live in the
+local SQLite store, which every worker re-reads every --sync-seconds.
+"""
+import argparse
+import logging
+import signal
+import threading
+
+import main
+import metrics
+from rate_limit import rate_limiter
+from scheduler import JobScheduler, ScheduledJob
+from sharding import HashRing, page_lease
+
+logger = logging.getLogger("worker")
+
+
+def job_page_id(job: ScheduledJob) -> str:
+    return job.settings["config"]["page_id"]
+
+
+def run(shard: int, shards: int, sync_seconds: float, metrics_port: int = 0):
+    ring = HashRing(shards)
+    owner = main.comment_queue.owner
+    # The API process (webhooks) and earlier owners of a page write to the same reply index
+    main.replied_index.shared_store = True
+    # The API process and every shard draw on the same quotas
+    rate_limiter.set_shares(shards + 1)
+
+    def run_leased(job: ScheduledJob):
+        page_id = job_page_id(job)
+        with page_lease(page_id, owner) as leased:
+            if not leased:
+                logger.warning(f"Job {job.job_id}: page {page_id} is being handled by another process, skipping")
+                return
+            # Settings may have been changed through the API process since the last run
+            main.page_settings.reload()
+            main.daily_job_runner(job)
+
+    scheduler = JobScheduler(
+        run_leased, main.get_next_dhaka_time,
+        owns=lambda job: ring.shard_for(job_page_id(job)) == shard
+    )
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    if metrics_port:
+        metrics.serve(metrics_port)
+        logger.info(f"Worker {shard}/{shards} serving metrics on port {metrics_port}")
+    logger.info(f"Worker {shard}/{shards} started as {owner} with 1/{rate_limiter.shares} of each rate limit")
+    while True:
+        try:
+            # Limits changed through the API process apply here from the next sync
+            rate_limiter.reload()
+            added, removed = scheduler.sync()
+            if added or removed:
+                owned = [job.job_id for job in scheduler.jobs() if scheduler.owns(job)]
+                logger.info(f"Worker {shard}/{shards}: {added} jobs added, {removed} removed, owning {owned}")
+        except Exception as e:
+            logger.error(f"Worker {shard}/{shards}: could not sync schedules: {e}")
+        if stop.wait(sync_seconds):
+            break
+
+    logger.info(f"Worker {shard}/{shards} stopping")
+    scheduler.shutdown(wait=True)
+    main.sheet_writer.flush()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shard", type=int, required=True)
+    parser.add_argument("--shards", type=int, required=True)
+    parser.add_argument("--sync-seconds", type=float, default=5.0)
+    parser.add_argument("--metrics-port", type=int, default=0, help="Serve /metrics on this port (0 = off)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run(args.shard, args.shards, args.sync_seconds, args.metrics_port)